@@ -0,0 +1,333 @@
+"""End-to-end benchmark suite that runs offline on a CPU-only box.
+
+Generates a synthetic PDF corpus in a scratch directory, then measures:
+
+* ingest throughput per stage (load_documents, split_documents, embed_and_save)
+* index startup time and resident memory (load_all_indexes)
+* retriever latency p50/p95/p99, for new and for repeated queries
+* end-to-end RetrievalQA latency against a deterministic stand-in for Ollama
+
+Results are written as JSON so runs can be compared across commits::
+
+    python app/benchmark.py --docs 50 --pages 20 --output before.json
+    python app/benchmark.py --docs 50 --pages 20 --output after.json --compare before.json
+
+By default chunks are embedded with a local hashing model (no download);
+pass ``--embedding-model`` with a small sentence-transformers model name or
+local path to benchmark real embeddings.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+import embedding_registry
+import index_store
+from ingest import DATA_DIR, embed_and_save, load_documents, split_documents
+from logger import logging
+from qa_pipeline import build_qa_chain, load_all_indexes
+
+VOCABULARY = (
+    "policy employee leave benefit security access laptop vpn travel expense approval manager "
+    "onboarding payroll holiday remote office badge password incident escalation compliance audit "
+    "training contractor reimbursement equipment procurement invoice vendor retention privacy"
+).split()
+
+
+# --- Synthetic corpus ---------------------------------------------------------
+
+def _pdf_text_page(lines):
+    escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+    return ("BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({line}) '" for line in escaped) + " ET").encode("latin-1")
+
+
+def write_pdf(path, pages):
+    """Write a minimal text PDF; ``pages`` is a list of line lists."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        stream = _pdf_text_page(lines)
+        page_id, content_id = len(objects) + 1, len(objects) + 2
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(page_id)
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def make_corpus(data_dir, n_docs, pages_per_doc, lines_per_page=40, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    for d in range(n_docs):
+        pages = []
+        for p in range(pages_per_doc):
+            lines = [
+                " ".join(rng.choice(VOCABULARY) for _ in range(12)) + f" ref POL-{d:03d}-{p:03d}-{line:02d}."
+                for line in range(lines_per_page)
+            ]
+            pages.append(lines)
+        write_pdf(os.path.join(data_dir, f"synthetic_{d:04d}.pdf"), pages)
+
+
+def make_queries(n, seed=1):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(VOCABULARY) for _ in range(6)) + "?" for _ in range(n)]
+
+
+# --- Stand-ins ----------------------------------------------------------------
+
+class StubLLM(LLM):
+    """Deterministic local stand-in for Ollama with configurable latency.
+
+    Answers with the first ``answer_tokens`` words of the prompt's context after
+    a fixed prefill delay, then one delay per generated token.
+    """
+
+    prefill_ms: float = 50.0
+    token_ms: float = 5.0
+    answer_tokens: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _tokens(self, prompt):
+        context = prompt.split("Context:", 1)[-1]
+        return [word + " " for word in context.split()[: self.answer_tokens]]
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any):
+        time.sleep(self.prefill_ms / 1000)
+        for token in self._tokens(prompt):
+            time.sleep(self.token_ms / 1000)
+            yield GenerationChunk(text=token)
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt))
+
+
+def install_embeddings(model):
+    """Register the embedding model every code path will get from the registry."""
+    if model == "hash":
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+
+        embedding_registry.register_embeddings(embedding_registry.EMBEDDING_MODEL, DeterministicFakeEmbedding(size=384))
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        embedding_registry.register_embeddings(embedding_registry.EMBEDDING_MODEL, HuggingFaceEmbeddings(model_name=model))
+
+
+# --- Measurements -------------------------------------------------------------
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(samples_s):
+    ms = np.array(samples_s) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def bench_ingest(data_dir):
+    pdfs = sorted(f for f in os.listdir(data_dir) if f.endswith(".pdf"))
+    load_s = split_s = 0.0
+    pages = 0
+    parsed = []
+    for pdf in pdfs:
+        t0 = time.perf_counter()
+        docs = load_documents(os.path.join(data_dir, pdf))
+        t1 = time.perf_counter()
+        chunks = split_documents(docs, pdf)
+        t2 = time.perf_counter()
+        load_s += t1 - t0
+        split_s += t2 - t1
+        pages += len(docs)
+        parsed.append((pdf, chunks))
+    n_chunks = sum(len(chunks) for _, chunks in parsed)
+
+    store = index_store.get_index_store()
+    t0 = time.perf_counter()
+    with store.transaction():
+        for pdf, chunks in parsed:
+            embed_and_save(chunks, pdf, save=False)
+        embed_s = time.perf_counter() - t0
+        store.save()
+    save_s = time.perf_counter() - t0 - embed_s
+
+    # Same chunks again: every vector now comes from the embedding cache.
+    t0 = time.perf_counter()
+    with store.transaction():
+        for pdf, chunks in parsed:
+            embed_and_save(chunks, pdf, save=False)
+    cached_embed_s = time.perf_counter() - t0
+
+    return {
+        "documents": len(pdfs),
+        "pages": pages,
+        "chunks": n_chunks,
+        "load_documents": {"seconds": load_s, "pages_per_s": pages / load_s},
+        "split_documents": {"seconds": split_s, "chunks_per_s": n_chunks / split_s},
+        "embed_and_save": {"seconds": embed_s, "chunks_per_s": n_chunks / embed_s},
+        "embed_and_save_cached": {"seconds": cached_embed_s, "chunks_per_s": n_chunks / cached_embed_s},
+        "index_save": {"seconds": save_s},
+    }
+
+
+def bench_startup():
+    # Drop the in-process store so the index is read from disk like a fresh process would.
+    index_store._store = None
+    before = rss_mb()
+    t0 = time.perf_counter()
+    retriever = load_all_indexes()
+    seconds = time.perf_counter() - t0
+    return retriever, {
+        "seconds": seconds,
+        "rss_delta_mb": rss_mb() - before,
+        "vectors": retriever.store.db.index.ntotal,
+    }
+
+
+def bench_retrieval(retriever, queries):
+    cold = []
+    for query in queries:
+        t0 = time.perf_counter()
+        retriever.invoke(query)
+        cold.append(time.perf_counter() - t0)
+    warm = []
+    for query in queries:
+        t0 = time.perf_counter()
+        retriever.invoke(query)
+        warm.append(time.perf_counter() - t0)
+    return {"uncached": percentiles(cold), "cached": percentiles(warm)}
+
+
+def bench_end_to_end(retriever, queries, llm):
+    chain = build_qa_chain(retriever, llm)
+    samples = []
+    for query in queries:
+        t0 = time.perf_counter()
+        chain.invoke({"query": query})
+        samples.append(time.perf_counter() - t0)
+    result = percentiles(samples)
+    result["llm_floor_ms"] = llm.prefill_ms + llm.token_ms * llm.answer_tokens
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    """Print relative changes of every numeric leaf against an earlier result file."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def walk(new, old, prefix=""):
+        for key, value in new.items():
+            if key == "meta" or key not in old:
+                continue
+            if isinstance(value, dict):
+                walk(value, old[key], f"{prefix}{key}.")
+            elif isinstance(value, (int, float)) and old[key]:
+                name = prefix + key
+                print(f"  {name:<48} {old[key]:>12.3f} -> {value:>12.3f} ({(value - old[key]) / old[key]:+.1%})")
+
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('meta', {}).get('commit')}):")
+    walk(current, baseline)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingest, startup, retrieval and end-to-end QA offline.")
+    parser.add_argument("--docs", type=int, default=20, help="Synthetic PDFs to generate.")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per synthetic PDF.")
+    parser.add_argument("--queries", type=int, default=200, help="Retrieval queries to time.")
+    parser.add_argument("--qa-queries", type=int, default=20, help="End-to-end RetrievalQA queries to time.")
+    parser.add_argument("--embedding-model", default="hash", help="'hash' for a local hashing model, or a sentence-transformers name/path.")
+    parser.add_argument("--llm-prefill-ms", type=float, default=50.0)
+    parser.add_argument("--llm-token-ms", type=float, default=5.0)
+    parser.add_argument("--workdir", default=None, help="Scratch directory (default: a new temp dir).")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory.")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None, help="Earlier result file to diff against.")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="copilot-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # index/, data/ and cache/ are all relative to the working directory
+
+    install_embeddings(args.embedding_model)
+    make_corpus(DATA_DIR, args.docs, args.pages)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        }
+    }
+    print(f"Benchmarking in '{workdir}' with {args.docs} PDF(s) x {args.pages} page(s)...")
+    results["ingest"] = bench_ingest(DATA_DIR)
+    retriever, results["startup"] = bench_startup()
+    queries = make_queries(args.queries)
+    results["retrieval"] = bench_retrieval(retriever, queries)
+    llm = StubLLM(prefill_ms=args.llm_prefill_ms, token_ms=args.llm_token_ms)
+    results["end_to_end"] = bench_end_to_end(retriever, make_queries(args.qa_queries, seed=2), llm)
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    logging.info(f"Benchmark results written to '{output}'.")
+    print(json.dumps({k: v for k, v in results.items() if k != "meta"}, indent=2))
+    print(f"\nResults written to '{output}'.")
+
+    if baseline:
+        compare(results, baseline)
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,119 @@
+"""Pack retrieved chunks into the prompt context under a token budget.
+
+Chunks from the same source and page are merged where they overlap or touch,
+so text shared through ``chunk_overlap`` is sent once. The merged passages
+are then added in relevance order until ``CONTEXT_TOKEN_BUDGET`` is reached,
+each under a ``(Source: ..., Page: ...)`` line so the model can cite it.
+
+Token counts are estimates (about four characters per token for llama3 on
+English text); the budget is a prefill-time control, not an exact limit.
+"""
+import math
+
+from langchain_core.documents import Document
+
+CONTEXT_TOKEN_BUDGET = 1500
+CHARS_PER_TOKEN = 4
+MIN_PARTIAL_TOKENS = 100  # smaller leftovers of the budget are not worth a truncated passage
+MIN_TEXT_OVERLAP = 20
+MAX_TEXT_OVERLAP = 200
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _text_overlap(first, second):
+    """Length of the longest suffix of ``first`` that starts ``second`` (0 if under MIN_TEXT_OVERLAP)."""
+    for size in range(min(len(first), len(second), MAX_TEXT_OVERLAP), MIN_TEXT_OVERLAP - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+def _merge_group(chunks):
+    """Merge one page's ``(rank, doc)`` chunks into passages; returns ``[(rank, text, metadata)]``."""
+    if all("start_index" in doc.metadata for _, doc in chunks):
+        # Offsets recorded by the splitter give exact overlaps.
+        ordered = sorted(chunks, key=lambda item: item[1].metadata["start_index"])
+        passages = []
+        for rank, doc in ordered:
+            start = doc.metadata["start_index"]
+            end = start + len(doc.page_content)
+            if passages and start <= passages[-1][3]:
+                best, text, metadata, last_end = passages[-1]
+                if end > last_end:
+                    text += doc.page_content[last_end - start:]
+                passages[-1] = [min(best, rank), text, metadata, max(end, last_end)]
+            else:
+                passages.append([rank, doc.page_content, doc.metadata, end])
+        return [(rank, text, metadata) for rank, text, metadata, _ in passages]
+
+    # Older chunks carry no offsets; join runs whose text overlaps.
+    passages = []
+    for rank, doc in chunks:
+        text = doc.page_content
+        for passage in passages:
+            if text in passage[1]:
+                passage[0] = min(passage[0], rank)
+                break
+            overlap = _text_overlap(passage[1], text)
+            if overlap:
+                passage[0], passage[1] = min(passage[0], rank), passage[1] + text[overlap:]
+                break
+            overlap = _text_overlap(text, passage[1])
+            if overlap:
+                passage[0], passage[1] = min(passage[0], rank), text + passage[1][overlap:]
+                break
+        else:
+            passages.append([rank, text, doc.metadata])
+    return [tuple(passage) for passage in passages]
+
+
+def citations(metadata):
+    """``(source, page)`` pairs for a chunk; near-duplicates collapsed at ingest carry several."""
+    return [(cited.get("source", "Unknown"), cited.get("page", "?")) for cited in metadata.get("citations") or [metadata]]
+
+
+def citation(metadata):
+    return "(" + "; ".join(f"Source: {source}, Page: {page}" for source, page in citations(metadata)) + ")"
+
+
+def pack_documents(docs, budget=CONTEXT_TOKEN_BUDGET):
+    """Merge overlapping chunks and keep the most relevant passages that fit ``budget``.
+
+    ``docs`` are in relevance order. Returns ``(passages, stats)``; each passage
+    is a Document whose metadata is that of its first chunk on the page.
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        groups.setdefault(key, []).append((rank, doc))
+    merged = sorted(
+        (passage for chunks in groups.values() for passage in _merge_group(chunks)), key=lambda passage: passage[0]
+    )
+
+    packed, used = [], 0
+    for _, text, metadata in merged:
+        cost = estimate_tokens(citation(metadata)) + estimate_tokens(text)
+        if used + cost > budget:
+            room = budget - used - estimate_tokens(citation(metadata))
+            if room < MIN_PARTIAL_TOKENS:
+                continue
+            text = text[:room * CHARS_PER_TOKEN].rsplit(" ", 1)[0] + " ..."
+            cost = estimate_tokens(citation(metadata)) + estimate_tokens(text)
+        packed.append(Document(page_content=text, metadata=metadata))
+        used += cost
+
+    stats = {
+        "chunks": len(docs),
+        "passages": len(packed),
+        "dropped": len(merged) - len(packed),
+        "chunk_chars": sum(len(doc.page_content) for doc in docs),
+        "context_tokens": used,
+    }
+    return packed, stats
+
+
+def format_context(passages):
+    return "\n\n".join(f"{citation(doc.metadata)}\n{doc.page_content}" for doc in passages)
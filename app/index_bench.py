@@ -0,0 +1,116 @@
+"""Compare FAISS index specs on recall@k, query latency and index size.
+
+Recall is measured against an exact flat index built over the same vectors.
+Queries are a random sample of the corpus vectors that is held out of the
+indexes, so no query can trivially find itself. Specs with ``rescore=N``
+re-sort N candidates by exact distance; the float32 vectors are read from
+memory here rather than from the docstore, so that read is not in the timings.
+
+    python index_bench.py --specs Flat "IVF256,Flat;nprobe=16" "HNSW32;efSearch=64" "IVF256,PQ16;nprobe=16"
+    python index_bench.py --specs Flat SQfp16 SQ8 "SQ8;rescore=40"
+    python index_bench.py --synthetic 200000 --dim 384 --specs "HNSW32;efSearch=64"
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+from filters import Selection
+from index_specs import build_index, index_size_bytes, rescore_depth
+from logger import logging
+
+FILTER_FRACTION = 0.3
+
+
+def corpus_from_index():
+    from index_store import get_index_store
+
+    store = get_index_store()
+    if store.load() is None:
+        raise ValueError("No global index found; run ingest.py first or pass --synthetic.")
+    return store.corpus_vectors()
+
+
+def split_queries(vectors, n_queries, seed=0):
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(vectors))
+    n_queries = min(n_queries, len(vectors) // 10 or 1)
+    return vectors[order[n_queries:]], vectors[order[:n_queries]]
+
+
+def benchmark_spec(spec, base, queries, exact_ids, k, mask=None, filtered_ids=None):
+    start = time.perf_counter()
+    index = build_index(spec, base)
+    build_seconds = time.perf_counter() - start
+
+    depth = rescore_depth(spec)
+    latencies = []
+    found = []
+    for query in queries:
+        t0 = time.perf_counter()
+        if depth > k:
+            _, ids = index.search(query[None, :], depth)
+            candidates = ids[0][ids[0] != -1]
+            distances = ((base[candidates] - query) ** 2).sum(axis=1)
+            ids = candidates[np.argsort(distances)[:k]][None, :]
+        else:
+            _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - t0)
+        found.append(ids[0])
+
+    recall = np.mean([len(set(f) & set(e)) / k for f, e in zip(found, exact_ids)])
+    filtered = None
+    if mask is not None:
+        selection = Selection(mask, np.arange(len(base)))
+        target, params = selection.search_target(index)
+        _, ids = target.search(queries, k, params=params)
+        filtered = np.mean([len(set(f) & set(e)) / k for f, e in zip(ids, filtered_ids)])
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "spec": spec,
+        "recall": float(recall),
+        "filtered": None if filtered is None else float(filtered),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "size_mb": index_size_bytes(index) / 2**20,
+        "vs_flat": index_size_bytes(index) / base.nbytes,
+        "build_s": build_seconds,
+    }
+
+
+def run(specs, vectors, n_queries=200, k=4):
+    base, queries = split_queries(np.ascontiguousarray(vectors, dtype=np.float32), n_queries)
+    exact = faiss.IndexFlatL2(base.shape[1])
+    exact.add(base)
+    _, exact_ids = exact.search(queries, k)
+    mask = np.random.default_rng(2).random(len(base)) < FILTER_FRACTION
+    selection = Selection(mask, np.arange(len(base)))  # owns the bitmap its selector reads
+    _, filtered_ids = exact.search(queries, k, params=faiss.SearchParameters(sel=selection.selector))
+    return [benchmark_spec(spec, base, queries, exact_ids, k, mask, filtered_ids) for spec in specs]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index specs against exact search.")
+    parser.add_argument(
+        "--specs", nargs="+",
+        default=["Flat", "IVF256,Flat;nprobe=16", "HNSW32;efSearch=64", "SQfp16", "SQ8;rescore=40", "PQ16"],
+    )
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N random vectors instead of the global index.")
+    parser.add_argument("--dim", type=int, default=384, help="Dimension of --synthetic vectors.")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = np.random.default_rng(1).standard_normal((args.synthetic, args.dim)).astype(np.float32)
+    else:
+        vectors = corpus_from_index()
+
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, recall@{args.k} vs exact flat search\n")
+    print(f"{'spec':<32} {'recall':>7} {'filtered':>9} {'p50 ms':>8} {'p95 ms':>8} {'size MB':>9} {'vs Flat':>8} {'build s':>8}")
+    for row in run(args.specs, vectors, n_queries=args.queries, k=args.k):
+        print(
+            f"{row['spec']:<32} {row['recall']:>7.3f} {row['filtered']:>9.3f} {row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f} "
+            f"{row['size_mb']:>9.2f} {row['vs_flat']:>8.2f} {row['build_s']:>8.2f}"
+        )
+        logging.info(f"Index benchmark: {row}")
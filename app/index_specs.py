@@ -0,0 +1,127 @@
+"""FAISS index specs: which index type the global index uses and how it is searched.
+
+A spec is a ``faiss.index_factory`` string optionally followed by search-time
+parameters after a semicolon, for example::
+
+    Flat                      exact brute-force search (default)
+    IVF1024,Flat;nprobe=16    inverted lists, 16 of 1024 probed per query
+    HNSW32;efSearch=64        graph index with M=32
+    IVF1024,PQ48;nprobe=32    inverted lists with product-quantized codes
+    SQfp16                    float16 vectors, half the memory of Flat
+    SQ8;rescore=40            int8 scalar-quantized vectors (a quarter of Flat);
+                              the top 40 hits are re-sorted by exact distance
+
+Indexes other than Flat are trained on the corpus vectors when built.
+``rescore=N`` is not a FAISS parameter: the retriever searches the compressed
+index for N candidates and re-ranks them with the float32 vectors kept on disk
+in the docstore, recovering most of the recall lost to quantization.
+"""
+import faiss
+import numpy as np
+
+DEFAULT_INDEX_SPEC = "Flat"
+RESCORE_PARAM = "rescore"
+
+# Index types whose reconstruct() returns the original float32 vectors.
+_EXACT_STORAGE = (faiss.IndexFlat, faiss.IndexHNSWFlat, faiss.IndexIVFFlat)
+# Exhaustive-scan index types whose search() honours an IDSelector in plain
+# SearchParameters; IndexPQ, IndexLSH and the fast-scan and refine indexes raise.
+_SELECTOR_SEARCH = (faiss.IndexFlat, faiss.IndexScalarQuantizer)
+
+
+def parse_spec(spec):
+    """Split ``"IVF256,Flat;nprobe=16"`` into ``("IVF256,Flat", {"nprobe": 16})``."""
+    factory, _, params = spec.partition(";")
+    search_params = {}
+    for item in filter(None, (p.strip() for p in params.split(","))):
+        name, _, value = item.partition("=")
+        if not value:
+            raise ValueError(f"Invalid search parameter '{item}' in index spec '{spec}'.")
+        search_params[name.strip()] = float(value) if "." in value else int(value)
+    return factory.strip(), search_params
+
+
+def apply_search_params(index, spec):
+    """Set nprobe / efSearch (or any other faiss ParameterSpace name) on ``index``."""
+    _, search_params = parse_spec(spec)
+    space = faiss.ParameterSpace()
+    for name, value in search_params.items():
+        if name != RESCORE_PARAM:
+            space.set_index_parameter(index, name, value)
+    return index
+
+
+def rescore_depth(spec):
+    """Candidates to re-rank by exact float32 distance, or 0 when the spec does not ask for rescoring."""
+    return int(parse_spec(spec)[1].get(RESCORE_PARAM, 0))
+
+
+def build_index(spec, vectors):
+    """Create the index described by ``spec``, train it on ``vectors`` and add them."""
+    factory, _ = parse_spec(spec)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], factory)
+    if not index.is_trained:
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None and len(vectors) < ivf.nlist:
+            raise ValueError(
+                f"Index spec '{spec}' needs at least {ivf.nlist} vectors to train; the corpus has {len(vectors)}."
+            )
+        try:
+            index.train(vectors)
+        except RuntimeError as e:
+            raise ValueError(f"Could not train index spec '{spec}' on {len(vectors)} vectors: {e}") from e
+    index.add(vectors)
+    return apply_search_params(index, spec)
+
+
+def has_exact_storage(index):
+    return isinstance(index, _EXACT_STORAGE)
+
+
+def accepts_selector(index):
+    return isinstance(index, _SELECTOR_SEARCH)
+
+
+def reconstruct_all(index):
+    """Return every vector in ``index`` in position order.
+
+    Exact for Flat, HNSW-Flat and IVF-Flat; quantized indexes return their
+    decoded approximations.
+    """
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return index.reconstruct_n(0, index.ntotal)
+    # IVF lists need a direct map to reconstruct by position, but remove_ids
+    # refuses to run while one exists, so it is dropped again afterwards.
+    ivf.make_direct_map()
+    try:
+        return index.reconstruct_n(0, index.ntotal)
+    finally:
+        ivf.make_direct_map(False)
+
+
+def remove_positions(index, positions):
+    """Remove vectors by position, leaving the rest numbered ``0..ntotal-1`` in their previous order.
+
+    Flat and scalar-quantized indexes shift later vectors down themselves; IVF
+    indexes keep their labels, so the stored ids are renumbered to match.
+    Raises RuntimeError for indexes that cannot remove vectors (HNSW).
+    """
+    removed = np.sort(np.asarray(positions, dtype=np.int64))
+    index.remove_ids(removed)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return
+    invlists = ivf.invlists
+    for list_no in range(ivf.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ids = faiss.rev_swig_ptr(invlists.get_ids(list_no), size)
+            ids -= np.searchsorted(removed, ids)
+
+
+def index_size_bytes(index):
+    return faiss.serialize_index(index).nbytes
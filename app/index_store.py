@@ -0,0 +1,585 @@
+"""Single persistent FAISS index with a manifest of ingested files.
+
+All chunks live in one index at the root of ``index/``. ``manifest.json``
+records, for every ingested PDF, its content hash and the range of vector ids
+its chunks occupy, so documents can be appended, replaced or removed in place
+and ingestion can skip files that have not changed since the last run. Chunk
+text is kept in a SQLite docstore (see ``docstore.py``) and read lazily. The
+FAISS index type is chosen by an index spec (see ``index_specs.py``).
+
+Near-duplicate chunks (see ``dedup.py``) are stored once: later copies add a
+citation to the chunk they repeat instead of a vector of their own.
+
+Long-running query processes call ``start_refresh_thread`` to pick up versions
+published on disk by another process, such as ``watcher.py``. Writers take an
+exclusive lock on ``index/.lock`` for each transaction, and keep it while
+published changes are unsaved, so the webapp, the watcher and CLI ingests take
+turns; a writer first loads any newer version another one saved.
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not locked against each other
+    fcntl = None
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from dedup import DEDUP_ENABLED, band_keys, find_duplicates, minhash
+from docstore import INDEX_FILE, PICKLE_FILE, convert_to_sqlite, is_lazy, load_lazy, new_lazy_store, save_lazy
+from embedding_registry import get_cached_embeddings, get_embeddings
+from index_specs import (
+    DEFAULT_INDEX_SPEC, apply_search_params, build_index, has_exact_storage, parse_spec, reconstruct_all,
+    remove_positions,
+)
+from logger import logging
+from metrics import incr, span
+
+INDEX_DIR = "index"
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+MANIFEST_POLL_SECONDS = 2.0
+TRANSACTION_SAVEPOINT = "index_transaction"
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IndexStore:
+    """Owns the global index and its manifest.
+
+    Docstore ids are stringified integers handed out from a monotonically
+    increasing counter, so a file's chunks always occupy the contiguous id range
+    ``[start, end)`` recorded in the manifest. A file may also hold ``adopted``
+    ids: chunks it duplicated that outlived the file they were first stored for.
+
+    ``db`` and ``manifest`` are published snapshots. Changes are made inside a
+    ``transaction()`` on a private copy of the FAISS index and become visible in
+    one attribute swap, so concurrent searches never see a half-applied change.
+    Copying the index costs one extra index's worth of memory while a
+    transaction is open; group many changes into a single transaction.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR):
+        self.index_dir = index_dir
+        self.manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+        self.db = None
+        self._loaded = False
+        self._ready = False  # set once loading has finished; lets load() skip the lock
+        self._lock = threading.RLock()
+        self.manifest = self._read_manifest()
+        self._in_transaction = False
+        self._db = None  # working copies while a transaction is open
+        self._manifest = None
+        self._pending_deletes = set()
+        self._pending_citations = set()
+        self._save_pending = False
+        self._savepoints = 0  # open isolated nested transactions
+        self._lock_file = None  # held from the first change until it is saved
+        self._unsaved = False  # published changes not yet written to disk
+        self._refresher = None
+        if self.manifest.pop("writing", False):
+            logging.warning(f"The last save to '{index_dir}' did not finish; its index files may be inconsistent.")
+
+    def _read_manifest(self):
+        manifest = {"version": 0, "next_id": 0, "index_spec": DEFAULT_INDEX_SPEC, "files": {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest.update(json.load(f))
+        return manifest
+
+    def refresh(self):
+        """Adopt a newer version another process has published to ``index_dir``.
+
+        Returns True if one was loaded. Nothing happens while this process has
+        a transaction open, or while the writer's files are half written: the
+        manifest carries a ``writing`` flag until they are complete, and is read
+        again after loading to catch a save that started in the meantime.
+        """
+        if not self._ready:
+            return False
+        disk = self._read_manifest()
+        if disk["version"] <= self.version or disk.get("writing"):
+            return False
+        with self._lock:
+            if self._in_transaction or disk["version"] <= self.version:
+                return False
+            start = time.perf_counter()
+            try:
+                db = load_lazy(self.index_dir, get_embeddings(), self.db.docstore if self.db is not None else None)
+            except Exception as e:
+                logging.warning(f"Could not load index version {disk['version']} yet: {e}")
+                return False
+            if self._read_manifest() != disk or len(db.index_to_docstore_id) != db.index.ntotal:
+                return False
+            db.docstore.refresh()
+            apply_search_params(db.index, disk["index_spec"])
+            self.db = db
+            self.manifest = disk
+            logging.info(
+                f"Loaded index version {disk['version']} ({db.index.ntotal} vectors) published by another process "
+                f"in {time.perf_counter() - start:.2f}s."
+            )
+            return True
+
+    def start_refresh_thread(self, interval=MANIFEST_POLL_SECONDS):
+        """Poll for newer versions from a daemon thread; later calls are no-ops."""
+        with self._lock:
+            if self._refresher is not None:
+                return
+
+            def poll():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        self.refresh()
+                    except Exception as e:
+                        logging.error(f"Index refresh failed: {e}")
+
+            self._refresher = threading.Thread(target=poll, name="index-refresh", daemon=True)
+            self._refresher.start()
+
+    @property
+    def version(self):
+        return self.manifest["version"]
+
+    @property
+    def index_spec(self):
+        return self.manifest["index_spec"]
+
+    @property
+    def files(self):
+        return self.manifest["files"]
+
+    def is_current(self, file_name, digest):
+        entry = self.files.get(file_name)
+        return entry is not None and entry["hash"] == digest
+
+    def load(self):
+        """Load the global index once; later calls return the in-memory copy."""
+        if self._ready:
+            # A long ingest transaction holds the lock; readers must not wait on it.
+            return self.db
+        with self._lock:
+            if self._loaded:
+                return self.db
+            self._loaded = True
+            if os.path.exists(os.path.join(self.index_dir, PICKLE_FILE)) and not is_lazy(self.index_dir):
+                # Pickled docstore from an older version; converted once so later loads skip it.
+                convert_to_sqlite(self.index_dir)
+            if is_lazy(self.index_dir):
+                start = time.perf_counter()
+                self.db = load_lazy(self.index_dir, get_embeddings())
+                apply_search_params(self.db.index, self.index_spec)
+                logging.info(
+                    f"Loaded global index with {self.db.index.ntotal} vectors from '{self.index_dir}' "
+                    f"in {time.perf_counter() - start:.2f}s."
+                )
+            else:
+                self._import_legacy_indexes()
+            self._ready = True
+            return self.db
+
+    def _import_legacy_indexes(self):
+        """One-time migration from the old one-directory-per-PDF layout."""
+        if not os.path.isdir(self.index_dir):
+            return
+        folders = sorted(
+            name for name in os.listdir(self.index_dir)
+            if os.path.exists(os.path.join(self.index_dir, name, INDEX_FILE))
+        )
+        if not folders:
+            return
+        with self.transaction():
+            for folder in folders:
+                subdir = os.path.join(self.index_dir, folder)
+                try:
+                    legacy = FAISS.load_local(subdir, get_embeddings(), allow_dangerous_deserialization=True)
+                except Exception as e:
+                    logging.error(f"Skipped legacy index '{subdir}': {e}")
+                    continue
+                vectors = legacy.index.reconstruct_n(0, legacy.index.ntotal)
+                chunks = [legacy.docstore.search(legacy.index_to_docstore_id[i]) for i in range(legacy.index.ntotal)]
+                # No content hash is known, so the next ingest run re-processes the PDF.
+                self.add_file(f"{folder}.pdf", None, chunks, vectors.tolist())
+                logging.info(f"Imported legacy index '{subdir}' into the global index.")
+        logging.info("Legacy per-PDF index folders are no longer read and can be deleted.")
+
+    @contextmanager
+    def transaction(self, isolated=False):
+        """Group changes and publish them atomically when the block exits.
+
+        Nested transactions join the outermost one; an ``isolated`` nested
+        transaction that raises undoes only its own changes, at the cost of
+        another copy of the working index, and the outer one carries on. If
+        the outermost block raises, the working copy and the block's docstore
+        writes are discarded and the published index is left untouched.
+        """
+        with self._lock:
+            if self._in_transaction:
+                if not isolated:
+                    yield
+                    return
+                with self._savepoint():
+                    yield
+                return
+            with self._write_lock():
+                if not self._loaded:
+                    self.load()
+                self._catch_up()
+                with self._publish():
+                    yield
+
+    @contextmanager
+    def _publish(self):
+        self._in_transaction = True
+        self._db = self._copy(self.db)
+        self._manifest = copy.deepcopy(self.manifest)
+        # The published docstore may still hold uncommitted rows of earlier
+        # transactions published with save=False; a failure undoes only this one's.
+        docstore = self.db.docstore if self.db is not None else None
+        if docstore is not None:
+            docstore.savepoint(TRANSACTION_SAVEPOINT)
+        try:
+            yield
+        except BaseException:
+            if docstore is not None:
+                docstore.rollback_to(TRANSACTION_SAVEPOINT)
+            elif self._db is not None:
+                self._db.docstore.rollback()  # a docstore created by this transaction
+            raise
+        else:
+            if docstore is not None:
+                docstore.release(TRANSACTION_SAVEPOINT)
+            changed = self._manifest["version"] != self.manifest["version"]
+            # Publish the index before the manifest: a reader that sees the
+            # new version is then guaranteed to search the new index.
+            self.db = self._db
+            self.manifest = self._manifest
+            if self._pending_deletes:
+                self.db.docstore.delete(self._pending_deletes)
+            if self._pending_citations:
+                self.db.docstore.delete_citations(self._pending_citations)
+            if self._save_pending:
+                self._write()
+            elif changed:
+                self._unsaved = True
+        finally:
+            self._in_transaction = False
+            self._db = self._manifest = None
+            self._pending_deletes = set()
+            self._pending_citations = set()
+            self._save_pending = False
+
+    @contextmanager
+    def _savepoint(self):
+        """Undo the block's changes to the working copy if it raises."""
+        self._savepoints += 1
+        name = f"{TRANSACTION_SAVEPOINT}_{self._savepoints}"
+        saved = (
+            self._copy(self._db), copy.deepcopy(self._manifest), set(self._pending_deletes),
+            set(self._pending_citations), self._save_pending,
+        )
+        docstore = self._db.docstore if self._db is not None else None
+        if docstore is not None:
+            docstore.savepoint(name)
+        try:
+            yield
+        except BaseException:
+            if docstore is not None:
+                docstore.rollback_to(name)
+            elif self._db is not None:
+                self._db.docstore.rollback()
+            self._db, self._manifest, self._pending_deletes, self._pending_citations, self._save_pending = saved
+            raise
+        else:
+            if docstore is not None:
+                docstore.release(name)
+        finally:
+            self._savepoints -= 1
+
+    @contextmanager
+    def _write_lock(self):
+        """Hold the cross-process write lock for the block, and after it while changes are unsaved."""
+        if fcntl is not None and self._lock_file is None:
+            os.makedirs(self.index_dir, exist_ok=True)
+            lock_file = open(os.path.join(self.index_dir, LOCK_FILE), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                start = time.perf_counter()
+                logging.info(f"Waiting for another process writing to '{self.index_dir}'.")
+                with span("index.lock_wait"):
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                logging.info(f"Got the write lock on '{self.index_dir}' after {time.perf_counter() - start:.1f}s.")
+            self._lock_file = lock_file
+        try:
+            yield
+        finally:
+            if self._lock_file is not None and not self._unsaved:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _catch_up(self):
+        """With the write lock held, load a newer version another process saved; True if one was loaded.
+
+        Changing a stale snapshot would reuse ids the other process handed
+        out and overwrite its files.
+        """
+        disk = self._read_manifest()
+        if disk["version"] <= self.version:
+            return False
+        if disk.get("writing"):
+            # Nobody else holds the lock, so that writer died mid-save.
+            logging.warning(f"Index version {disk['version']} in '{self.index_dir}' was never completely saved; ignoring it.")
+            return False
+        if not self.refresh():
+            raise RuntimeError(
+                f"Index version {disk['version']} in '{self.index_dir}' is newer than this process's "
+                f"{self.version} and could not be loaded; not writing over it."
+            )
+        return True
+
+    @staticmethod
+    def _copy(db):
+        if db is None:
+            return None
+        return FAISS(db.embedding_function, faiss.clone_index(db.index), db.docstore, dict(db.index_to_docstore_id))
+
+    def add_file(self, file_name, digest, chunks, vectors=None, save=True):
+        """Append a file's chunks to the index, replacing any previous version of it."""
+        with self.transaction():
+            files = self._manifest["files"]
+            if file_name in files:
+                self._drop_file(file_name)
+
+            start = self._manifest["next_id"]
+            end, duplicates = self._add_chunks(file_name, start, chunks, vectors)
+            files[file_name] = {"hash": digest, "start": start, "end": end, "chunks": len(chunks), "duplicates": duplicates}
+            self._manifest["next_id"] = end
+            self._manifest["version"] += 1
+            logging.info(
+                f"Added {len(chunks)} chunks for '{file_name}' to the global index (ids {start}-{end}, "
+                f"{duplicates} near-duplicate(s) collapsed)."
+            )
+            if save:
+                self.save()
+
+    def append_chunks(self, file_name, chunks, vectors=None, save=True):
+        """Add chunks to the end of a file's id range, e.g. the next window of a streamed PDF.
+
+        Only the most recently added file can grow, since its range must stay contiguous.
+        """
+        with self.transaction():
+            entry = self._manifest["files"].get(file_name)
+            if entry is None or entry["end"] != self._manifest["next_id"]:
+                raise ValueError(f"'{file_name}' is not the most recently added file; its id range cannot grow.")
+            end, duplicates = self._add_chunks(file_name, entry["end"], chunks, vectors)
+            entry["end"] = end
+            entry["chunks"] += len(chunks)
+            entry["duplicates"] = entry.get("duplicates", 0) + duplicates
+            self._manifest["next_id"] = end
+            self._manifest["version"] += 1
+            if save:
+                self.save()
+
+    def _add_chunks(self, file_name, start, chunks, vectors):
+        """Embed (unless ``vectors`` are given) and add chunks with ids from ``start``.
+
+        Near-duplicates of stored chunks, or of earlier ones in ``chunks``, are
+        recorded as citations of that chunk and not embedded. Returns
+        ``(end id, number of duplicates)``.
+        """
+        if not chunks:
+            return start, 0
+        kept, cited = list(range(len(chunks))), []
+        if DEDUP_ENABLED:
+            with span("index.dedup", file=file_name, chunks=len(chunks)) as attrs:
+                signatures = [minhash(c.page_content) for c in chunks]
+                docstore = self._db.docstore if self._db is not None else None
+                matches = find_duplicates(signatures, docstore, lambda _id: _id not in self._pending_deletes)
+                kept = [i for i, match in enumerate(matches) if match is None]
+                attrs["duplicates"] = len(chunks) - len(kept)
+        ids = {position: str(start + n) for n, position in enumerate(kept)}
+        if DEDUP_ENABLED:
+            cited = [
+                (ids[match] if isinstance(match, int) else match, file_name, chunks[i].metadata)
+                for i, match in enumerate(matches) if match is not None
+            ]
+            incr("chunks_deduplicated", len(cited))
+
+        end = start + len(kept)
+        if kept:
+            if vectors is None:
+                with span("index.embed", file=file_name, chunks=len(kept)):
+                    vectors = get_cached_embeddings().embed_documents([chunks[i].page_content for i in kept])
+            else:
+                vectors = [vectors[i] for i in kept]
+            text_embeddings = [(chunks[i].page_content, v) for i, v in zip(kept, vectors)]
+            metadatas = [chunks[i].metadata for i in kept]
+            if self._db is None:
+                self._db = new_lazy_store(self.index_dir, get_embeddings(), len(text_embeddings[0][1]))
+                # A fresh store starts out flat; rebuild() switches it to another spec.
+                self._manifest["index_spec"] = DEFAULT_INDEX_SPEC
+            with span("index.faiss_add", chunks=len(kept)):
+                self._db.add_embeddings(text_embeddings, metadatas=metadatas, ids=[ids[i] for i in kept])
+            # Exact copies on disk, for rescoring and retraining a quantized index.
+            self._db.docstore.add_vectors(zip([ids[i] for i in kept], vectors))
+        if DEDUP_ENABLED:
+            self._db.docstore.add_minhashes([(ids[i], signatures[i], band_keys(signatures[i])) for i in kept])
+            self._db.docstore.add_citations(cited)
+        return end, len(cited)
+
+    def remove_file(self, file_name, save=True):
+        with self.transaction():
+            if file_name not in self._manifest["files"]:
+                return False
+            self._drop_file(file_name)
+            self._manifest["version"] += 1
+            logging.info(f"Removed '{file_name}' from the global index.")
+            if save:
+                self.save()
+            return True
+
+    def _drop_file(self, file_name):
+        """Take a file out of the working manifest and index.
+
+        A chunk that other files have near-duplicates of is handed to the first
+        of those files, with that copy's metadata, instead of being deleted.
+        """
+        files = self._manifest["files"]
+        entry = files.pop(file_name)
+        ids = {str(i) for i in range(entry["start"], entry["end"])} | set(entry.get("adopted", ()))
+        if self._db is None or not ids:
+            return
+        docstore = self._db.docstore
+        self._pending_citations.update(docstore.file_citations(file_name))
+        for _id, cited in docstore.citations_of(ids).items():
+            heirs = [row for row in cited if row[1] in files and row[0] not in self._pending_citations]
+            if not heirs:
+                continue
+            rowid, heir, metadata = heirs[0]
+            files[heir].setdefault("adopted", []).append(_id)
+            docstore.set_metadata(_id, metadata)
+            self._pending_citations.add(rowid)
+            ids.discard(_id)
+        self._delete_ids(ids)
+
+    def _delete_ids(self, ids):
+        """Remove docstore ids from the working index.
+
+        Docstore rows are deleted only after the new index is published, since
+        searches on the previous snapshot may still fetch them.
+        """
+        if self._db is None or not ids:
+            return
+        id_map = self._db.index_to_docstore_id
+        positions = sorted(id_map)
+        keep = [pos for pos in positions if id_map[pos] not in ids]
+        if len(keep) == len(positions):
+            return
+        removed = np.array([pos for pos in positions if id_map[pos] in ids], dtype=np.int64)
+        try:
+            remove_positions(self._db.index, removed)
+        except RuntimeError:
+            # HNSW graphs cannot remove vectors; rebuild the graph without them.
+            vectors = self._corpus_vectors(self._db)[keep]
+            self._db.index = build_index(self._manifest["index_spec"], vectors)
+        self._db.index_to_docstore_id = {i: id_map[pos] for i, pos in enumerate(keep)}
+        self._pending_deletes.update(ids)
+
+    def corpus_vectors(self):
+        """All stored vectors of the published index in position order, as float32."""
+        return self._corpus_vectors(self.load())
+
+    @staticmethod
+    def _corpus_vectors(db):
+        index = db.index
+        if has_exact_storage(index):
+            return reconstruct_all(index)
+        # Quantized codes are lossy; read the float32 copies kept in the docstore,
+        # re-embedding (through the embedding cache) chunks stored without one.
+        ids = [db.index_to_docstore_id[i] for i in range(index.ntotal)]
+        stored = db.docstore.get_vectors(ids)
+        missing = [_id for _id in ids if _id not in stored]
+        if missing:
+            texts = [doc.page_content for doc in db.docstore.get_many(missing)]
+            stored.update(zip(missing, np.asarray(get_cached_embeddings().embed_documents(texts), dtype=np.float32)))
+        if not ids:
+            return np.zeros((0, index.d), dtype=np.float32)
+        return np.stack([stored[_id] for _id in ids])
+
+    def rebuild(self, spec):
+        """Re-create the index with ``spec``, training it on the whole corpus."""
+        with self.transaction():
+            if self._db is None or self._db.index.ntotal == 0:
+                logging.warning("The global index is empty; nothing to rebuild.")
+                return
+            start = time.perf_counter()
+            vectors = self._corpus_vectors(self._db)
+            if not has_exact_storage(faiss.index_factory(vectors.shape[1], parse_spec(spec)[0])):
+                # Indexes written before the docstore kept vectors get their
+                # float32 copies now, while they can still be read back exactly.
+                ids = [self._db.index_to_docstore_id[i] for i in range(len(vectors))]
+                self._db.docstore.add_vectors(zip(ids, vectors))
+            self._db.index = build_index(spec, vectors)
+            self._manifest["index_spec"] = spec
+            self._manifest["version"] += 1
+            logging.info(
+                f"Rebuilt global index as '{spec}' over {self._db.index.ntotal} vectors "
+                f"in {time.perf_counter() - start:.2f}s."
+            )
+            self.save()
+
+    def save(self):
+        """Persist the index, then the manifest; inside a transaction this happens on publish."""
+        with self._lock:
+            if self._in_transaction:
+                self._save_pending = True
+                return
+            with self._write_lock():
+                if self._unsaved or not self._catch_up():
+                    self._write()
+
+    def _write(self):
+        with span("index.save"):
+            os.makedirs(self.index_dir, exist_ok=True)
+            if self.db is not None:
+                # Other processes' refresh() ignores the index files until the flag is gone.
+                self._write_manifest({**self.manifest, "writing": True})
+                save_lazy(self.db, self.index_dir)
+            self._write_manifest(self.manifest)
+        self._unsaved = False
+
+    def _write_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_index_store():
+    """Return the process-wide index store shared by ingestion and queries."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = IndexStore()
+    return _store
@@ -1,51 +1,228 @@
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+import argparse
+import json
 import os
-import shutil
+import queue
+import threading
+import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 warnings.filterwarnings("ignore", category=FutureWarning)
 from logger import logging
+from embedding_registry import get_cached_embeddings
+from index_store import file_hash, get_index_store
+from metrics import incr, span, write_prometheus
 
 
 DATA_DIR = "data"
-OUTPUT_ROOT = "index"
+BULK_BATCH_SIZE = 256
+STREAM_WINDOW_PAGES = 32
+METADATA_FILE = "metadata.json"
+
+def file_metadata(pdf_path):
+    """Custom fields for a PDF from ``metadata.json`` beside it, e.g. ``{"handbook.pdf": {"department": "HR"}}``.
+
+    They are stored on every chunk and can be used in search filters (see
+    ``filters.py``); edits take effect when the PDF is next ingested.
+    """
+    path = os.path.join(os.path.dirname(pdf_path), METADATA_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get(os.path.basename(pdf_path), {})
 
 def load_documents(pdf_path):
-    loader = PyPDFLoader(pdf_path)
-    documents = loader.load()
+    with span("ingest.load", file=os.path.basename(pdf_path)) as attrs:
+        loader = PyPDFLoader(pdf_path)
+        documents = loader.load()
+        extra = file_metadata(pdf_path)
+        for doc in documents:
+            doc.metadata.update(extra)
+        attrs["pages"] = len(documents)
+    incr("pages_loaded", len(documents))
     logging.info(f"Loaded {len(documents)} pages from '{os.path.basename(pdf_path)}'.")
     return documents
 
 def split_documents(docs, filename):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    chunks = splitter.split_documents(docs)
+    with span("ingest.split", file=filename) as attrs:
+        splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50, add_start_index=True)
+        chunks = splitter.split_documents(docs)
+        attrs["chunks"] = len(chunks)
+    incr("chunks_split", len(chunks))
     logging.info(f"Split into {len(chunks)} chunks for '{filename}'.")
     return chunks
 
-def embed_and_save(chunks, pdf_filename):
-    base_name = os.path.splitext(pdf_filename)[0]
-    output_dir = os.path.join(OUTPUT_ROOT, base_name)  # Changed from f"{base_name}_index" to just base_name
-    os.makedirs(output_dir, exist_ok=True)
-    logging.info(f"Embedding and saving vector index for '{base_name}' to '{output_dir}'.")
+def embed_and_save(chunks, pdf_filename, vectors=None, digest=None, save=True):
+    """Append a PDF's chunks to the global index, replacing any earlier version of the file."""
+    store = get_index_store()
+    logging.info(f"Embedding {len(chunks)} chunks for '{pdf_filename}' into the global index at '{store.index_dir}'.")
+    with span("ingest.embed_and_save", file=pdf_filename, chunks=len(chunks)):
+        store.add_file(pdf_filename, digest, chunks, vectors=vectors, save=save)
+    if save:
+        logging.info(f"Global index and manifest saved to '{store.index_dir}'.")
+
+def iter_page_windows(pdf_path, window_pages=STREAM_WINDOW_PAGES):
+    """Yield lists of at most ``window_pages`` pages, parsed lazily one page at a time."""
+    extra = file_metadata(pdf_path)
+    window = []
+    for page in PyPDFLoader(pdf_path).lazy_load():
+        page.metadata.update(extra)
+        window.append(page)
+        if len(window) == window_pages:
+            yield window
+            window = []
+    if window:
+        yield window
+
+def stream_ingest(pdf_path, digest=None, window_pages=STREAM_WINDOW_PAGES, save=True):
+    """Ingest one PDF a window of pages at a time.
+
+    Each window is split, embedded and appended to the working index before
+    the next is read, so memory holds one window of pages and chunks rather
+    than the whole document. The file is published only once it is complete.
+    """
+    pdf_file = os.path.basename(pdf_path)
+    store = get_index_store()
+    pages = chunks = windows = 0
+    start = time.perf_counter()
+    with span("ingest.stream", file=pdf_file) as attrs, store.transaction():
+        store.add_file(pdf_file, digest, [], save=False)
+        for window in iter_page_windows(pdf_path, window_pages):
+            with span("ingest.window", file=pdf_file, pages=len(window)):
+                window_chunks = split_documents(window, pdf_file)
+                store.append_chunks(pdf_file, window_chunks, save=False)
+            incr("pages_loaded", len(window))
+            pages += len(window)
+            chunks += len(window_chunks)
+            windows += 1
+        attrs.update(pages=pages, chunks=chunks, windows=windows)
+        if save:
+            store.save()
+    logging.info(
+        f"Streamed '{pdf_file}': {pages} pages, {chunks} chunks in {windows} window(s) of up to "
+        f"{window_pages} pages, {time.perf_counter() - start:.1f}s."
+    )
+    return pages, chunks
+
+def _load_and_split(pdf_path):
+    """Parse stage of the bulk pipeline; runs inside a worker process."""
+    pdf_file = os.path.basename(pdf_path)
+    docs = load_documents(pdf_path)
+    return pdf_file, len(docs), split_documents(docs, pdf_file)
+
+def bulk_ingest(pdf_paths, workers=None, batch_size=BULK_BATCH_SIZE, queue_size=None, digests=None):
+    """Ingest many PDFs with parsing and embedding overlapped.
+
+    A process pool parses and splits PDFs while the main thread embeds chunks in
+    batches of ``batch_size``. At most ``queue_size`` parsed PDFs wait for the
+    embedder at any time, so a slow embedder applies backpressure to the parsers.
+    The global index is written to disk once, after the last PDF.
+    """
+    digests = digests or {}
+    workers = workers or os.cpu_count() or 1
+    queue_size = queue_size or workers * 2
+    parsed = queue.Queue(maxsize=queue_size)
+    slots = threading.BoundedSemaphore(queue_size)
+    embeddings = get_cached_embeddings()
+    stats = {"files": 0, "pages": 0, "chunks": 0, "embed_seconds": 0.0, "parse_end": None}
+    start = time.perf_counter()
+
+    def parse_stage():
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path in pdf_paths:
+                slots.acquire()
+                # Never blocks: a slot is held for every future that can land in the queue.
+                pool.submit(_load_and_split, path).add_done_callback(parsed.put_nowait)
+        stats["parse_end"] = time.perf_counter()
+        parsed.put(None)
+
+    producer = threading.Thread(target=parse_stage, name="bulk-parse", daemon=True)
+    producer.start()
 
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    db = FAISS.from_documents(chunks, embeddings)
-    db.save_local(output_dir)
-    logging.info(f"Embeddings and vector index saved to '{output_dir}'.")
+    pending = {}  # pdf_file -> (chunks, vectors embedded so far)
+    batch = []  # (pdf_file, chunk) pairs waiting for the embedder
 
-    # Verify files exist but don't rename them
-    index_faiss = os.path.join(output_dir, "index.faiss")
-    index_pkl = os.path.join(output_dir, "index.pkl")
+    def embed_batch():
+        if not batch:
+            return
+        t0 = time.perf_counter()
+        with span("ingest.embed_batch", chunks=len(batch)):
+            vectors = embeddings.embed_documents([chunk.page_content for _, chunk in batch])
+        stats["embed_seconds"] += time.perf_counter() - t0
+        touched = set()
+        for (pdf_file, _), vector in zip(batch, vectors):
+            pending[pdf_file][1].append(vector)
+            touched.add(pdf_file)
+        batch.clear()
+        for pdf_file in touched:
+            chunks, file_vectors = pending[pdf_file]
+            if len(file_vectors) == len(chunks):
+                embed_and_save(chunks, pdf_file, vectors=file_vectors, digest=digests.get(pdf_file), save=False)
+                del pending[pdf_file]
 
-    if os.path.exists(index_faiss) and os.path.exists(index_pkl):
-        logging.info(f"Vector index saved to '{output_dir}' as 'index.faiss' and 'index.pkl'.")
-    else:
-        logging.error(f"Expected FAISS output files were not found after saving in '{output_dir}'.")
+    # One transaction: the index is copied once and published once for the whole run.
+    with get_index_store().transaction():
+        while True:
+            future = parsed.get()
+            if future is None:
+                break
+            slots.release()
+            try:
+                pdf_file, n_pages, chunks = future.result()
+            except Exception as e:
+                logging.error(f"Failed to parse PDF in bulk ingest: {e}")
+                continue
+
+            stats["files"] += 1
+            stats["pages"] += n_pages
+            stats["chunks"] += len(chunks)
+            # Counters bumped inside the parser processes never reach this one.
+            incr("pages_loaded", n_pages)
+            incr("chunks_split", len(chunks))
+            if not chunks:
+                logging.warning(f"No text chunks extracted from '{pdf_file}'.")
+                embed_and_save(chunks, pdf_file, digest=digests.get(pdf_file), save=False)
+                continue
+
+            pending[pdf_file] = (chunks, [])
+            for chunk in chunks:
+                batch.append((pdf_file, chunk))
+                if len(batch) >= batch_size:
+                    embed_batch()
+        embed_batch()
+        producer.join()
+        get_index_store().save()
+
+    total = time.perf_counter() - start
+    parse_seconds = stats["parse_end"] - start
+    report = (
+        f"Parse stage: {stats['pages']} pages from {stats['files']} PDF(s) in {parse_seconds:.1f}s "
+        f"({stats['pages'] / max(parse_seconds, 1e-9):.1f} pages/s, {workers} worker(s)).\n"
+        f"Embed stage: {stats['chunks']} chunks in {stats['embed_seconds']:.1f}s "
+        f"({stats['chunks'] / max(stats['embed_seconds'], 1e-9):.1f} chunks/s, batch size {batch_size}).\n"
+        f"Total: {total:.1f}s ({stats['chunks'] / max(total, 1e-9):.1f} chunks/s end to end)."
+    )
+    print(report)
+    logging.info(report)
+    return stats
 
 if __name__ == "__main__":
-    os.makedirs(OUTPUT_ROOT, exist_ok=True)
+    parser = argparse.ArgumentParser(description="Build FAISS indexes for the PDFs in the data directory.")
+    parser.add_argument("--bulk", action="store_true", help="Parse PDFs in a process pool while embedding in batches.")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes for --bulk (default: CPU count).")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE, help="Chunks per embedding call for --bulk.")
+    parser.add_argument("--queue-size", type=int, default=None, help="Parsed PDFs allowed to wait for the embedder (default: 2x workers).")
+    parser.add_argument("--stream", action="store_true", help="Read, split and embed each PDF in windows of pages to bound memory.")
+    parser.add_argument("--window-pages", type=int, default=STREAM_WINDOW_PAGES, help="Pages per window for --stream.")
+    parser.add_argument("--index-spec", default=None, help="FAISS index spec, e.g. 'Flat', 'IVF1024,Flat;nprobe=16', 'HNSW32;efSearch=64', 'SQ8;rescore=40'.")
+    parser.add_argument("--retrain", action="store_true", help="Retrain the index on the whole corpus even if the spec is unchanged.")
+    args = parser.parse_args()
+    if args.bulk and args.stream:
+        parser.error("--bulk and --stream cannot be combined.")
+
+    store = get_index_store()
+    store.load()
     pdf_files = [f for f in os.listdir(DATA_DIR) if f.endswith(".pdf")]
 
     if not pdf_files:
@@ -53,10 +230,46 @@ if __name__ == "__main__":
 
     logging.info(f"Found {len(pdf_files)} PDF(s) in '{DATA_DIR}'.\n")
 
-    for pdf_file in pdf_files:
-        path = os.path.join(DATA_DIR, pdf_file)
-        docs = load_documents(path)
-        chunks = split_documents(docs, pdf_file)
-        embed_and_save(chunks, pdf_file)
-    
+    with span("ingest.run"), store.transaction():
+        digests = {f: file_hash(os.path.join(DATA_DIR, f)) for f in pdf_files}
+        for indexed_file in list(store.files):
+            if indexed_file not in digests:
+                logging.info(f"'{indexed_file}' is no longer in '{DATA_DIR}'; removing it from the index.")
+                store.remove_file(indexed_file, save=False)
+
+        changed = [f for f in pdf_files if not store.is_current(f, digests[f])]
+        logging.info(f"{len(pdf_files) - len(changed)} PDF(s) unchanged since the last run; {len(changed)} to ingest.")
+
+        if args.bulk and changed:
+            bulk_ingest(
+                [os.path.join(DATA_DIR, f) for f in changed],
+                workers=args.workers,
+                batch_size=args.batch_size,
+                queue_size=args.queue_size,
+                digests=digests,
+            )
+        else:
+            for pdf_file in changed:
+                path = os.path.join(DATA_DIR, pdf_file)
+                if args.stream:
+                    stream_ingest(path, digest=digests[pdf_file], window_pages=args.window_pages, save=False)
+                    continue
+                docs = load_documents(path)
+                chunks = split_documents(docs, pdf_file)
+                embed_and_save(chunks, pdf_file, digest=digests[pdf_file], save=False)
+            store.save()
+
+    ingested = [store.files[f] for f in changed if f in store.files]
+    split = sum(entry["chunks"] for entry in ingested)
+    if split:
+        duplicates = sum(entry.get("duplicates", 0) for entry in ingested)
+        report = f"Near-duplicate chunks skipped: {duplicates} of {split} ({duplicates / split:.1%}); {split - duplicates} embedded and stored."
+        print(report)
+        logging.info(report)
+
+    index_spec = args.index_spec or store.index_spec
+    if index_spec != store.index_spec or args.retrain:
+        store.rebuild(index_spec)
+
+    logging.info(f"Metrics written to '{write_prometheus()}'.")
     logging.info("Ingest.py completed with no errors.")
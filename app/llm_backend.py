@@ -0,0 +1,369 @@
+"""Pooled, concurrency-limited client for an Ollama server.
+
+Every query path gets its LLM from ``get_llm()`` instead of constructing one:
+
+* HTTP connections are pooled and reused, a ``requests`` session for the
+  synchronous ``stream``/``invoke`` paths and one ``aiohttp`` session per event
+  loop for ``astream`` (``server.py``).
+* At most ``LLM_CONCURRENCY`` generations are sent to Ollama at once; the rest
+  queue in arrival order. Queue wait is recorded as the ``llm.queue_wait``
+  span and the ``llm_waiting``/``llm_active`` gauges.
+* Every request asks Ollama to keep the model loaded for ``KEEP_ALIVE``, and
+  the model is loaded in the background at start-up, so requests after an idle
+  spell do not pay for a cold load.
+* Every request has a deadline covering its queue wait and generation
+  (``LLM_DEADLINE_SECONDS``, or ``llm.stream(prompt, deadline=30)``); a
+  request that runs out of time raises ``TimeoutError`` and frees its slot.
+
+``llm_stub_server.py`` mimics Ollama's generate API with configurable latency
+for offline load tests; point ``OLLAMA_HOST`` at it.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import aiohttp
+import requests
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from pydantic import Field, PrivateAttr
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+
+from logger import logging
+from metrics import incr, record, register_gauge
+
+OLLAMA_URL = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
+if "://" not in OLLAMA_URL:
+    OLLAMA_URL = "http://" + OLLAMA_URL
+LLM_MODEL = "llama3"
+LLM_CONCURRENCY = 4  # generations sent to Ollama at once; match OLLAMA_NUM_PARALLEL
+LLM_POOL_SIZE = 8  # kept-alive HTTP connections per session
+KEEP_ALIVE = "30m"  # how long Ollama keeps the model loaded after a request
+LLM_DEADLINE_SECONDS = 120.0
+CONNECT_TIMEOUT_SECONDS = 5.0
+PRELOAD_ON_START = True
+
+
+class _Waiter:
+    __slots__ = ("granted", "wake")
+
+    def __init__(self, wake):
+        self.granted = False
+        self.wake = wake
+
+
+class GenerationSlots:
+    """A FIFO semaphore shared by threads and event loops.
+
+    A released slot is handed straight to the oldest waiter, so a burst of
+    requests is served in arrival order whichever path they came from.
+    """
+
+    def __init__(self, limit=LLM_CONCURRENCY):
+        self.limit = limit
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def _enter(self, waiter):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        self._waiters.append(waiter)
+        return False
+
+    def _abandon(self, waiter):
+        """Take ``waiter`` out of the queue after a timeout; False if it got a slot meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._waiters.remove(waiter)
+        return True
+
+    def _queued(self, started, timed_out=False):
+        waited = time.perf_counter() - started
+        incr("llm_queued")
+        if timed_out:
+            incr("llm_queue_timeouts")
+            raise TimeoutError(f"No LLM slot became free within {waited:.1f}s.")
+        record("llm.queue_wait", waited)
+
+    def acquire(self, timeout=None):
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        with self._lock:
+            if self._enter(waiter):
+                return
+        started = time.perf_counter()
+        if not event.wait(timeout) and self._abandon(waiter):
+            self._queued(started, timed_out=True)
+        self._queued(started)
+
+    async def acquire_async(self, timeout=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = _Waiter(wake)
+        with self._lock:
+            if self._enter(waiter):
+                return
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                self._queued(started, timed_out=True)
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                self.release()
+            raise
+        self._queued(started)
+
+    def release(self):
+        with self._lock:
+            if self._waiters and self.active <= self.limit:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self.active -= 1
+
+    def resize(self, limit):
+        """Change the limit; raising it admits waiting requests straight away."""
+        with self._lock:
+            self.limit = limit
+            while self._waiters and self.active < self.limit:
+                self.active += 1
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+
+    @contextmanager
+    def hold(self, timeout=None):
+        self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def _remaining(expires):
+    remaining = expires - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("LLM request exceeded its deadline.")
+    return remaining
+
+
+def _chunk(line):
+    """Text of one NDJSON line of Ollama's streaming response, or None once it is done."""
+    data = json.loads(line)
+    if "error" in data:
+        raise ValueError(f"Ollama error: {data['error']}")
+    if data.get("done"):
+        return None
+    return data.get("response", "")
+
+
+class PooledOllama(LLM):
+    """Ollama's ``/api/generate`` over pooled connections, behind ``GenerationSlots``."""
+
+    model: str = LLM_MODEL
+    base_url: str = OLLAMA_URL
+    keep_alive: str = KEEP_ALIVE
+    deadline: float = LLM_DEADLINE_SECONDS
+    pool_size: int = LLM_POOL_SIZE
+    options: Dict[str, Any] = Field(default_factory=dict)
+    slots: Any = Field(default_factory=GenerationSlots)
+
+    _session: Any = PrivateAttr(default=None)
+    _async_sessions: Any = PrivateAttr(default_factory=weakref.WeakKeyDictionary)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "ollama-pooled"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model": self.model, "base_url": self.base_url, "options": self.options}
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def _async_session(self):
+        loop = asyncio.get_running_loop()
+        session = self._async_sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            session = self._async_sessions[loop] = aiohttp.ClientSession(connector=connector)
+        return session
+
+    async def aclose(self):
+        """Close the current event loop's connection pool (on server shutdown)."""
+        session = self._async_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def _payload(self, prompt, stop):
+        options = dict(self.options)
+        if stop:
+            options["stop"] = stop
+        return {"model": self.model, "prompt": prompt, "stream": True, "keep_alive": self.keep_alive, "options": options}
+
+    def _stream(
+        self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, deadline: Optional[float] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        expires = time.monotonic() + (deadline or self.deadline)
+        self.slots.acquire(timeout=_remaining(expires))
+        incr("llm_requests")
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/generate",
+                json=self._payload(prompt, stop),
+                stream=True,
+                timeout=(CONNECT_TIMEOUT_SECONDS, _remaining(expires)),
+            )
+            with response:
+                if response.status_code != 200:
+                    raise ValueError(f"Ollama call failed with status code {response.status_code}: {response.text}")
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    text = _chunk(line)
+                    if text is None:
+                        break
+                    _remaining(expires)
+                    chunk = GenerationChunk(text=text)
+                    if run_manager:
+                        run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                    yield chunk
+        except TimeoutError:
+            incr("llm_deadline_exceeded")
+            raise
+        except (requests.RequestException, ValueError) as e:
+            # A read timeout while streaming surfaces as a ConnectionError.
+            if isinstance(e, requests.Timeout) or any(isinstance(arg, ReadTimeoutError) for arg in e.args):
+                incr("llm_deadline_exceeded")
+                raise TimeoutError(f"LLM request exceeded its deadline: {e}") from e
+            incr("llm_errors")
+            raise
+        finally:
+            self.slots.release()
+
+    async def _astream(
+        self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, deadline: Optional[float] = None,
+        **kwargs: Any,
+    ):
+        expires = time.monotonic() + (deadline or self.deadline)
+        await self.slots.acquire_async(timeout=_remaining(expires))
+        incr("llm_requests")
+        try:
+            timeout = aiohttp.ClientTimeout(total=_remaining(expires), sock_connect=CONNECT_TIMEOUT_SECONDS)
+            async with self._async_session().post(
+                f"{self.base_url}/api/generate", json=self._payload(prompt, stop), timeout=timeout
+            ) as response:
+                if response.status != 200:
+                    raise ValueError(f"Ollama call failed with status code {response.status}: {await response.text()}")
+                async for line in response.content:
+                    if not line.strip():
+                        continue
+                    text = _chunk(line)
+                    if text is None:
+                        break
+                    _remaining(expires)
+                    chunk = GenerationChunk(text=text)
+                    if run_manager:
+                        await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                    yield chunk
+        except TimeoutError as e:  # also aiohttp's timeouts
+            incr("llm_deadline_exceeded")
+            raise TimeoutError("LLM request exceeded its deadline.") from e
+        except (aiohttp.ClientError, ValueError):
+            incr("llm_errors")
+            raise
+        finally:
+            self.slots.release()
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    async def _acall(
+        self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any
+    ) -> str:
+        return "".join([chunk.text async for chunk in self._astream(prompt, stop, run_manager, **kwargs)])
+
+    def preload(self):
+        """Load the model into Ollama's memory (a request without a prompt) and keep it there."""
+        start = time.perf_counter()
+        response = self.session.post(
+            f"{self.base_url}/api/generate",
+            json={"model": self.model, "keep_alive": self.keep_alive},
+            timeout=(CONNECT_TIMEOUT_SECONDS, self.deadline),
+        )
+        response.raise_for_status()
+        logging.info(f"Ollama model '{self.model}' loaded in {time.perf_counter() - start:.2f}s.")
+
+
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def _preload(llm):
+    try:
+        llm.preload()
+    except requests.RequestException as e:
+        logging.warning(f"Could not preload Ollama model '{llm.model}' from {llm.base_url}: {e}")
+
+
+def get_llm():
+    """Return the process-wide LLM, creating it (and preloading its model) on first use."""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                llm = PooledOllama()
+                if PRELOAD_ON_START:
+                    threading.Thread(target=_preload, args=(llm,), name="llm-preload", daemon=True).start()
+                logging.info(f"Using Ollama model '{llm.model}' at {llm.base_url}, {llm.slots.limit} at a time.")
+                _llm = llm
+    return _llm
+
+
+def register_llm(llm):
+    """Install an already constructed LLM, e.g. a local stand-in for tests or benchmarks."""
+    global _llm
+    with _llm_lock:
+        _llm = llm
+
+
+def _slots_gauge(name):
+    slots = getattr(_llm, "slots", None)
+    return getattr(slots, name, 0) if slots is not None else 0
+
+
+register_gauge("llm_waiting", lambda: _slots_gauge("waiting"))
+register_gauge("llm_active", lambda: _slots_gauge("active"))
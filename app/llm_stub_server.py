@@ -0,0 +1,267 @@
+"""Local stand-in for Ollama's generate API, for offline load tests.
+
+    python llm_stub_server.py --port 11500 --prefill-ms 300 --token-ms 20
+    OLLAMA_HOST=127.0.0.1:11500 python server.py
+
+``POST /api/generate`` answers like Ollama: newline-delimited JSON chunks
+(``{"response": ..., "done": false}``) and a final ``done`` object with the
+timing fields, or one JSON object with ``"stream": false``; a request without
+a prompt only loads the model. The answer is the first words of the prompt's
+context, one per ``--token-ms`` after ``--prefill-ms``. Like Ollama, at most
+``--parallel`` requests generate at once, and a model that was idle for longer
+than the requested ``keep_alive`` is unloaded and costs ``--cold-load-ms``
+on the next request. ``GET /api/tags`` lists the model.
+
+``--load-test N`` starts the stub in-process and sends N prompts through
+``llm_backend.PooledOllama`` from ``--clients`` threads, reporting latency,
+queueing, deadline misses and cold loads after the initial model load::
+
+    python llm_stub_server.py --load-test 200 --clients 16 --concurrency 4 --deadline 5
+"""
+import argparse
+import asyncio
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+from aiohttp import web
+
+from logger import logging
+
+STUB_PORT = 11500
+PREFILL_MS = 200.0
+TOKEN_MS = 20.0
+ANSWER_TOKENS = 40
+COLD_LOAD_MS = 2000.0
+PARALLEL = 4
+DEFAULT_KEEP_ALIVE = "5m"  # Ollama's default
+_DURATION = re.compile(r"(-?\d+(?:\.\d+)?)(ms|s|m|h)?$")
+_UNITS = {"ms": 0.001, "s": 1, None: 1, "m": 60, "h": 3600}
+
+
+def keep_alive_seconds(value):
+    """Seconds a ``keep_alive`` value ("30m", "10s", 300, -1) keeps a model loaded; inf for negative."""
+    match = _DURATION.match(str(value).strip())
+    if match is None:
+        raise ValueError(f"Invalid keep_alive '{value}'.")
+    seconds = float(match.group(1)) * _UNITS[match.group(2)]
+    return float("inf") if seconds < 0 else seconds
+
+
+class StubOllama:
+    """Model residency, generation slots and latency model of the stub."""
+
+    def __init__(self, prefill_ms=PREFILL_MS, token_ms=TOKEN_MS, answer_tokens=ANSWER_TOKENS,
+                 cold_load_ms=COLD_LOAD_MS, parallel=PARALLEL):
+        self.prefill_ms = prefill_ms
+        self.token_ms = token_ms
+        self.answer_tokens = answer_tokens
+        self.cold_load_ms = cold_load_ms
+        self.parallel = parallel
+        self.loaded_until = {}  # model -> time.monotonic() when it is unloaded
+        self.loads = 0
+        self.requests = 0
+        self._slots = None  # both created on the server's event loop
+        self._load_lock = None
+
+    def tokens(self, prompt, limit=None):
+        context = prompt.split("Context:", 1)[-1]
+        words = context.split()[: self.answer_tokens if limit is None or limit < 0 else limit]
+        return [word + " " for word in words] or ["(empty context) "]
+
+    async def ensure_loaded(self, model, keep_alive):
+        """Sleep for a cold load if ``model`` is not resident; returns the load time in seconds."""
+        load = 0.0
+        async with self._load_lock:  # concurrent requests wait for one load
+            if self.loaded_until.get(model, 0.0) < time.monotonic():
+                self.loads += 1
+                load = self.cold_load_ms / 1000
+                await asyncio.sleep(load)
+            self.loaded_until[model] = time.monotonic() + keep_alive_seconds(keep_alive)
+        return load
+
+    async def generate(self, body):
+        """Yield Ollama's response objects for one ``/api/generate`` request body."""
+        model = body.get("model", "")
+        keep_alive = body.get("keep_alive", DEFAULT_KEEP_ALIVE)
+        start = time.perf_counter()
+        async with self._slots:
+            self.requests += 1
+            load = await self.ensure_loaded(model, keep_alive)
+            final = {"model": model, "created_at": _now(), "response": "", "done": True}
+            prompt = body.get("prompt")
+            if not prompt:
+                yield {**final, "done_reason": "load"}
+                return
+            await asyncio.sleep(self.prefill_ms / 1000)
+            prompt_done = time.perf_counter()
+            tokens = self.tokens(prompt, (body.get("options") or {}).get("num_predict"))
+            for token in tokens:
+                await asyncio.sleep(self.token_ms / 1000)
+                yield {"model": model, "created_at": _now(), "response": token, "done": False}
+            end = time.perf_counter()
+        yield {
+            **final,
+            "done_reason": "stop",
+            "total_duration": int((end - start) * 1e9),
+            "load_duration": int(load * 1e9),
+            "prompt_eval_count": len(prompt) // 4,
+            "prompt_eval_duration": int(self.prefill_ms * 1e6),
+            "eval_count": len(tokens),
+            "eval_duration": int((end - prompt_done) * 1e9),
+        }
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+async def handle_generate(request):
+    stub = request.app["stub"]
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        return web.json_response({"error": "invalid JSON body"}, status=400)
+    if not body.get("model"):
+        return web.json_response({"error": "model is required"}, status=400)
+    try:
+        keep_alive_seconds(body.get("keep_alive", DEFAULT_KEEP_ALIVE))
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    if body.get("stream") is False:
+        text, final = "", None
+        async for part in stub.generate(body):
+            text += part["response"]
+            final = part
+        return web.json_response({**final, "response": text})
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    async for part in stub.generate(body):
+        await response.write((json.dumps(part) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def handle_tags(request):
+    stub = request.app["stub"]
+    now = time.monotonic()
+    models = [{"name": model, "model": model} for model, until in stub.loaded_until.items() if until >= now]
+    return web.json_response({"models": models})
+
+
+async def handle_root(request):
+    return web.Response(text="Ollama is running")
+
+
+def create_app(stub=None):
+    app = web.Application()
+    app["stub"] = stub or StubOllama()
+
+    async def create_slots(app):
+        app["stub"]._slots = asyncio.Semaphore(app["stub"].parallel)
+        app["stub"]._load_lock = asyncio.Lock()
+
+    app.on_startup.append(create_slots)
+    app.router.add_post("/api/generate", handle_generate)
+    app.router.add_get("/api/tags", handle_tags)
+    app.router.add_get("/", handle_root)
+    return app
+
+
+def start_in_thread(stub, host="127.0.0.1", port=0):
+    """Serve ``stub`` from a daemon thread; returns its base URL."""
+    ready = threading.Event()
+    address = {}
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(create_app(stub))
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, host, port).start())
+        address["url"] = f"http://{host}:{runner.addresses[0][1]}"
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, name="llm-stub", daemon=True).start()
+    ready.wait()
+    return address["url"]
+
+
+def load_test(stub, requests_count, clients, concurrency, deadline, keep_alive):
+    """Drive ``PooledOllama`` against ``stub`` from ``clients`` threads."""
+    from llm_backend import GenerationSlots, PooledOllama
+    from metrics import counters
+
+    llm = PooledOllama(
+        base_url=start_in_thread(stub), keep_alive=keep_alive, slots=GenerationSlots(concurrency),
+        pool_size=max(concurrency, 1),
+    )
+    prompt = "Context: " + " ".join(f"word{i}" for i in range(stub.answer_tokens)) + "\n\nQuestion: ping?"
+
+    def one(_):
+        start = time.perf_counter()
+        first = None
+        try:
+            for _ in llm.stream(prompt, deadline=deadline):
+                if first is None:
+                    first = time.perf_counter() - start
+        except TimeoutError:
+            return None, None
+        return time.perf_counter() - start, first
+
+    llm.preload()  # as get_llm() does at start-up
+    loads, before = stub.loads, counters()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        t0 = time.perf_counter()
+        results = list(pool.map(one, range(requests_count)))
+        wall = time.perf_counter() - t0
+    after = counters()
+    done = [r for r in results if r[0] is not None]
+    latencies = np.array([r[0] for r in done]) * 1000
+    first = np.array([r[1] for r in done if r[1] is not None]) * 1000
+    return {
+        "requests": requests_count,
+        "completed": len(done),
+        "deadline_misses": requests_count - len(done),
+        "throughput_rps": len(done) / wall,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(done) else None,
+        "p95_ms": float(np.percentile(latencies, 95)) if len(done) else None,
+        "first_token_p50_ms": float(np.percentile(first, 50)) if len(first) else None,
+        "queued": after.get("llm_queued", 0) - before.get("llm_queued", 0),
+        "queue_timeouts": after.get("llm_queue_timeouts", 0) - before.get("llm_queue_timeouts", 0),
+        "cold_loads": stub.loads - loads,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a stand-in for Ollama's generate API with configurable latency.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=STUB_PORT)
+    parser.add_argument("--prefill-ms", type=float, default=PREFILL_MS, help="Delay before the first token.")
+    parser.add_argument("--token-ms", type=float, default=TOKEN_MS, help="Delay per generated token.")
+    parser.add_argument("--tokens", type=int, default=ANSWER_TOKENS, help="Tokens per answer.")
+    parser.add_argument("--cold-load-ms", type=float, default=COLD_LOAD_MS, help="Model load time after keep_alive expires.")
+    parser.add_argument("--parallel", type=int, default=PARALLEL, help="Requests generated at once, like OLLAMA_NUM_PARALLEL.")
+    parser.add_argument("--load-test", type=int, default=0, metavar="N", help="Run N requests through PooledOllama and exit.")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent client threads for --load-test.")
+    parser.add_argument("--concurrency", type=int, default=PARALLEL, help="PooledOllama's generation slots for --load-test.")
+    parser.add_argument("--deadline", type=float, default=30.0, help="Per-request deadline in seconds for --load-test.")
+    parser.add_argument("--keep-alive", default="30m", help="keep_alive sent by --load-test.")
+    args = parser.parse_args()
+
+    stub = StubOllama(args.prefill_ms, args.token_ms, args.tokens, args.cold_load_ms, args.parallel)
+    if args.load_test:
+        result = load_test(stub, args.load_test, args.clients, args.concurrency, args.deadline, args.keep_alive)
+        logging.info(f"LLM load test: {result}")
+        print(json.dumps(result, indent=2))
+    else:
+        logging.info(f"Ollama stub listening on http://{args.host}:{args.port}.")
+        print(f"Ollama stub on http://{args.host}:{args.port} (set OLLAMA_HOST={args.host}:{args.port}).")
+        web.run_app(create_app(stub), host=args.host, port=args.port, print=None)
@@ -1,19 +1,32 @@
-from qa_pipeline import load_rag_chain
+from qa_pipeline import load_rag_chain, stream_answer
+from filters import SearchFilter
+from index_store import get_index_store
+from context_packing import citations
+from embedding_registry import WARM_UP_ON_START, warm_up
+from semantic_cache import get_answer_cache
+from retrieval_cache import get_retrieval_cache
+from metrics import counters, span, write_prometheus
 from logger import logging
 import warnings 
 warnings.filterwarnings("ignore", category=FutureWarning)
 
 def main():
     try:
-        chain = load_rag_chain()
+        with span("cli.startup"):
+            if WARM_UP_ON_START:
+                load_time = warm_up()
+                print(f"Embedding model ready (loaded in {load_time:.2f}s).")
+            chain = load_rag_chain()
     except Exception as e:
         print(f"Failed to load RAG pipeline: {e}")
         logging.error(f"Failed to load RAG pipeline: {e}")
         return
 
-    print("\n Enterprise Copilot is ready. Type your question or 'exit' to quit.")
+    print("\n Enterprise Copilot is ready. Type your question, 'stats' for cache counters, or 'exit' to quit.")
+    print(" Restrict answers with 'filter source=handbook.pdf page=3..10 department=HR'; 'filter off' clears it.")
     logging.info("\n Enterprise Copilot is engaging with user. Everything working fine")
 
+    search_filter = None
     try:
         while True:
             query = input("\n🧑 You: ").strip()
@@ -22,20 +35,58 @@ def main():
             if query.lower() in ("exit", "quit"):
                 print("👋 Exiting. Goodbye!")
                 break
+            if query.lower() == "stats":
+                answer_cache = get_answer_cache()
+                print(f"📊 Retrieval cache: {get_retrieval_cache().stats()}")
+                print(f"📊 Answer cache: {{'hits': {answer_cache.hits}, 'misses': {answer_cache.misses}}}")
+                print(f"📊 Counters: {counters()}")
+                continue
+            if query.lower() == "filter" or query.lower().startswith("filter "):
+                search_filter = set_filter(query[len("filter"):].strip(), search_filter)
+                continue
+
+            with span("cli.query"):
+                source_documents, tokens = stream_answer(
+                    chain, query, cache=get_answer_cache(), search_filter=search_filter
+                )
+                if search_filter and not source_documents:
+                    print(f"\n🔎 No chunks match the filter: {search_filter.describe()}")
 
-            result = chain.invoke({"query": query})
-            answer = result.get('result', 'No answer returned.')
-            print(f"\n🤖 Copilot :\n{answer}\n")
+                # Show citations (source documents) while the answer is generated
+                print("\n📚 Sources:")
+                for doc in source_documents:
+                    for source, page in citations(doc.metadata):
+                        print(f"  - (Source: {source}, Page: {page})")
 
-            # Show citations (source documents)
-            print("📚 Sources:")
-            for doc in result.get('source_documents', []):
-                source = doc.metadata.get("source", "Unknown")
-                page = doc.metadata.get("page", "?")
-                print(f"  - (Source: {source}, Page: {page})")
+                print("\n🤖 Copilot :")
+                for token in tokens:
+                    print(token, end="", flush=True)
+                print("\n")
 
     except KeyboardInterrupt:
         print("\n👋 Interrupted. Exiting...")
+    finally:
+        logging.info(f"Metrics written to '{write_prometheus()}'.")
+
+def set_filter(spec, current):
+    """Handle the ``filter`` command and return the filter now in effect."""
+    if not spec:
+        print(f"🔎 Filter: {current.describe() if current else 'none'}")
+        return current
+    if spec.lower() == "off":
+        print("🔎 Filter cleared.")
+        return None
+    try:
+        search_filter = SearchFilter.parse(spec)
+    except ValueError as e:
+        print(f"⚠️ {e}")
+        return current
+    unknown = [source for source in search_filter.sources if source not in get_index_store().files]
+    if unknown:
+        print(f"⚠️ Not in the index: {', '.join(unknown)}")
+    print(f"🔎 Filter: {search_filter.describe()}")
+    logging.info(f"Search filter set to '{search_filter.describe()}'.")
+    return search_filter
 
 if __name__ == "__main__":
     main()
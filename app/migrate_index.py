@@ -0,0 +1,62 @@
+"""Move the global index to another spec, e.g. scalar-quantized storage.
+
+    python migrate_index.py --spec "SQ8;rescore=40"
+    python migrate_index.py --spec SQfp16 --dry-run
+
+Before rebuilding, the current and target specs are benchmarked on the corpus
+(see ``index_bench.py``) and the memory saved is printed next to the recall
+lost, so a spec can be tried with ``--dry-run`` first. The float32 vectors the
+rescoring pass reads are written to the docstore on disk during the rebuild;
+only the compressed index is held in RAM by query processes.
+"""
+import argparse
+import time
+import warnings
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+from index_bench import run
+from index_specs import index_size_bytes, parse_spec, rescore_depth
+from index_store import get_index_store
+from logger import logging
+
+
+def report(current, target, vectors, n_queries=200, k=4):
+    """Benchmark rows for the current spec, the target without rescoring and the target as given."""
+    specs = [current, parse_spec(target)[0], target] if rescore_depth(target) else [current, target]
+    return run(list(dict.fromkeys(specs)), vectors, n_queries=n_queries, k=k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the global index with another spec, reporting memory against recall.")
+    parser.add_argument("--spec", required=True, help="Target spec, e.g. 'SQfp16', 'SQ8;rescore=40', 'IVF1024,SQ8;nprobe=16,rescore=40'.")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true", help="Only print the report.")
+    args = parser.parse_args()
+
+    store = get_index_store()
+    db = store.load()
+    if db is None:
+        raise SystemExit("No global index found; run ingest.py first.")
+    vectors = store.corpus_vectors()
+    current_mb = index_size_bytes(db.index) / 2**20
+
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, current spec '{store.index_spec}' ({current_mb:.2f} MB)\n")
+    print(f"{'spec':<36} {'recall@' + str(args.k):>9} {'size MB':>9} {'vs Flat':>8} {'p50 ms':>8}")
+    rows = report(store.index_spec, args.spec, vectors, n_queries=args.queries, k=args.k)
+    for row in rows:
+        print(f"{row['spec']:<36} {row['recall']:>9.3f} {row['size_mb']:>9.2f} {row['vs_flat']:>8.2f} {row['p50_ms']:>8.3f}")
+    before, after = rows[0], rows[-1]
+    summary = (
+        f"'{before['spec']}' -> '{after['spec']}': index memory {before['size_mb']:.2f} MB -> {after['size_mb']:.2f} MB "
+        f"({1 - after['size_mb'] / before['size_mb']:.0%} saved), recall@{args.k} {before['recall']:.3f} -> {after['recall']:.3f} "
+        f"({after['recall'] - before['recall']:+.3f})."
+    )
+    print(f"\n{summary}")
+    logging.info(f"Index migration report: {summary}")
+
+    if args.dry_run:
+        raise SystemExit(0)
+    start = time.perf_counter()
+    store.rebuild(args.spec)
+    print(f"Rebuilt the global index as '{args.spec}' in {time.perf_counter() - start:.1f}s.")
@@ -0,0 +1,96 @@
+"""Rerank stage between candidate retrieval and the prompt.
+
+The retriever fetches more candidates than it returns and reduces them to k
+with maximal marginal relevance: each pick trades relevance against cosine
+similarity to the chunks already picked, so overlapping chunks and repeated
+boilerplate do not fill the prompt. Candidate vectors are the ones already
+stored in the index. Relevance is the fused retrieval rank, or the score of an
+optional CPU cross-encoder when ``RERANKER_MODEL`` is set.
+"""
+import threading
+
+import numpy as np
+from logger import logging
+
+MMR_LAMBDA = 0.7  # 1.0 ranks purely by relevance
+RERANK_CANDIDATES = 20
+RERANKER_MODEL = None  # e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+def _unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def mmr(relevance, vectors, k, lambda_=MMR_LAMBDA):
+    """Indices of ``k`` candidates chosen by maximal marginal relevance, in pick order.
+
+    ``relevance`` is higher-is-better on any scale; it is min-max normalized so
+    it weighs against cosine similarity consistently.
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    n = len(relevance)
+    if n == 0:
+        return []
+    span = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / span if span > 0 else np.ones(n, dtype=np.float32)
+    unit = _unit(vectors)
+    similarity = unit @ unit.T
+
+    picked = [int(np.argmax(relevance))]
+    max_similarity = similarity[picked[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[picked[0]] = False
+    while len(picked) < min(k, n):
+        scores = lambda_ * relevance - (1 - lambda_) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return picked
+
+
+def redundancy(vectors):
+    """Mean pairwise cosine similarity of a result set; lower means more diverse."""
+    if len(vectors) < 2:
+        return 0.0
+    unit = _unit(vectors)
+    similarity = unit @ unit.T
+    n = len(unit)
+    return float((similarity.sum() - np.trace(similarity)) / (n * (n - 1)))
+
+
+class CrossEncoderReranker:
+    """Scores (query, chunk) pairs with a sentence-transformers CrossEncoder on CPU.
+
+    Any object with a ``name`` and a ``score(query, texts)`` method returning
+    one higher-is-better float per text can be used in its place.
+    """
+
+    def __init__(self, model_name=RERANKER_MODEL):
+        from sentence_transformers import CrossEncoder
+
+        self.name = model_name
+        self.model = CrossEncoder(model_name, device="cpu")
+        logging.info(f"Loaded reranker '{model_name}'.")
+
+    def score(self, query, texts):
+        return self.model.predict([(query, text) for text in texts])
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """Process-wide cross-encoder, or None when ``RERANKER_MODEL`` is unset."""
+    global _reranker
+    if RERANKER_MODEL is None:
+        return None
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = CrossEncoderReranker(RERANKER_MODEL)
+    return _reranker
@@ -0,0 +1,369 @@
+"""Exact-match cache of retrieval results.
+
+Maps a normalized query string to its query embedding and the ids and scores
+of its top-k hits (vector and BM25 keyword search, fused and reranked), so a
+repeated question (a Streamlit rerun, a pasted duplicate) skips both the query
+embedding and the search. Every entry is tied to the index version it was
+computed against; when ingestion or a removal bumps the version the cache is
+emptied. Filtered queries (see ``filters.py``) are cached under their filter.
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, List
+
+import faiss
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+from embedding_registry import get_cached_embeddings
+from filters import select
+from hybrid_search import CANDIDATES, LEXICAL_WEIGHT, VECTOR_WEIGHT, reciprocal_rank_fusion
+from index_specs import has_exact_storage, rescore_depth
+from index_store import get_index_store
+from metrics import incr, span
+from logger import logging
+from rerank import MMR_LAMBDA, RERANK_CANDIDATES, mmr, redundancy
+
+MAX_ENTRIES = 4096
+
+
+def normalize_query(query):
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class RetrievalCache:
+    """Bounded LRU of ``(query, k, weights, filter) -> (embedding, ids, scores)`` with hit/miss counters."""
+
+    def __init__(self, version_fn, max_entries=MAX_ENTRIES):
+        self.version_fn = version_fn
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+
+    def _sync_version(self):
+        version = self.version_fn()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key):
+        with self._lock:
+            self._sync_version()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                incr("retrieval_cache_misses")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            incr("retrieval_cache_hits")
+            return entry
+
+    def put(self, key, embedding, ids, scores, version):
+        with self._lock:
+            self._sync_version()
+            if version != self._version:
+                return  # the index changed while this search ran
+            self._entries[key] = (embedding, ids, scores)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "index_version": self._version,
+            }
+
+
+class CachedRetriever(BaseRetriever):
+    """Top-k hybrid retriever over the store's published index, backed by a ``RetrievalCache``.
+
+    The index is looked up on every query, so a retriever shared by many
+    sessions picks up hot-swapped indexes without being rebuilt. The best
+    ``candidates`` vector and keyword hits are fused by weighted reciprocal rank,
+    then the top ``rerank_candidates`` are reduced to k by MMR, scored by the
+    optional ``reranker``. A ``search_filter`` restricts both searches to the
+    chunks it selects; use ``model_copy`` to filter without changing a shared retriever.
+    With a ``sharding`` (see ``shards.py``), exhaustive-scan indexes are
+    searched in parallel shards.
+    """
+
+    store: Any
+    cache: Any
+    k: int = 4
+    vector_weight: float = VECTOR_WEIGHT
+    lexical_weight: float = LEXICAL_WEIGHT
+    candidates: int = CANDIDATES
+    mmr_lambda: float = MMR_LAMBDA
+    rerank_candidates: int = RERANK_CANDIDATES
+    reranker: Any = None
+    search_filter: Any = None
+    sharding: Any = None
+
+    def _key(self, query):
+        reranker = getattr(self.reranker, "name", None)
+        return (
+            normalize_query(query), self.k, self.vector_weight, self.lexical_weight, self.mmr_lambda, reranker,
+            self.search_filter or None,
+        )
+
+    def _selection(self, db):
+        """The filter's ``Selection`` in ``db``, or None when unfiltered."""
+        if not self.search_filter:
+            return None
+        return select(self.store, db, self.search_filter)
+
+    def _hybrid(self, db):
+        return self.lexical_weight > 0 and hasattr(db.docstore, "search_lexical")
+
+    def _reranking(self):
+        return self.rerank_candidates > self.k and (self.mmr_lambda < 1 or self.reranker is not None)
+
+    def _fetch_k(self, db):
+        fetch_k = self.k
+        if self._hybrid(db):
+            fetch_k = max(fetch_k, self.candidates)
+        if self._reranking():
+            fetch_k = max(fetch_k, self.rerank_candidates)
+        return fetch_k
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List:
+        key = self._key(query)
+        entry = self.cache.get(key)
+        if entry is not None:
+            with span("retrieval.docstore_fetch", docs=len(entry[1])):
+                docs = self._fetch(self.store.db, entry[1])
+            if docs is not None:
+                return docs
+
+        version = self.cache.version_fn()
+        if entry is not None:
+            embedding = entry[0]
+        else:
+            with span("retrieval.embed_query"):
+                embedding = self.store.db.embedding_function.embed_query(query)
+        return self._search([query], [embedding], [key], version)[0]
+
+    def retrieve_batch(self, queries, vectors):
+        """Top-k documents for many queries, searching the cache misses with one FAISS call.
+
+        ``vectors`` are the queries' embeddings, computed by the caller in one batch.
+        """
+        keys = [self._key(q) for q in queries]
+        results = [None] * len(queries)
+        for i, key in enumerate(keys):
+            entry = self.cache.get(key)
+            if entry is not None:
+                results[i] = self._fetch(self.store.db, entry[1])
+
+        misses = [i for i, docs in enumerate(results) if docs is None]
+        if misses:
+            version = self.cache.version_fn()
+            found = self._search(
+                [queries[i] for i in misses], [vectors[i] for i in misses], [keys[i] for i in misses], version
+            )
+            for i, docs in zip(misses, found):
+                results[i] = docs
+        return results
+
+    def _search(self, queries, vectors, keys, version):
+        """Vector search, keyword fusion and document fetch for each query, caching the ranked ids."""
+        matrix = np.asarray(vectors, dtype=np.float32)
+        for _ in range(2):
+            db = self.store.db
+            selection = self._selection(db)
+            with span("retrieval.faiss_search", queries=len(queries), k=self._fetch_k(db)) as attrs:
+                if selection is not None:
+                    attrs["selected"] = selection.count
+                hits, stored = self._vector_hits(db, matrix, selection)
+            ranked = [self._fuse(db, query, row, selection) for query, row in zip(queries, hits)]
+            if self._reranking():
+                ranked = [self._rerank(db, query, row, vectors) for query, row, vectors in zip(queries, ranked, stored)]
+            else:
+                ranked = [row[:self.k] for row in ranked]
+            if any(row is None for row in ranked):
+                self.store.refresh()
+                continue
+            with span("retrieval.docstore_fetch", docs=sum(len(row) for row in ranked)):
+                results = [self._fetch(db, [_id for _id, _ in row]) for row in ranked]
+            if all(docs is not None for docs in results):
+                break
+            # The snapshot was swapped out mid-search and its removed rows are
+            # already gone from the docstore; the new snapshot is consistent.
+            # If another process removed them, its version is loaded first.
+            self.store.refresh()
+        else:
+            raise ValueError("The index changed twice during one search.")
+
+        for key, vector, row in zip(keys, vectors, ranked):
+            self.cache.put(key, vector, [_id for _id, _ in row], [score for _, score in row], version)
+        return results
+
+    def _vector_hits(self, db, matrix, selection=None):
+        """``[[(id, L2 distance)]]`` for each row of ``matrix``, nearest first.
+
+        When reranking, also ``[{id: stored vector}]`` per row, read back by
+        the same FAISS call; otherwise a list of None. On a quantized index
+        whose spec sets ``rescore``, that many candidates are searched and
+        re-sorted by exact distance first. A ``selection`` is passed to FAISS,
+        which only scores the vectors in it.
+        """
+        if selection is not None and selection.count == 0:
+            return [[] for _ in matrix], [{} for _ in matrix]
+        index, params = selection.search_target(db.index) if selection is not None else (db.index, None)
+        if db._normalize_L2:
+            matrix = matrix.copy()
+            faiss.normalize_L2(matrix)
+        fetch_k = self._fetch_k(db)
+        depth = rescore_depth(self.store.index_spec)
+        rescoring = depth > fetch_k and not has_exact_storage(db.index) and hasattr(db.docstore, "get_vectors")
+        # IVF indexes reconstruct search hits from (list, offset) pairs, which
+        # FAISS cannot combine with a selector; those vectors come from the docstore.
+        reconstruct = self._reranking() and not rescoring and (
+            params is None or faiss.try_extract_index_ivf(index) is None
+        )
+        scores, positions, vectors = self._faiss_search(
+            index, matrix, depth if rescoring else fetch_k, params, reconstruct
+        )
+        if vectors is None:
+            vectors = [None] * len(matrix)
+        hits, stored = [], []
+        for row_scores, row_positions, row_vectors in zip(scores, positions, vectors):
+            row = [(db.index_to_docstore_id[pos], float(score)) for score, pos in zip(row_scores, row_positions) if pos != -1]
+            hits.append(row)
+            if row_vectors is None:
+                stored.append(None)
+            else:
+                stored.append({_id: vector for (_id, _), vector in zip(row, row_vectors[row_positions != -1])})
+        if rescoring:
+            return self._rescore(db, matrix, hits, fetch_k)
+        if self._reranking() and not reconstruct:
+            exact = db.docstore.get_vectors({_id for row in hits for _id, _ in row})
+            stored = [{_id: exact[_id] for _id, _ in row if _id in exact} for row in hits]
+        return hits, stored
+
+    def _faiss_search(self, index, matrix, k, params, reconstruct):
+        """``(distances, positions, vectors or None)`` from one FAISS search, sharded when that pays."""
+        if self.sharding is not None and self.sharding.usable(index, len(matrix)):
+            with span("retrieval.sharded_search", shards=len(self.sharding.ranges(index.ntotal))):
+                return self.sharding.search(index, matrix, k, reconstruct, params.sel if params is not None else None)
+        if reconstruct:
+            return index.search_and_reconstruct(matrix, k, params=params)
+        return index.search(matrix, k, params=params) + (None,)
+
+    def _rescore(self, db, matrix, hits, fetch_k):
+        """Re-sort each row by L2 distance to the float32 vectors in the docstore and keep ``fetch_k``.
+
+        The exact vectors also replace the quantized ones as the stored vectors
+        for reranking. Hits without a stored vector keep their approximate distance.
+        """
+        with span("retrieval.rescore", candidates=sum(len(row) for row in hits)):
+            exact = db.docstore.get_vectors({_id for row in hits for _id, _ in row})
+            rescored, stored = [], []
+            for query, row in zip(matrix, hits):
+                row = sorted(
+                    ((_id, float(np.sum((exact[_id] - query) ** 2)) if _id in exact else distance) for _id, distance in row),
+                    key=lambda hit: hit[1],
+                )[:fetch_k]
+                rescored.append(row)
+                stored.append({_id: exact[_id] for _id, _ in row if _id in exact} if self._reranking() else None)
+        return rescored, stored
+
+    def _fuse(self, db, query, hits, selection=None):
+        """Merge vector hits with BM25 hits into one ranked ``(id, score)`` list, higher first."""
+        if not self._hybrid(db):
+            return [(_id, -distance) for _id, distance in hits]
+        with span("retrieval.lexical_search", k=self.candidates):
+            if selection is not None:
+                # Only ids of the published snapshot are ever selected, which
+                # also rules out rows of unpublished or removed files.
+                lexical = []
+                if selection.count:
+                    lexical = [
+                        _id for _id, _ in db.docstore.search_lexical(query, self.candidates, keep=selection.contains)
+                    ]
+            else:
+                lexical = [_id for _id, _ in db.docstore.search_lexical(query, self.candidates)]
+                # Keyword hits come straight from SQLite, which may already hold rows
+                # of an unpublished transaction or still hold just-removed ones.
+                files = self.store.files.values()
+                ranges = [(entry["start"], entry["end"]) for entry in files]
+                adopted = {_id for entry in files for _id in entry.get("adopted", ())}
+                lexical = [
+                    _id for _id in lexical if _id in adopted or any(start <= int(_id) < end for start, end in ranges)
+                ]
+        return reciprocal_rank_fusion([[_id for _id, _ in hits], lexical], [self.vector_weight, self.lexical_weight])
+
+    def _rerank(self, db, query, ranked, vectors):
+        """Reduce the top ``rerank_candidates`` to k by MMR; None if a candidate's row is gone."""
+        pool = ranked[:self.rerank_candidates]
+        if not pool:
+            return []
+        ids = [_id for _id, _ in pool]
+        with span("retrieval.rerank", candidates=len(ids)) as attrs:
+            missing = [_id for _id in ids if _id not in vectors]
+            docs = None
+            if self.reranker is not None:
+                docs = self._fetch(db, ids)
+                if docs is None:
+                    return None
+            if missing:
+                # Keyword-only hits did not come back from FAISS; their vectors are
+                # read from the chunk embedding cache, not recomputed.
+                texts = self._fetch(db, missing)
+                if texts is None:
+                    return None
+                texts = [doc.page_content for doc in texts]
+                embeddings = get_cached_embeddings()
+                cached = embeddings.get_cached(texts)
+                uncached = [i for i, vector in enumerate(cached) if vector is None]
+                if uncached:
+                    for i, vector in zip(uncached, embeddings.embed_documents([texts[i] for i in uncached])):
+                        cached[i] = vector
+                vectors.update(zip(missing, cached))
+            matrix = np.asarray([vectors[_id] for _id in ids], dtype=np.float32)
+
+            if self.reranker is not None:
+                relevance = np.asarray(self.reranker.score(query, [doc.page_content for doc in docs]), dtype=np.float32)
+            else:
+                relevance = np.asarray([score for _, score in pool], dtype=np.float32)
+            picked = mmr(relevance, matrix, self.k, self.mmr_lambda)
+
+            attrs["redundancy_before"] = redundancy(matrix[np.argsort(-relevance, kind="stable")[:self.k]])
+            attrs["redundancy_after"] = redundancy(matrix[picked])
+        logging.info(
+            f"Reranked {len(ids)} candidates to {len(picked)}: mean pairwise similarity "
+            f"{attrs['redundancy_before']:.3f} -> {attrs['redundancy_after']:.3f}."
+        )
+        return [(ids[i], float(relevance[i])) for i in picked]
+
+    @staticmethod
+    def _fetch(db, ids):
+        """Documents for ``ids`` in order, or None if any row is gone."""
+        docs = db.docstore.get_many(ids)
+        return docs if all(doc is not None for doc in docs) else None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache():
+    """Process-wide retrieval cache, versioned by the global index manifest."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                store = get_index_store()
+                _cache = RetrievalCache(lambda: store.version)
+    return _cache
+
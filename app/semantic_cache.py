@@ -0,0 +1,122 @@
+"""Semantic answer cache in front of the RAG chain.
+
+Questions are embedded and compared by cosine similarity with previously
+answered ones; a close enough match returns the stored answer and source
+documents without retrieval or generation. Entries expire after a TTL, the
+least recently used are evicted past ``max_entries``, and the whole cache is
+dropped whenever the index version changes. An answer is only stored under the
+index version its documents were retrieved from.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from embedding_registry import get_embeddings
+from index_store import get_index_store
+from metrics import incr, span
+from logger import logging
+
+SIMILARITY_THRESHOLD = 0.92
+TTL_SECONDS = 24 * 60 * 60
+MAX_ENTRIES = 1000
+
+
+class SemanticAnswerCache:
+    def __init__(self, embeddings, version_fn, threshold=SIMILARITY_THRESHOLD, ttl=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.version_fn = version_fn
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # query -> (unit vector, answer, source documents, created)
+        self._matrix = None  # stacked vectors of _entries, rebuilt lazily
+        self._version = None
+
+    def embed(self, query):
+        with span("answer_cache.embed_query"):
+            return self.unit(self.embeddings.embed_query(query))
+
+    @staticmethod
+    def unit(vector):
+        """Normalize a raw query embedding for lookup and store."""
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _sync_version(self):
+        version = self.version_fn()
+        if version != self._version:
+            if self._entries:
+                logging.info(f"Index version changed to {version}; dropping {len(self._entries)} cached answers.")
+            self._entries.clear()
+            self._matrix = None
+            self._version = version
+
+    def _expire(self, now):
+        expired = [q for q, entry in self._entries.items() if now - entry[3] > self.ttl]
+        for q in expired:
+            del self._entries[q]
+        if expired:
+            self._matrix = None
+
+    def lookup(self, query, vector=None):
+        """Return ``(answer, source_documents, similarity)`` for a close enough earlier question, else None."""
+        vector = self.embed(query) if vector is None else vector
+        with self._lock:
+            self._sync_version()
+            self._expire(time.time())
+            if not self._entries:
+                self.misses += 1
+                incr("answer_cache_misses")
+                return None
+            if self._matrix is None:
+                self._matrix = np.stack([entry[0] for entry in self._entries.values()])
+            scores = self._matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                incr("answer_cache_misses")
+                return None
+            key = list(self._entries)[best]
+            self._entries.move_to_end(key)
+            self._matrix = None
+            _, answer, source_documents, _ = self._entries[key]
+            self.hits += 1
+        incr("answer_cache_hits")
+        logging.info(f"Semantic cache hit ({scores[best]:.3f}) for '{query}' via '{key}'.")
+        return answer, source_documents, float(scores[best])
+
+    def store(self, query, answer, source_documents, vector=None, version=None):
+        """Cache an answer built from documents retrieved at index ``version`` (default: the current one).
+
+        Skipped if the index changed since, as the answer may cite removed or
+        outdated chunks.
+        """
+        vector = self.embed(query) if vector is None else vector
+        with self._lock:
+            self._sync_version()
+            if version is not None and version != self._version:
+                return  # the index changed while this answer was generated
+            self._entries[query] = (vector, answer, source_documents, time.time())
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Process-wide answer cache, invalidated by the global index version."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                store = get_index_store()
+                _cache = SemanticAnswerCache(get_embeddings(), lambda: store.version)
+    return _cache
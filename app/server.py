@@ -0,0 +1,233 @@
+"""Asyncio HTTP query service for integrations.
+
+    python server.py --port 8000
+
+``POST /query`` takes ``{"query": "...", "stream": false}`` and returns
+``{"answer", "sources", "cached"}``; with ``"stream": true`` the response is
+newline-delimited JSON: a ``sources`` line, one ``token`` line per chunk and a
+final ``done`` line. ``GET /metrics`` serves Prometheus text, ``GET /healthz``
+the index version.
+
+Queries that arrive within ``BATCH_WINDOW_MS`` of each other (up to
+``MAX_BATCH``) are embedded with one model call and searched with one FAISS
+call. Generations go through the pooled LLM backend (``llm_backend.py``),
+which runs at most ``--llm-concurrency`` of them at once and queues the rest;
+a generation that misses its deadline answers 504 (or an ``error`` line when
+streaming).
+"""
+import argparse
+import asyncio
+import json
+import time
+import warnings
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+from aiohttp import web
+from context_packing import citations
+from index_store import get_index_store
+from llm_backend import LLM_CONCURRENCY
+from logger import logging
+from metrics import incr, prometheus_text, record, span
+from qa_pipeline import build_prompt, load_rag_chain
+from semantic_cache import get_answer_cache
+
+BATCH_WINDOW_MS = 10
+MAX_BATCH = 64
+
+
+class QueryBatcher:
+    """Collects concurrent queries and retrieves them together in a worker thread."""
+
+    def __init__(self, retriever, answer_cache=None, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH):
+        self.retriever = retriever
+        self.answer_cache = answer_cache
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = asyncio.Queue()
+
+    async def submit(self, query):
+        """Resolve to ``(cached_answer or None, docs, unit query vector, index version of docs)``."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await loop.run_in_executor(None, self._process, [query for query, _ in batch])
+            except Exception as e:
+                logging.error(f"Retrieval failed for a batch of {len(batch)} queries: {e}")
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue  # the client went away
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _process(self, queries):
+        incr("server_batches")
+        incr("server_batched_queries", len(queries))
+        with span("server.batch", size=len(queries)):
+            with span("server.embed_batch", size=len(queries)):
+                vectors = self.retriever.store.db.embedding_function.embed_documents(queries)
+
+            results = [None] * len(queries)
+            units = [None] * len(queries)
+            version = None
+            if self.answer_cache is not None:
+                version = self.answer_cache.version_fn()  # before retrieval, so a swap during it skips the store
+                for i, (query, vector) in enumerate(zip(queries, vectors)):
+                    units[i] = self.answer_cache.unit(vector)
+                    hit = self.answer_cache.lookup(query, units[i])
+                    if hit is not None:
+                        results[i] = (hit[0], hit[1], units[i], version)
+
+            pending = [i for i, result in enumerate(results) if result is None]
+            if pending:
+                found = self.retriever.retrieve_batch([queries[i] for i in pending], [vectors[i] for i in pending])
+                for i, docs in zip(pending, found):
+                    results[i] = (None, docs, units[i], version)
+        return results
+
+
+class QueryService:
+    def __init__(self, chain, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH, llm_concurrency=LLM_CONCURRENCY):
+        self.chain = chain
+        self.llm = chain.combine_documents_chain.llm_chain.llm
+        self.answer_cache = get_answer_cache()
+        self.batcher = QueryBatcher(chain.retriever, self.answer_cache, window_ms, max_batch)
+        if getattr(self.llm, "slots", None) is not None:
+            self.llm.slots.resize(llm_concurrency)
+
+    async def generate(self, query, docs, vector, version=None):
+        """Stream an answer from the LLM backend, which queues it for a slot.
+
+        The complete answer is cached if the index is still at ``version``,
+        the one ``docs`` were retrieved from.
+        """
+        prompt = build_prompt(self.chain, query, docs)
+        start = time.perf_counter()
+        answer, count = "", 0
+        tokens = self.llm.astream(prompt)
+        try:
+            async for token in tokens:
+                if count == 0:
+                    record("qa.llm_first_token", time.perf_counter() - start)
+                answer += token
+                count += 1
+                yield token
+        finally:
+            await tokens.aclose()  # frees the backend's slot straight away if the client went away
+        incr("llm_tokens_out", count)
+        record("qa.llm_generate", time.perf_counter() - start, tokens=count)
+        if self.answer_cache is not None:
+            self.answer_cache.store(query, answer, docs, vector, version)
+
+
+def _sources(docs):
+    return [{"source": source, "page": page} for doc in docs for source, page in citations(doc.metadata)]
+
+
+async def handle_query(request):
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(text="Request body must be JSON.")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Request body must be a JSON object.")
+    query = str(body.get("query") or "").strip()
+    if not query:
+        raise web.HTTPBadRequest(text="'query' is required.")
+
+    service = request.app["service"]
+    start = time.perf_counter()
+    incr("server_requests")
+    answer, docs, vector, version = await service.batcher.submit(query)
+    cached = answer is not None
+
+    if not body.get("stream"):
+        if not cached:
+            try:
+                answer = "".join([token async for token in service.generate(query, docs, vector, version)])
+            except TimeoutError as e:
+                raise web.HTTPGatewayTimeout(text=str(e))
+        record("server.request", time.perf_counter() - start, cached=cached)
+        return web.json_response({"answer": answer, "sources": _sources(docs), "cached": cached})
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    await response.write((json.dumps({"sources": _sources(docs), "cached": cached}) + "\n").encode("utf-8"))
+    if cached:
+        await response.write((json.dumps({"token": answer}) + "\n").encode("utf-8"))
+    else:
+        tokens = service.generate(query, docs, vector, version)
+        try:
+            async for token in tokens:
+                await response.write((json.dumps({"token": token}) + "\n").encode("utf-8"))
+        except TimeoutError as e:
+            await response.write((json.dumps({"error": str(e)}) + "\n").encode("utf-8"))
+        finally:
+            await tokens.aclose()  # frees the LLM slot if the client disconnected
+    await response.write(b'{"done": true}\n')
+    await response.write_eof()
+    record("server.request", time.perf_counter() - start, cached=cached)
+    return response
+
+
+async def handle_metrics(request):
+    return web.Response(text=prometheus_text(), content_type="text/plain")
+
+
+async def handle_health(request):
+    store = get_index_store()
+    return web.json_response({"status": "ok", "index_version": store.version, "files": len(store.files)})
+
+
+def create_app(chain=None, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH, llm_concurrency=LLM_CONCURRENCY):
+    app = web.Application()
+    app["service"] = QueryService(chain or load_rag_chain(), window_ms, max_batch, llm_concurrency)
+
+    async def start_batcher(app):
+        app["batcher_task"] = asyncio.create_task(app["service"].batcher.run())
+
+    async def stop_batcher(app):
+        app["batcher_task"].cancel()
+        llm = app["service"].llm
+        if hasattr(llm, "aclose"):
+            await llm.aclose()
+
+    app.on_startup.append(start_batcher)
+    app.on_cleanup.append(stop_batcher)
+    app.router.add_post("/query", handle_query)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/healthz", handle_health)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the RAG pipeline over HTTP with micro-batched retrieval.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--window-ms", type=float, default=BATCH_WINDOW_MS, help="How long a batch waits for more queries.")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="Queries embedded and searched per batch.")
+    parser.add_argument("--llm-concurrency", type=int, default=LLM_CONCURRENCY, help="LLM generations allowed at once.")
+    args = parser.parse_args()
+
+    app = create_app(window_ms=args.window_ms, max_batch=args.max_batch, llm_concurrency=args.llm_concurrency)
+    logging.info(f"Query service listening on http://{args.host}:{args.port}.")
+    print(f"Enterprise Copilot API on http://{args.host}:{args.port} (POST /query).")
+    web.run_app(app, host=args.host, port=args.port, print=None)
@@ -0,0 +1,90 @@
+"""Measure single-query latency of sharded search at several thread counts.
+
+Each row searches the same queries one at a time with as many shards as
+threads (see ``shards.py``) and checks that the merged top-k is the unsharded
+one. Speedup is against an unsharded search; it tracks the number of free
+cores until memory bandwidth runs out. Searches go through
+``ShardedSearch.usable`` as the retriever's do, so specs that are not sharded
+(PQ) report one shard and must still return the unsharded top-k.
+
+    python shard_bench.py --synthetic 500000 --threads 1 2 4 8
+    python shard_bench.py --specs SQ8 PQ16 --threads 1 2 4
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from index_bench import corpus_from_index, split_queries
+from index_specs import build_index
+from logger import logging
+from shards import MAX_SHARDED_BATCH, ShardedSearch
+
+
+def latencies_ms(search, queries):
+    search(queries[:1])  # warm-up
+    latencies = []
+    for query in queries:
+        t0 = time.perf_counter()
+        search(query[None, :])
+        latencies.append(time.perf_counter() - t0)
+    return np.array(latencies) * 1000
+
+
+def search(sharded, index, queries, k):
+    """``(distances, positions)``, sharded when ``usable`` as in ``RetrievalCache._faiss_search``."""
+    if sharded.usable(index, len(queries)):
+        return sharded.search(index, queries, k)[:2]
+    return index.search(queries, k)
+
+
+def run(vectors, spec="Flat", threads=(1, 2, 4), n_queries=200, k=20):
+    base, queries = split_queries(np.ascontiguousarray(vectors, dtype=np.float32), n_queries)
+    index = build_index(spec, base)
+    _, expected = index.search(queries, k)
+    baseline = np.percentile(latencies_ms(lambda q: index.search(q, k), queries), 50)
+    rows = []
+    for count in threads:
+        sharded = ShardedSearch(shards=count, threads=count, min_shard_vectors=1)
+        found = np.vstack([
+            search(sharded, index, queries[i:i + MAX_SHARDED_BATCH], k)[1]
+            for i in range(0, len(queries), MAX_SHARDED_BATCH)
+        ])
+        latencies = latencies_ms(lambda q: search(sharded, index, q, k), queries)
+        rows.append({
+            "threads": count,
+            "shards": len(sharded.ranges(index.ntotal)) if sharded.usable(index, 1) else 1,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "speedup": float(baseline / np.percentile(latencies, 50)),
+            "same_topk": bool(np.array_equal(np.sort(found, axis=1), np.sort(expected, axis=1))),
+        })
+    return baseline, rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sharded parallel search against one unsharded scan.")
+    parser.add_argument("--specs", nargs="+", default=["Flat", "SQ8", "PQ16"], help="Index specs, e.g. Flat SQfp16 SQ8 PQ16.")
+    parser.add_argument("--threads", nargs="+", type=int, default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N random vectors instead of the global index.")
+    parser.add_argument("--dim", type=int, default=384, help="Dimension of --synthetic vectors.")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = np.random.default_rng(1).standard_normal((args.synthetic, args.dim)).astype(np.float32)
+    else:
+        vectors = corpus_from_index()
+
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, {os.cpu_count()} CPU(s), top-{args.k}")
+    for spec in args.specs:
+        baseline, rows = run(vectors, spec, args.threads, n_queries=args.queries, k=args.k)
+        print(f"\nspec '{spec}', unsharded p50: {baseline:.3f} ms")
+        print(f"{'threads':>7} {'shards':>7} {'p50 ms':>8} {'p95 ms':>8} {'speedup':>8} {'same top-k':>11}")
+        for row in rows:
+            print(
+                f"{row['threads']:>7} {row['shards']:>7} {row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f} "
+                f"{row['speedup']:>8.2f} {str(row['same_topk']):>11}"
+            )
+            logging.info(f"Shard benchmark ({spec}): {row}")
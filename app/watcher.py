@@ -0,0 +1,175 @@
+"""Keep the global index in step with the data directory.
+
+    python watcher.py [--debounce 2] [--max-wait 30] [--bulk-threshold 8]
+
+Filesystem events on ``data/`` are coalesced per file name and only the
+file's state when the batch is applied counts: many writes to one PDF are one
+change, and a file created and deleted within a batch is no change at all. A
+batch is applied once ``DEBOUNCE_SECONDS`` pass without a new event, or
+``MAX_WAIT_SECONDS`` after its first event, so a sync job dropping hundreds of
+files is ingested in a few large batches. Created or modified PDFs whose hash
+differs from the manifest are ingested (through the bulk pipeline when at least
+``BULK_THRESHOLD`` change at once); deleted PDFs are removed from the index.
+
+Each batch is one index transaction, published and saved once as one new
+version. Query processes poll the manifest and load it without a restart
+(see ``IndexStore.refresh``). On startup the whole directory is reconciled
+against the manifest, covering changes made while the watcher was down.
+"""
+import argparse
+import os
+import threading
+import time
+import warnings
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from index_store import file_hash, get_index_store
+from ingest import DATA_DIR, bulk_ingest, stream_ingest
+from logger import logging
+from metrics import incr, span, write_prometheus
+
+DEBOUNCE_SECONDS = 2.0
+MAX_WAIT_SECONDS = 30.0
+BULK_THRESHOLD = 8
+
+
+class ChangeBatcher:
+    """Collects changed PDF names until the directory has been quiet for ``debounce`` seconds."""
+
+    def __init__(self, debounce=DEBOUNCE_SECONDS, max_wait=MAX_WAIT_SECONDS):
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._pending = set()
+        self._first = self._last = 0.0
+
+    def touch(self, names):
+        with self._cond:
+            now = time.monotonic()
+            if not self._pending:
+                self._first = now
+            self._pending.update(names)
+            self._last = now
+            self._cond.notify()
+
+    def next_batch(self):
+        """Block until a batch is due and return its file names."""
+        with self._cond:
+            while True:
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                due = min(self._last + self.debounce, self._first + self.max_wait)
+                now = time.monotonic()
+                if now >= due:
+                    break
+                self._cond.wait(due - now)
+            batch, self._pending = self._pending, set()
+            return batch
+
+
+class DataDirHandler(FileSystemEventHandler):
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type in ("opened", "closed_no_write"):
+            return
+        paths = [event.src_path] + ([event.dest_path] if event.event_type == "moved" else [])
+        names = [os.path.basename(path) for path in paths if str(path).lower().endswith(".pdf")]
+        if names:
+            incr("watcher_events")
+            self.batcher.touch(names)
+
+
+def apply_changes(names, data_dir=DATA_DIR, bulk_threshold=BULK_THRESHOLD):
+    """Bring the index in line with the current state of ``names`` in ``data_dir``, in one transaction."""
+    store = get_index_store()
+    store.refresh()  # another process may have written since the last batch
+    removed, changed, failed = [], [], []
+    digests = {}
+    start = time.perf_counter()
+    with span("watcher.batch", files=len(names)) as attrs:
+        with store.transaction():
+            for name in sorted(names):
+                path = os.path.join(data_dir, name)
+                try:
+                    digests[name] = file_hash(path)
+                except FileNotFoundError:
+                    if store.remove_file(name, save=False):
+                        removed.append(name)
+                    continue
+                if not store.is_current(name, digests[name]):
+                    changed.append(name)
+
+            bulk = len(changed) >= bulk_threshold
+            if bulk:
+                bulk_ingest([os.path.join(data_dir, name) for name in changed], digests=digests)
+            else:
+                for name in changed:
+                    try:
+                        # Isolated: a failure undoes only this file's changes, so a
+                        # modified file keeps its previously indexed version.
+                        with store.transaction(isolated=True):
+                            stream_ingest(os.path.join(data_dir, name), digest=digests[name], save=False)
+                    except Exception as e:
+                        # Usually a file still being copied; its next write event retries it.
+                        logging.error(f"Failed to ingest '{name}': {e}")
+                        failed.append(name)
+            if removed or changed:
+                store.save()
+        if bulk:
+            # Files the bulk parser could not read keep their previous version, if any, as above.
+            failed = [name for name in changed if not store.is_current(name, digests[name])]
+        attrs.update(removed=len(removed), ingested=len(changed) - len(failed), failed=len(failed))
+
+    incr("watcher_batches")
+    incr("watcher_files_ingested", len(changed) - len(failed))
+    incr("watcher_files_removed", len(removed))
+    if removed or changed:
+        logging.info(
+            f"Watcher batch of {len(names)} file(s): {len(changed) - len(failed)} ingested, {len(removed)} removed, "
+            f"{len(failed)} failed; index version {store.version} in {time.perf_counter() - start:.1f}s."
+        )
+        write_prometheus()
+    return removed, changed, failed
+
+
+def watch(data_dir=DATA_DIR, debounce=DEBOUNCE_SECONDS, max_wait=MAX_WAIT_SECONDS, bulk_threshold=BULK_THRESHOLD):
+    store = get_index_store()
+    store.load()
+    os.makedirs(data_dir, exist_ok=True)
+    batcher = ChangeBatcher(debounce, max_wait)
+    observer = Observer()
+    observer.schedule(DataDirHandler(batcher), data_dir, recursive=False)
+    observer.start()
+    logging.info(f"Watching '{data_dir}' (debounce {debounce}s, max wait {max_wait}s).")
+    print(f"Watching '{data_dir}' for PDF changes. Press Ctrl+C to stop.")
+    try:
+        # Events that arrive during the initial reconcile land in the next batch.
+        existing = {f for f in os.listdir(data_dir) if f.lower().endswith(".pdf")}
+        apply_changes(existing | set(store.files), data_dir, bulk_threshold)
+        while True:
+            names = batcher.next_batch()
+            try:
+                apply_changes(names, data_dir, bulk_threshold)
+            except Exception as e:
+                logging.error(f"Watcher batch of {len(names)} file(s) failed and was rolled back: {e}")
+    except KeyboardInterrupt:
+        print("Stopping watcher.")
+    finally:
+        observer.stop()
+        observer.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest PDFs as they are added to, changed in or removed from the data directory.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS, help="Quiet seconds before a batch is applied.")
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT_SECONDS, help="Longest a change waits while events keep arriving.")
+    parser.add_argument("--bulk-threshold", type=int, default=BULK_THRESHOLD, help="Changed files per batch that switch to bulk ingest.")
+    args = parser.parse_args()
+
+    watch(args.data_dir, args.debounce, args.max_wait, args.bulk_threshold)
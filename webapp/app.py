@@ -4,18 +4,22 @@ import os
 import time
 import logging
 import random
-import shutil
-from ingest import process_pdfs_for_file
-from qa_pipeline import load_all_indexes
+import shlex
+from context_packing import citations
+from conversation_store import get_conversation_store
+from filters import SearchFilter
+from ingest import is_indexed
+from ingest_jobs import ACTIVE, DONE, FAILED, REMOVE, get_ingest_jobs
+from qa_pipeline import load_all_indexes, stream_answer
+from embedding_registry import WARM_UP_ON_START, warm_up
+from index_store import get_index_store
+from semantic_cache import get_answer_cache
+from retrieval_cache import get_retrieval_cache
+from metrics import METRICS_PORT, span, start_metrics_server
 
 import warnings
 warnings.filterwarnings("ignore")
 
-if st.session_state.get("should_rerun", False):
-    st.session_state.should_rerun = False
-    st.rerun()
-
-
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
     page_title="Enterprise Copilot",
@@ -274,6 +278,27 @@ def show_toast(message, type="success"):
     """, unsafe_allow_html=True)
     time.sleep(3)
 
+def render_message(message):
+    """Draw one stored chat message as a bubble"""
+    role = message["role"]
+    icon = "👤" if role == "user" else "🤖"
+    bubble_class = "user-bubble" if role == "user" else "assistant-bubble"
+    st.markdown(f"""
+    <div class="chat-bubble {bubble_class}">
+        <span class="chat-icon">{icon}</span>
+        <div class="bubble-content">{message["content"]}</div>
+    </div>
+    """, unsafe_allow_html=True)
+
+def render_assistant_bubble(placeholder, content):
+    """Draw (or redraw) an assistant chat bubble inside a placeholder"""
+    placeholder.markdown(f"""
+    <div class="chat-bubble assistant-bubble">
+        <span class="chat-icon">🤖</span>
+        <div class="bubble-content">{content}</div>
+    </div>
+    """, unsafe_allow_html=True)
+
 def get_stats():
     """Get processing statistics"""
     data_dir = "data"
@@ -290,34 +315,181 @@ def format_file_size(size_in_bytes):
         size_in_bytes /= 1024.0
     return f"{size_in_bytes:.1f} TB"
 
-def remove_file(file_name):
-    """Remove file from data directory and its corresponding index folder"""
+@st.cache_resource(show_spinner="🔤 Loading embedding model...")
+def warm_up_embeddings():
+    """Load the shared embedding model once per server process"""
+    load_time = warm_up()
+    logging.info(f"Embedding model loaded in {load_time:.2f}s.")
+    return load_time
+
+@st.cache_resource(show_spinner="🧠 Loading knowledge engine...")
+def get_shared_chain():
+    """One RAG chain per server process; every session attaches to it.
+
+    Its retriever reads the index store's published snapshot on each query, so
+    uploads and removals are hot-swapped in without rebuilding the chain."""
+    return load_all_indexes()
+
+CHAT_WINDOW = 20  # messages drawn per page of a conversation
+
+def open_conversation(conversation):
+    """Point this session (and the page URL) at a conversation and load its newest messages"""
+    st.session_state.conversation = conversation
+    st.query_params["c"] = conversation
+    st.session_state.messages = []
+    st.session_state.chat_window = 0
+    show_earlier_messages()
+
+def show_earlier_messages():
+    """Prepend the previous page of the conversation to the messages on screen"""
+    first = st.session_state.messages[0]["id"] if st.session_state.messages else None
+    page = get_conversation_store().recent(st.session_state.conversation, CHAT_WINDOW + 1, before=first)
+    st.session_state.has_earlier = len(page) > CHAT_WINDOW
+    st.session_state.messages = page[-CHAT_WINDOW:] + st.session_state.messages
+    st.session_state.chat_window += CHAT_WINDOW
+
+def add_message(role, content):
+    """Append a message to the stored conversation and to the window on screen, dropping its oldest if full"""
+    message = get_conversation_store().append(st.session_state.conversation, role, content)
+    st.session_state.messages.append(message)
+    if len(st.session_state.messages) > st.session_state.chat_window:
+        del st.session_state.messages[0]
+        st.session_state.has_earlier = True
+    return message
+
+JOB_POLL_SECONDS = 2
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def ingest_job_status():
+    """Poll the background ingest jobs; reruns only this panel until a job finishes."""
+    jobs = get_ingest_jobs().jobs()
+    if not jobs:
+        return
+    st.markdown("**⚙️ Indexing jobs**")
+    for job in jobs:
+        if job["action"] == REMOVE and job["status"] in ACTIVE:
+            st.caption(f"🗑️ {job['file']} · {job['status']}")
+        elif job["action"] == REMOVE and job["status"] == DONE:
+            st.caption(f"🗑️ {job['file']}: removed")
+        elif job["status"] in ACTIVE:
+            st.progress(int(job["progress"]), text=f"{job['file']} · {job['status']} ({job['progress']:.0f}%)")
+        elif job["status"] == FAILED:
+            st.caption(f"❌ {job['file']}: {job['error']}")
+        else:
+            st.caption(f"✅ {job['file']}: {job['pages']} pages, {job['chunks']} chunks")
+    if not any(job["status"] in ACTIVE for job in jobs) and st.button("Clear finished jobs", key="clear_jobs"):
+        get_ingest_jobs().clear_finished()
+        st.rerun()
+
+    # Newly indexed or removed documents are already swapped into the shared
+    # index; a full rerun attaches sessions that had no chain yet and refreshes the file list.
+    finished = {job["id"] for job in jobs if job["status"] == DONE}
+    if finished - st.session_state.seen_jobs:
+        st.session_state.seen_jobs |= finished
+        try:
+            st.session_state.rag_chain = get_shared_chain()
+            st.session_state.processed = True
+        except Exception as e:
+            logging.error(f"Failed to load RAG chain: {e}")
+        st.rerun()
+
+def search_filter_controls():
+    """Sidebar inputs that restrict answers to some documents, pages or metadata values."""
+    indexed = sorted(get_index_store().files)
+    if "filter_sources" in st.session_state:
+        # Drop documents removed since they were picked.
+        st.session_state.filter_sources = [f for f in st.session_state.filter_sources if f in indexed]
+    documents = st.multiselect("Documents", indexed, key="filter_sources", placeholder="All documents")
+    pages = st.text_input("Pages", key="filter_pages", placeholder="e.g. 5 or 3..10").strip()
+    fields = st.text_input("Metadata", key="filter_fields", placeholder="e.g. department=HR creationdate=2024-01-01..")
+    terms = [shlex.quote("source=" + ",".join(documents))] if documents else []
+    if pages:
+        terms.append(shlex.quote("page=" + pages))
     try:
-        # Remove from data directory
-        data_file_path = os.path.join("data", file_name)
-        if os.path.exists(data_file_path):
-            os.remove(data_file_path)
-        
-        # Remove corresponding index folder (assuming it's named after the file without extension)
-        file_base_name = os.path.splitext(file_name)[0]
-        index_folder_path = os.path.join("index", file_base_name)
-        if os.path.exists(index_folder_path):
-            shutil.rmtree(index_folder_path)
-            
-        return True
+        search_filter = SearchFilter.parse(" ".join(terms + [fields]))
+    except ValueError as e:
+        st.caption(f"⚠️ {e}")
+        return None
+    if search_filter:
+        st.caption(f"🔎 Answers use only: `{search_filter.describe()}`")
+    return search_filter or None
+
+def answer_question(prompt, search_filter):
+    """Stream the answer to ``prompt`` into a new bubble and store it in the conversation"""
+    thinking_placeholder = st.empty()
+    thinking_placeholder.markdown("""
+    <div class="thinking-animation">
+        <span class="chat-icon">🚀</span>
+        <span>Enterprise Copilot is analyzing...</span>
+    </div>
+    """, unsafe_allow_html=True)
+
+    try:
+        with span("webapp.query"):
+            # Retrieval runs first, so the sources can be shown before the LLM starts
+            sources, tokens = stream_answer(
+                st.session_state.rag_chain, prompt, cache=get_answer_cache(), search_filter=search_filter
+            )
+
+            source_text = ""
+            unique_sources = list(set(source for d in sources for source, _ in citations(d.metadata)))
+            if unique_sources:
+                source_text = "\n\n---\n**Sources:**\n"
+                for doc_path in unique_sources:
+                    source_text += f"- `{os.path.basename(doc_path)}`\n"
+            render_assistant_bubble(thinking_placeholder, "<i>Enterprise Copilot is writing...</i>" + source_text)
+
+            # Write tokens into the bubble as they arrive (redraws throttled to ~20/s)
+            answer = ""
+            last_render = 0.0
+            for token in tokens:
+                answer += token
+                if time.time() - last_render > 0.05:
+                    render_assistant_bubble(thinking_placeholder, answer + "▌" + source_text)
+                    last_render = time.time()
+
+        full_response = (answer or "I couldn't generate a response based on the documents.") + source_text
+        add_message("assistant", full_response)
+        render_assistant_bubble(thinking_placeholder, full_response)
+
     except Exception as e:
-        logging.error(f"Error removing file {file_name}: {e}")
-        return False
+        logging.error(f"Answer generation error: {e}")
+        error_msg = f"Error getting answer: {str(e)}"
+        add_message("assistant", error_msg)
+        render_assistant_bubble(thinking_placeholder, error_msg)
+        show_toast("❌ Failed to get answer", "error")
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """Expose Prometheus metrics for this server process on METRICS_PORT"""
+    try:
+        return start_metrics_server(METRICS_PORT)
+    except OSError as e:
+        logging.warning(f"Metrics endpoint not started on port {METRICS_PORT}: {e}")
+        return None
 
 load_css()
+start_metrics_endpoint()
+if WARM_UP_ON_START:
+    warm_up_embeddings()
 
 # --- SESSION STATE INITIALIZATION ---
 if "rag_chain" not in st.session_state:
     st.session_state.rag_chain = None
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+if "conversation" not in st.session_state:
+    open_conversation(st.query_params.get("c") or get_conversation_store().new_conversation())
 if "processed" not in st.session_state:
     st.session_state.processed = False
+if "seen_jobs" not in st.session_state:
+    st.session_state.seen_jobs = {job["id"] for job in get_ingest_jobs().jobs() if job["status"] == DONE}
+
+# Attach new sessions to the shared chain if documents are already indexed
+if st.session_state.rag_chain is None and get_index_store().files:
+    try:
+        st.session_state.rag_chain = get_shared_chain()
+        st.session_state.processed = True
+    except Exception as e:
+        logging.error(f"Failed to attach to the shared RAG chain: {e}")
 
 # --- SIDEBAR ---
 with st.sidebar:
@@ -341,69 +513,67 @@ with st.sidebar:
     if "processed_files" not in st.session_state:
         st.session_state.processed_files = set()
 
-    # Upload handler
+    # Upload handler: save the files and queue them; indexing runs in the background
     if uploaded_files:
         data_dir = "data"
         os.makedirs(data_dir, exist_ok=True)
         os.makedirs("index", exist_ok=True)
 
-        saved_files = []
-        processed_files = []
+        queued_files = []
         skipped_files = []
         errors = []
 
-        with st.spinner("🧠 Uploading and processing documents..."):
-            for uploaded_file in uploaded_files:
-                safe_filename = uploaded_file.name.replace(" ", "_")
-                file_path = os.path.join(data_dir, safe_filename)
-                index_name = os.path.splitext(safe_filename)[0]
-                index_path = os.path.join("index", index_name)
-
-                # Skip reprocessing in the current session
-                if safe_filename in st.session_state.processed_files:
-                    continue
-
-                try:
-                    # Save file if not already saved
-                    if not os.path.exists(file_path):
-                        with open(file_path, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
-                        saved_files.append(safe_filename)
-
-                    # Check if index already exists
-                    if not os.path.exists(index_path) or force_reprocess:
-                        process_pdfs_for_file(file_path)
-                        processed_files.append(safe_filename)
-                    else:
-                        logging.info(f"⏩ Skipping '{safe_filename}'; already indexed.")
-                        skipped_files.append(safe_filename)
-
-                    # Track that we've handled it
-                    st.session_state.processed_files.add(safe_filename)
-
-                except Exception as e:
-                    logging.error(f"Error processing {safe_filename}: {e}")
-                    errors.append(safe_filename)
-
-            if processed_files or force_reprocess:
-                try:
-                    st.session_state.rag_chain = load_all_indexes()
-                    st.session_state.processed = True
-                except Exception as e:
-                    logging.error(f"Failed to load RAG chain: {e}")
-                    show_toast("❌ Failed to load knowledge engine", "error")
+        for uploaded_file in uploaded_files:
+            safe_filename = uploaded_file.name.replace(" ", "_")
+            file_path = os.path.join(data_dir, safe_filename)
+
+            # Skip reprocessing in the current session
+            if safe_filename in st.session_state.processed_files:
+                continue
+
+            try:
+                # Save file if not already saved
+                if not os.path.exists(file_path):
+                    with open(file_path, "wb") as f:
+                        f.write(uploaded_file.getbuffer())
+
+                # Check the manifest for this exact file content
+                if force_reprocess or not is_indexed(file_path):
+                    with span("webapp.upload", file=safe_filename):
+                        get_ingest_jobs().submit(file_path)
+                    queued_files.append(safe_filename)
+                else:
+                    logging.info(f"⏩ Skipping '{safe_filename}'; already indexed.")
+                    skipped_files.append(safe_filename)
+
+                # Track that we've handled it
+                st.session_state.processed_files.add(safe_filename)
+
+            except Exception as e:
+                logging.error(f"Error queueing {safe_filename}: {e}")
+                errors.append(safe_filename)
 
         # Toasts
-        if processed_files:
-            show_toast(f"✅ Processed {len(processed_files)} new document(s).", "success")
+        if queued_files:
+            show_toast(f"📥 Queued {len(queued_files)} document(s) for indexing.", "success")
         if skipped_files:
             show_toast(f"ℹ️ Skipped {len(skipped_files)} already-processed document(s).", "warning")
         if errors:
-            show_toast(f"❌ Failed to process: {', '.join(errors)}", "error")
+            show_toast(f"❌ Failed to queue: {', '.join(errors)}", "error")
 
-        st.session_state.should_rerun = True
+    ingest_job_status()
 
+    st.markdown("---")
+    st.header("💬 Conversation")
+    st.button(
+        "🆕 New conversation",
+        on_click=lambda: open_conversation(get_conversation_store().new_conversation()),
+        help="Start over; this conversation stays available at its current URL",
+    )
 
+    st.markdown("---")
+    st.header("🔎 Search Filter")
+    search_filter = search_filter_controls()
 
     # Display uploaded files with remove option
     st.markdown("---")
@@ -429,11 +599,9 @@ with st.sidebar:
                 # Using a form to handle the remove action
                 with col2:
                     if st.button("❌", key=f"remove_{file_name}", help="Remove this document"):
-                        if remove_file(file_name):
-                            show_toast(f"🗑️ Removed {file_name}", "success")
-                            st.rerun()
-                        else:
-                            show_toast(f"❌ Failed to remove {file_name}", "error")
+                        # Queued behind any running ingest, which holds the index store's lock.
+                        get_ingest_jobs().remove(file_name)
+                        show_toast(f"🗑️ Removing {file_name}", "success")
         else:
             st.info("No documents uploaded yet")
     else:
@@ -462,35 +630,31 @@ selected = option_menu(
 if selected == "Assistant":
     st.markdown('<div class="main-header"><h1>🚀 Enterprise Copilot</h1><p>Your AI-powered business assistant</p></div>', unsafe_allow_html=True)
 
-    # Chat display
-    chat_placeholder = st.empty()
-    with chat_placeholder.container():
-        st.markdown('<div class="chat-container">', unsafe_allow_html=True)
+    # Chat display: only the newest page of the conversation is drawn
+    chat_area = st.container()
+    with chat_area:
+        if st.session_state.has_earlier:
+            st.button("⬆️ Show earlier messages", on_click=show_earlier_messages)
+        greeting = st.empty()
         if st.session_state.messages:
             for message in st.session_state.messages:
-                role = message["role"]
-                icon = "👤" if role == "user" else "🤖"
-                bubble_class = "user-bubble" if role == "user" else "assistant-bubble"
-                st.markdown(f"""
-                <div class="chat-bubble {bubble_class}">
-                    <span class="chat-icon">{icon}</span>
-                    <div class="bubble-content">{message["content"]}</div>
-                </div>
-                """, unsafe_allow_html=True)
+                render_message(message)
         else:
-            st.markdown(f"""
+            greeting.markdown(f"""
             <div class="chat-bubble assistant-bubble">
                 <span class="chat-icon">🤖</span>
                 <div class="bubble-content">Hello! I'm your Enterprise Copilot. Once you've processed your documents, ask me anything about your company's knowledge base.</div>
             </div>
             """, unsafe_allow_html=True)
-        st.markdown('</div>', unsafe_allow_html=True)
 
-    # Chat input
+    # Chat input: the question and its answer are drawn below the history in
+    # this same run, so a turn costs one script run however long the history is
     if prompt := st.chat_input("💬 Ask me anything about your documents..."):
         if st.session_state.rag_chain:
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            st.rerun()
+            greeting.empty()
+            with chat_area:
+                render_message(add_message("user", prompt))
+                answer_question(prompt, search_filter)
         else:
             show_toast("⚠️ Please process your documents first!", "warning")
 
@@ -499,7 +663,7 @@ elif selected == "Dashboard":
     st.markdown('<div class="main-header"><h1>📊 Enterprise Copilot Dashboard</h1><p>Insights and analytics for your knowledge base</p></div>', unsafe_allow_html=True)
     
     # Stats cards
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
     
     with col1:
         st.markdown(f"""
@@ -512,10 +676,19 @@ elif selected == "Dashboard":
     with col2:
         st.markdown(f"""
         <div class="stat-card">
-            <h3>{len(st.session_state.messages) // 2 if st.session_state.messages else 0}</h3>
+            <h3>{get_conversation_store().count(st.session_state.conversation) // 2}</h3>
             <p>Interactions</p>
         </div>
         """, unsafe_allow_html=True)
+
+    with col3:
+        cache_stats = get_retrieval_cache().stats()
+        st.markdown(f"""
+        <div class="stat-card">
+            <h3>{cache_stats['hit_rate']:.0%}</h3>
+            <p>Retrieval cache hits ({cache_stats['hits']} / {cache_stats['hits'] + cache_stats['misses']})</p>
+        </div>
+        """, unsafe_allow_html=True)
     
     st.markdown("---")
     
@@ -539,43 +712,3 @@ elif selected == "Dashboard":
                 <div style="font-weight:600;">{tech}</div>
             </div>
             """, unsafe_allow_html=True)
-
-# --- RAG RESPONSE HANDLING ---
-if (selected == "Assistant" and 
-    st.session_state.messages and 
-    st.session_state.messages[-1]["role"] == "user" and 
-    st.session_state.rag_chain):
-    
-    prompt = st.session_state.messages[-1]["content"]
-    thinking_placeholder = st.empty()
-    thinking_placeholder.markdown("""
-    <div class="thinking-animation">
-        <span class="chat-icon">🚀</span>
-        <span>Enterprise Copilot is analyzing...</span>
-    </div>
-    """, unsafe_allow_html=True)
-
-    try:
-        response = st.session_state.rag_chain.invoke({"query": prompt})
-        full_response = response.get('result', "I couldn't generate a response based on the documents.")
-
-        sources = response.get('source_documents', [])
-        if sources:
-            unique_sources = list(set(d.metadata.get("source", "Unknown") for d in sources))
-            if unique_sources:
-                source_text = "\n\n---\n**Sources:**\n"
-                for doc_path in unique_sources:
-                    source_text += f"- `{os.path.basename(doc_path)}`\n"
-                full_response += source_text
-
-        st.session_state.messages.append({"role": "assistant", "content": full_response})
-        thinking_placeholder.empty()
-        st.rerun()
-
-    except Exception as e:
-        logging.error(f"Answer generation error: {e}")
-        error_msg = f"Error getting answer: {str(e)}"
-        st.session_state.messages.append({"role": "assistant", "content": error_msg})
-        thinking_placeholder.empty()
-        show_toast("❌ Failed to get answer", "error")
-        st.rerun()
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""Persistent, append-only chat history for the Streamlit assistant.
+
+Messages are rows in a small SQLite database, keyed by conversation id and
+numbered in the order they were written. They are never updated or deleted,
+so a turn costs one insert however long the conversation is, and a page of
+history is one indexed range read::
+
+    store = get_conversation_store()
+    conversation = store.new_conversation()
+    store.append(conversation, "user", "How many leave days do I get?")
+    store.recent(conversation, limit=20)             # newest page, oldest first
+    store.recent(conversation, limit=20, before=41)  # the page before message 41
+
+The app keeps the conversation id in the page URL, so a reload or a bookmark
+reopens the same history.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+CONVERSATIONS_DB = os.path.join("history", "conversations.sqlite")
+_COLUMNS = ("id", "role", "content", "created")
+
+
+class ConversationStore:
+    """Append-only messages of every conversation, shared by all sessions."""
+
+    def __init__(self, path=CONVERSATIONS_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, conversation TEXT NOT NULL,
+                role TEXT NOT NULL, content TEXT NOT NULL, created REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation, id);
+            CREATE TRIGGER IF NOT EXISTS messages_no_update BEFORE UPDATE ON messages
+                BEGIN SELECT RAISE(ABORT, 'messages are append-only'); END;
+            CREATE TRIGGER IF NOT EXISTS messages_no_delete BEFORE DELETE ON messages
+                BEGIN SELECT RAISE(ABORT, 'messages are append-only'); END;
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def new_conversation():
+        return uuid.uuid4().hex
+
+    def append(self, conversation, role, content):
+        """Add a message to the end of ``conversation``; returns it as a dict."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO messages (conversation, role, content, created) VALUES (?, ?, ?, ?)",
+                (conversation, role, content, now),
+            )
+            self._conn.commit()
+        return {"id": cursor.lastrowid, "role": role, "content": content, "created": now}
+
+    def recent(self, conversation, limit, before=None):
+        """Up to ``limit`` messages written before message ``before`` (default: the newest), oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM messages WHERE conversation = ? AND id < ?"
+                " ORDER BY id DESC LIMIT ?",
+                (conversation, before if before is not None else 2**63 - 1, limit),
+            ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in reversed(rows)]
+
+    def count(self, conversation):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages WHERE conversation = ?", (conversation,)).fetchone()[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store():
+    """Return the process-wide conversation store; every Streamlit session shares it."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ConversationStore()
+    return _store
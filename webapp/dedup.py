@@ -0,0 +1,90 @@
+"""Near-duplicate chunk detection with MinHash and LSH.
+
+Chunks are compared as sets of word 3-grams. Each chunk gets a MinHash
+signature of ``NUM_PERM`` values, split into ``BANDS`` bands; chunks that hash
+to the same bucket in any band are candidates, and a candidate is a duplicate
+when the two signatures agree in at least ``DUPLICATE_THRESHOLD`` of their
+positions (an estimate of the Jaccard similarity of the shingle sets).
+
+Repeated headers, footers, disclaimers and copies of the same policy in
+several PDFs are then embedded and stored once. The docstore keeps the
+signatures and band buckets of stored chunks, so duplicates are found across
+files and across ingest runs.
+"""
+import re
+import zlib
+
+import numpy as np
+
+DEDUP_ENABLED = True
+NUM_PERM = 64
+BANDS = 16  # 4 rows per band: pairs above ~0.6 similarity almost always share a bucket
+DUPLICATE_THRESHOLD = 0.85
+SHINGLE_WORDS = 3
+
+_PRIME = 4294967311  # smallest prime above 2**32
+_rng = np.random.RandomState(20240517)  # fixed: signatures are persisted and compared across runs
+_A = _rng.randint(1, 2**31, NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, 2**32, NUM_PERM, dtype=np.int64).astype(np.uint64)
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text):
+    words = _WORD.findall(text.lower())
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))}
+
+
+def minhash(text):
+    """MinHash signature of ``text`` as ``NUM_PERM`` uint64 values."""
+    items = shingles(text)
+    # crc32 rather than hash(): str hashes are salted per process.
+    hashes = np.fromiter((zlib.crc32(item.encode("utf-8")) for item in items), dtype=np.uint64, count=len(items))
+    return ((np.outer(hashes, _A) + _B) % _PRIME).min(axis=0)
+
+
+def band_keys(signature):
+    """One integer bucket key per band; the band number is folded in so bands never collide."""
+    rows = NUM_PERM // BANDS
+    return [(band << 32) | zlib.crc32(signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+
+
+def similarity(first, second):
+    return float(np.mean(first == second))
+
+
+def find_duplicates(signatures, docstore=None, is_live=None):
+    """Match each signature to the chunk it near-duplicates.
+
+    Returns one entry per signature: the id of a stored chunk, the position of
+    an earlier signature in the same list, or None if the chunk is new.
+    ``is_live(id)`` excludes stored chunks that are about to be deleted.
+    """
+    keys = [band_keys(signature) for signature in signatures]
+    stored_buckets, stored = {}, {}
+    if docstore is not None:
+        for key, _id, signature in docstore.minhash_candidates({key for row in keys for key in row}):
+            if is_live is None or is_live(_id):
+                stored_buckets.setdefault(key, []).append(_id)
+                stored[_id] = np.frombuffer(signature, dtype=np.uint64)
+
+    local_buckets = {}
+    matches = []
+    for position, (signature, row) in enumerate(zip(signatures, keys)):
+        match, seen = None, set()
+        for key in row:
+            candidates = [(_id, stored[_id]) for _id in stored_buckets.get(key, ())]
+            candidates += [(other, signatures[other]) for other in local_buckets.get(key, ())]
+            for candidate, other in candidates:
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if similarity(signature, other) >= DUPLICATE_THRESHOLD:
+                    match = candidate
+                    break
+            if match is not None:
+                break
+        matches.append(match)
+        if match is None:
+            for key in row:
+                local_buckets.setdefault(key, []).append(position)
+    return matches
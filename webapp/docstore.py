@@ -0,0 +1,540 @@
+"""Lazily read, SQLite-backed docstore for FAISS indexes.
+
+``FAISS.save_local`` pickles every chunk's text and metadata into
+``index.pkl``, and ``load_local`` unpickles all of it into RAM. This module
+keeps chunks in ``docstore.sqlite`` instead and reads a row only when a search
+returns it, so loading an index costs the FAISS vectors plus the id list.
+
+The same database holds an FTS5 inverted index over the chunk text, kept in
+step with the ``docs`` table by triggers, for BM25 keyword search, the
+MinHash signatures and extra citations used for near-duplicate chunks, a
+float32 copy of every chunk vector, read back to rescore hits from a quantized
+index (see ``index_specs.py``) and to retrain without re-embedding, and an
+index of scalar metadata values for metadata filters (see ``filters.py``).
+
+Convert an existing index in place with::
+
+    python docstore.py to-sqlite index
+    python docstore.py to-pickle index
+
+``index.pkl`` only holds documents, so ``to-pickle`` moves the stored vectors,
+MinHash signatures and near-duplicate citations to ``docstore_extras.sqlite``
+next to it, and ``to-sqlite`` reads them back.
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+import logging
+
+DOCSTORE_FILE = "docstore.sqlite"
+IDS_FILE = "index_ids.json"
+INDEX_FILE = "index.faiss"
+PICKLE_FILE = "index.pkl"
+EXTRAS_FILE = "docstore_extras.sqlite"
+
+# Keep codes like "POL-2024-17" or "SKU_88" as single terms.
+FTS_TOKENIZER = "unicode61 tokenchars '-_'"
+_DF_CACHE_SIZE = 100_000
+# SQLite caps the number of bound parameters per statement.
+_SQL_BATCH = 500
+_TERM = re.compile(r"\w[\w\-]*")
+# Per-chunk tables besides ``docs`` that a pickled docstore cannot hold.
+_CHUNK_TABLES = {
+    "vectors": ("id", "vector"),
+    "minhash": ("id", "signature"),
+    "minhash_bands": ("key", "id"),
+    "citations": ("id", "file", "metadata"),
+}
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Docstore whose documents stay on disk until they are looked up.
+
+    Writes are held in an open transaction until ``commit`` is called, so the
+    owning index can make them durable together with its own files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Query processes keep reading while another process (watcher.py) writes.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._create_fts()
+        self._create_dedup_tables()
+        self._create_field_index()
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS vectors (id TEXT PRIMARY KEY, vector BLOB NOT NULL);
+            CREATE TRIGGER IF NOT EXISTS docs_vectors_delete AFTER DELETE ON docs BEGIN
+                DELETE FROM vectors WHERE id = old.id;
+            END;
+        """)
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+        self._df = {}  # term -> number of chunks containing it; cleared on every write
+
+    def _create_fts(self):
+        exists = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'docs_fts'").fetchone()
+        self._conn.executescript(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+                content, content='docs', content_rowid='rowid', tokenize="{FTS_TOKENIZER}");
+            CREATE TRIGGER IF NOT EXISTS docs_fts_insert AFTER INSERT ON docs BEGIN
+                INSERT INTO docs_fts (rowid, content) VALUES (new.rowid, new.content);
+            END;
+            CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts_vocab USING fts5vocab(docs_fts, 'row');
+            CREATE TRIGGER IF NOT EXISTS docs_fts_delete AFTER DELETE ON docs BEGIN
+                INSERT INTO docs_fts (docs_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+            END;
+        """)
+        if not exists:
+            # Docstores written before the keyword index existed are indexed once here.
+            self._conn.execute("INSERT INTO docs_fts (docs_fts) VALUES ('rebuild')")
+            logging.info(f"Built the keyword index for '{self.path}'.")
+
+    def _create_dedup_tables(self):
+        # A chunk's near-duplicates elsewhere are not stored as documents; each
+        # is a ``citations`` row holding its metadata, pointing at the kept chunk.
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS minhash (id TEXT PRIMARY KEY, signature BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS minhash_bands (key INTEGER NOT NULL, id TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS minhash_bands_key ON minhash_bands (key);
+            CREATE INDEX IF NOT EXISTS minhash_bands_id ON minhash_bands (id);
+            CREATE TABLE IF NOT EXISTS citations (id TEXT NOT NULL, file TEXT NOT NULL, metadata TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS citations_id ON citations (id);
+            CREATE INDEX IF NOT EXISTS citations_file ON citations (file);
+            CREATE TRIGGER IF NOT EXISTS docs_dedup_delete AFTER DELETE ON docs BEGIN
+                DELETE FROM minhash WHERE id = old.id;
+                DELETE FROM minhash_bands WHERE id = old.id;
+                DELETE FROM citations WHERE id = old.id;
+            END;
+        """)
+
+    def _create_field_index(self):
+        # One (id, key, value) row per scalar metadata field, kept in step with ``docs`` by triggers.
+        exists = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'doc_fields'").fetchone()
+        select = (
+            "SELECT {id}, key, value FROM json_each({metadata})"
+            " WHERE type IN ('integer', 'real', 'text') AND key != 'start_index'"
+        )
+        self._conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS doc_fields (id TEXT NOT NULL, key TEXT NOT NULL, value);
+            CREATE INDEX IF NOT EXISTS doc_fields_key_value ON doc_fields (key, value);
+            CREATE INDEX IF NOT EXISTS doc_fields_id ON doc_fields (id);
+            CREATE TRIGGER IF NOT EXISTS docs_fields_insert AFTER INSERT ON docs BEGIN
+                INSERT INTO doc_fields (id, key, value) {select.format(id="new.id", metadata="new.metadata")};
+            END;
+            CREATE TRIGGER IF NOT EXISTS docs_fields_update AFTER UPDATE OF metadata ON docs BEGIN
+                DELETE FROM doc_fields WHERE id = old.id;
+                INSERT INTO doc_fields (id, key, value) {select.format(id="new.id", metadata="new.metadata")};
+            END;
+            CREATE TRIGGER IF NOT EXISTS docs_fields_delete AFTER DELETE ON docs BEGIN
+                DELETE FROM doc_fields WHERE id = old.id;
+            END;
+        """)
+        if not exists:
+            # Docstores written before metadata filters existed are indexed once here.
+            self._conn.execute(
+                "INSERT INTO doc_fields (id, key, value) SELECT docs.id, json_each.key, json_each.value"
+                " FROM docs, json_each(docs.metadata)"
+                " WHERE json_each.type IN ('integer', 'real', 'text') AND json_each.key != 'start_index'"
+            )
+
+    def search(self, search):
+        with self._lock:
+            row = self._conn.execute("SELECT content, metadata FROM docs WHERE id = ?", (search,)).fetchone()
+            cited = self._citations([search]) if row is not None else {}
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=_with_citations(json.loads(row[1]), cited.get(search)))
+
+    def add(self, texts):
+        rows = [(_id, doc.page_content, json.dumps(doc.metadata)) for _id, doc in texts.items()]
+        with self._lock:
+            try:
+                self._conn.executemany("INSERT INTO docs (id, content, metadata) VALUES (?, ?, ?)", rows)
+            except sqlite3.IntegrityError as e:
+                raise ValueError(f"Tried to add ids that already exist: {e}") from e
+            self._count += len(rows)
+            self._df.clear()
+
+    def get_many(self, ids):
+        """Documents for ``ids`` in order, with None for ids that are not stored."""
+        rows = {}
+        with self._lock:
+            for i in range(0, len(ids), _SQL_BATCH):
+                batch = ids[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                for _id, content, metadata in self._conn.execute(
+                    f"SELECT id, content, metadata FROM docs WHERE id IN ({placeholders})", batch
+                ):
+                    rows[_id] = (content, json.loads(metadata))
+            cited = self._citations(list(rows))
+        docs = {
+            _id: Document(id=_id, page_content=content, metadata=_with_citations(metadata, cited.get(_id)))
+            for _id, (content, metadata) in rows.items()
+        }
+        return [docs.get(_id) for _id in ids]
+
+    def _citations(self, ids):
+        """``{id: [(rowid, file, metadata)]}`` of the near-duplicates recorded against ``ids``."""
+        cited = {}
+        for i in range(0, len(ids), _SQL_BATCH):
+            batch = ids[i:i + _SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            for rowid, _id, file, metadata in self._conn.execute(
+                f"SELECT rowid, id, file, metadata FROM citations WHERE id IN ({placeholders}) ORDER BY rowid", batch
+            ):
+                cited.setdefault(_id, []).append((rowid, file, json.loads(metadata)))
+        return cited
+
+    def citations_of(self, ids):
+        with self._lock:
+            return self._citations(list(ids))
+
+    def add_citations(self, rows):
+        """Record ``(id, file, metadata)`` near-duplicates of stored chunks."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO citations (id, file, metadata) VALUES (?, ?, ?)",
+                [(_id, file, json.dumps(metadata)) for _id, file, metadata in rows],
+            )
+
+    def file_citations(self, file):
+        """Row ids of the citations recorded for ``file``'s duplicate chunks."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT rowid FROM citations WHERE file = ?", (file,))]
+
+    def delete_citations(self, rowids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM citations WHERE rowid = ?", [(rowid,) for rowid in rowids])
+
+    def cited_ids(self, files):
+        """Ids of stored chunks that ``files`` have near-duplicates of."""
+        files = list(files)
+        ids = set()
+        with self._lock:
+            for i in range(0, len(files), _SQL_BATCH):
+                batch = files[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                ids.update(row[0] for row in self._conn.execute(
+                    f"SELECT DISTINCT id FROM citations WHERE file IN ({placeholders})", batch
+                ))
+        return ids
+
+    def ids_with_field(self, key, values=None, low=None, high=None):
+        """Ids of chunks whose metadata ``key`` is one of ``values``, or lies in ``[low, high]``.
+
+        A chunk also matches on the metadata of its recorded near-duplicates.
+        """
+        if values is not None:
+            condition, params = f"value IN ({','.join('?' * len(values))})", list(values)
+        else:
+            bounds = [(op, bound) for op, bound in ((">=", low), ("<=", high)) if bound is not None]
+            condition = " AND ".join(f"value {op} ?" for op, _ in bounds) or "value IS NOT NULL"
+            params = [bound for _, bound in bounds]
+        path = '$."' + key.replace('"', '""') + '"'
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id FROM doc_fields WHERE key = ? AND {condition} UNION"
+                f" SELECT id FROM (SELECT id, json_extract(metadata, ?) AS value FROM citations) WHERE {condition}",
+                [key, *params, path, *params],
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def set_metadata(self, _id, metadata):
+        with self._lock:
+            self._conn.execute("UPDATE docs SET metadata = ? WHERE id = ?", (json.dumps(metadata), _id))
+
+    def add_vectors(self, rows):
+        """Store ``(id, vector)`` pairs as float32."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors (id, vector) VALUES (?, ?)",
+                [(_id, np.asarray(vector, dtype=np.float32).tobytes()) for _id, vector in rows],
+            )
+
+    def get_vectors(self, ids):
+        """``{id: float32 vector}`` for the ``ids`` that have a stored vector."""
+        ids = list(ids)
+        found = {}
+        with self._lock:
+            for i in range(0, len(ids), _SQL_BATCH):
+                batch = ids[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                for _id, vector in self._conn.execute(
+                    f"SELECT id, vector FROM vectors WHERE id IN ({placeholders})", batch
+                ):
+                    found[_id] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def add_minhashes(self, rows):
+        """Store ``(id, signature, band keys)`` for chunks later ones are checked against."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO minhash (id, signature) VALUES (?, ?)",
+                [(_id, signature.tobytes()) for _id, signature, _ in rows],
+            )
+            self._conn.executemany(
+                "INSERT INTO minhash_bands (key, id) VALUES (?, ?)",
+                [(key, _id) for _id, _, keys in rows for key in keys],
+            )
+
+    def minhash_candidates(self, keys):
+        """``(key, id, signature)`` for every stored chunk in one of the band buckets ``keys``."""
+        keys = list(keys)
+        rows = []
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows += self._conn.execute(
+                    "SELECT minhash_bands.key, minhash.id, minhash.signature FROM minhash_bands"
+                    f" JOIN minhash ON minhash.id = minhash_bands.id WHERE minhash_bands.key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+        return rows
+
+    def search_lexical(self, query, k, keep=None):
+        """BM25 keyword search; returns up to ``k`` ``(id, score)`` pairs, best first, higher is better.
+
+        With a ``keep(id)`` predicate, matches it rejects are skipped while
+        reading the ranked rows, so a filtered search still returns ``k`` hits.
+        """
+        terms = {term.strip("-") for term in _TERM.findall(query.lower())} - {""}
+        with self._lock:
+            df = self._document_frequencies(terms)
+            # FTS5's BM25 gives terms found in over half of the chunks (nearly)
+            # zero weight, so matching on them would only add rows to score.
+            terms = [term for term in terms if 0 < df[term] <= max(self._count / 2, 1)]
+            if not terms:
+                return []
+            match = " OR ".join(f'"{term}"' for term in terms)
+            sql = (
+                "SELECT docs.id, bm25(docs_fts) AS score FROM docs_fts JOIN docs ON docs.rowid = docs_fts.rowid"
+                " WHERE docs_fts MATCH ? ORDER BY score"
+            )
+            if keep is None:
+                rows = self._conn.execute(sql + " LIMIT ?", (match, k)).fetchall()
+            else:
+                rows = []
+                for _id, score in self._conn.execute(sql, (match,)):
+                    if keep(_id):
+                        rows.append((_id, score))
+                        if len(rows) == k:
+                            break
+        return [(_id, -score) for _id, score in rows]
+
+    def _document_frequencies(self, terms):
+        missing = [term for term in terms if term not in self._df]
+        if missing:
+            if len(self._df) > _DF_CACHE_SIZE:
+                self._df.clear()
+            placeholders = ",".join("?" * len(missing))
+            found = dict(self._conn.execute(
+                f"SELECT term, doc FROM docs_fts_vocab WHERE term IN ({placeholders})", missing
+            ))
+            self._df.update({term: found.get(term, 0) for term in missing})
+        return {term: self._df[term] for term in terms}
+
+    def delete(self, ids):
+        with self._lock:
+            cursor = self._conn.executemany("DELETE FROM docs WHERE id = ?", [(_id,) for _id in ids])
+            self._count -= cursor.rowcount
+            self._df.clear()
+
+    def __len__(self):
+        with self._lock:
+            return self._count
+
+    def iter_documents(self):
+        """Yield ``(id, Document)`` for every stored chunk; used by conversions and rebuilds."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, content, metadata FROM docs").fetchall()
+        for _id, content, metadata in rows:
+            yield _id, Document(id=_id, page_content=content, metadata=json.loads(metadata))
+
+    def export_chunk_tables(self, path):
+        """Copy the ``_CHUNK_TABLES`` rows to a new database at ``path``; returns how many were copied."""
+        copied = 0
+        target = sqlite3.connect(path)
+        try:
+            with self._lock:
+                for table, columns in _CHUNK_TABLES.items():
+                    names = ", ".join(columns)
+                    target.execute(f"CREATE TABLE {table} ({names})")
+                    rows = self._conn.execute(f"SELECT {names} FROM {table} ORDER BY rowid")
+                    cursor = target.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})", rows)
+                    rows.close()  # an open statement would keep the WAL file around after close()
+                    copied += cursor.rowcount
+            target.commit()
+        finally:
+            target.close()
+        return copied
+
+    def import_chunk_tables(self, path):
+        """Add the rows ``export_chunk_tables`` wrote to ``path`` that belong to stored chunks."""
+        source = sqlite3.connect(path)
+        try:
+            with self._lock:
+                for table, columns in _CHUNK_TABLES.items():
+                    id_column = columns.index("id")
+                    rows = source.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid")
+                    self._conn.executemany(
+                        f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join('?' * len(columns))}"
+                        " WHERE EXISTS (SELECT 1 FROM docs WHERE id = ?)",
+                        (row + (row[id_column],) for row in rows),
+                    )
+                    rows.close()
+        finally:
+            source.close()
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def rollback(self):
+        with self._lock:
+            self._conn.rollback()
+        self.refresh()
+
+    def savepoint(self, name):
+        """Mark a point that ``rollback_to`` can return to without losing earlier uncommitted writes."""
+        with self._lock:
+            if not self._conn.in_transaction:
+                # Opened explicitly so releasing the savepoint does not commit.
+                self._conn.execute("BEGIN")
+            self._conn.execute(f"SAVEPOINT {name}")
+
+    def release(self, name):
+        with self._lock:
+            self._conn.execute(f"RELEASE SAVEPOINT {name}")
+
+    def rollback_to(self, name):
+        """Undo the writes made since ``savepoint(name)``; earlier uncommitted ones are kept."""
+        with self._lock:
+            self._conn.execute(f"ROLLBACK TO SAVEPOINT {name}")
+            self._conn.execute(f"RELEASE SAVEPOINT {name}")
+        self.refresh()
+
+    def refresh(self):
+        """Re-read cached counts, e.g. after another process committed changes."""
+        with self._lock:
+            self._count = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            self._df.clear()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _with_citations(metadata, cited):
+    """Add a ``citations`` list of every source/page a deduplicated chunk appears on."""
+    if cited:
+        metadata["citations"] = [{"source": metadata.get("source"), "page": metadata.get("page")}] + [
+            {"source": other.get("source"), "page": other.get("page")} for _, _, other in cited
+        ]
+    return metadata
+
+
+def new_lazy_store(folder, embeddings, dimension):
+    """Create an empty flat FAISS store whose docstore lives in ``folder``."""
+    os.makedirs(folder, exist_ok=True)
+    docstore = SQLiteDocstore(os.path.join(folder, DOCSTORE_FILE))
+    return FAISS(embeddings, faiss.IndexFlatL2(dimension), docstore, {})
+
+
+def save_lazy(db, folder):
+    """Write the FAISS index and id list, then commit the docstore."""
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = os.path.join(folder, INDEX_FILE + ".tmp")
+    faiss.write_index(db.index, tmp_path)
+    os.replace(tmp_path, os.path.join(folder, INDEX_FILE))
+    ids = [db.index_to_docstore_id[i] for i in range(len(db.index_to_docstore_id))]
+    tmp_path = os.path.join(folder, IDS_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    os.replace(tmp_path, os.path.join(folder, IDS_FILE))
+    db.docstore.commit()
+
+
+def load_lazy(folder, embeddings, docstore=None):
+    """Load an index saved by ``save_lazy``; no document text is read.
+
+    Pass the ``docstore`` of an already open copy to reuse its connection.
+    """
+    index = faiss.read_index(os.path.join(folder, INDEX_FILE))
+    with open(os.path.join(folder, IDS_FILE), encoding="utf-8") as f:
+        ids = json.load(f)
+    if docstore is None:
+        docstore = SQLiteDocstore(os.path.join(folder, DOCSTORE_FILE))
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
+
+
+def is_lazy(folder):
+    return os.path.exists(os.path.join(folder, DOCSTORE_FILE)) and os.path.exists(os.path.join(folder, IDS_FILE))
+
+
+def convert_to_sqlite(folder):
+    """Replace ``index.pkl`` in ``folder`` with a SQLite docstore, restoring ``docstore_extras.sqlite`` if present."""
+    db = FAISS.load_local(folder, None, allow_dangerous_deserialization=True)
+    docstore_path = os.path.join(folder, DOCSTORE_FILE)
+    if os.path.exists(docstore_path):
+        os.remove(docstore_path)
+    docstore = SQLiteDocstore(docstore_path)
+    docstore.add({_id: db.docstore.search(_id) for _id in db.index_to_docstore_id.values()})
+    extras_path = os.path.join(folder, EXTRAS_FILE)
+    if os.path.exists(extras_path):
+        docstore.import_chunk_tables(extras_path)
+    db.docstore = docstore
+    save_lazy(db, folder)
+    docstore.close()
+    os.remove(os.path.join(folder, PICKLE_FILE))
+    if os.path.exists(extras_path):
+        os.remove(extras_path)
+    logging.info(f"Converted '{folder}' to a SQLite docstore ({len(db.index_to_docstore_id)} documents).")
+
+
+def convert_to_pickle(folder):
+    """Write the standard ``save_local`` layout back out, for tools that expect ``index.pkl``.
+
+    Rows ``index.pkl`` cannot hold are kept in ``docstore_extras.sqlite`` for ``convert_to_sqlite``.
+    """
+    db = load_lazy(folder, None)
+    lazy_docstore = db.docstore
+    extras_path = os.path.join(folder, EXTRAS_FILE)
+    if os.path.exists(extras_path):
+        os.remove(extras_path)
+    if not lazy_docstore.export_chunk_tables(extras_path):
+        os.remove(extras_path)
+    db.docstore = InMemoryDocstore(dict(lazy_docstore.iter_documents()))
+    db.save_local(folder)
+    lazy_docstore.close()
+    os.remove(os.path.join(folder, DOCSTORE_FILE))
+    os.remove(os.path.join(folder, IDS_FILE))
+    logging.info(f"Converted '{folder}' to a pickled docstore ({len(db.index_to_docstore_id)} documents).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a FAISS index folder between docstore formats.")
+    parser.add_argument("direction", choices=["to-sqlite", "to-pickle"])
+    parser.add_argument("folder", help="Folder containing index.faiss")
+    args = parser.parse_args()
+
+    if args.direction == "to-sqlite":
+        convert_to_sqlite(args.folder)
+    else:
+        convert_to_pickle(args.folder)
+    print(f"Converted '{args.folder}' ({args.direction}).")
@@ -0,0 +1,130 @@
+"""Persistent, content-addressed cache for chunk embeddings.
+
+Vectors are keyed by (embedding model name, SHA-256 of the chunk text) and kept
+in a small SQLite database, so re-indexing an unchanged or lightly edited PDF
+only sends the new chunks through the embedding model.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from metrics import incr, span
+import logging
+
+CACHE_PATH = os.path.join("cache", "embeddings.sqlite")
+MAX_ENTRIES = 500_000
+
+# SQLite caps the number of bound parameters per statement.
+_SQL_BATCH = 500
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model and serves repeated chunk texts from disk.
+
+    Only cache misses reach the wrapped model. Once the cache grows past
+    ``max_entries`` the least recently used vectors are evicted.
+    """
+
+    def __init__(self, embeddings, model_name, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL, PRIMARY KEY (model, hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _lookup(self, hashes):
+        found = {}
+        for i in range(0, len(hashes), _SQL_BATCH):
+            batch = hashes[i:i + _SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                [self.model_name, *batch],
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _evict(self):
+        if self._count <= self.max_entries:
+            return
+        # Trim to 90% so eviction does not run again on the very next insert.
+        excess = self._count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self._count -= excess
+        logging.info(f"Evicted {excess} entries from the embedding cache.")
+
+    def embed_documents(self, texts):
+        hashes = [text_hash(t) for t in texts]
+        with self._lock:
+            found = self._lookup(list(set(hashes)))
+
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            with span("embed.model", chunks=len(missing)):
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            found.update(zip(missing.keys(), vectors))
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [
+                    (self.model_name, key, np.asarray(found[key], dtype=np.float32).tobytes(), now)
+                    for key in missing
+                ],
+            )
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                [(now, self.model_name, key) for key in set(hashes) - missing.keys()],
+            )
+            self._count += len(missing)
+            self._evict()
+            self._conn.commit()
+
+        hits = len(texts) - len(missing)
+        self.hits += hits
+        self.misses += len(missing)
+        incr("embedding_cache_hits", hits)
+        incr("chunks_embedded", len(missing))
+        logging.info(f"Embedding cache: {hits} hit(s), {len(missing)} miss(es) for {len(texts)} chunk(s).")
+        return [found[key] for key in hashes]
+
+    def get_cached(self, texts):
+        """Stored vectors for ``texts`` (None where missing); read-only, recency is not updated."""
+        hashes = [text_hash(t) for t in texts]
+        with self._lock:
+            found = self._lookup(list(set(hashes)))
+        return [found.get(key) for key in hashes]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,69 @@
+"""Process-wide registry of embedding models.
+
+Loading MiniLM weights takes seconds, so every ingestion and query path asks
+this registry for its model instead of constructing ``HuggingFaceEmbeddings``
+itself. Models are loaded lazily, once per process, behind a lock.
+"""
+import threading
+import time
+
+from langchain_huggingface import HuggingFaceEmbeddings
+from embedding_cache import CachedEmbeddings
+import logging
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+WARM_UP_ON_START = True
+
+_lock = threading.Lock()
+_models = {}
+_cached_models = {}
+load_times = {}
+
+
+def get_embeddings(model_name=EMBEDDING_MODEL):
+    """Return the shared embedding model, loading it on first use."""
+    model = _models.get(model_name)
+    if model is None:
+        with _lock:
+            model = _models.get(model_name)
+            if model is None:
+                start = time.perf_counter()
+                model = HuggingFaceEmbeddings(model_name=model_name)
+                load_times[model_name] = time.perf_counter() - start
+                _models[model_name] = model
+                logging.info(f"Loaded embedding model '{model_name}' in {load_times[model_name]:.2f}s.")
+    return model
+
+
+def get_cached_embeddings(model_name=EMBEDDING_MODEL):
+    """Return the shared model wrapped in the on-disk chunk embedding cache."""
+    model = _cached_models.get(model_name)
+    if model is None:
+        base = get_embeddings(model_name)
+        with _lock:
+            model = _cached_models.get(model_name)
+            if model is None:
+                model = CachedEmbeddings(base, model_name)
+                _cached_models[model_name] = model
+    return model
+
+
+def register_embeddings(model_name, model):
+    """Install an already constructed model, e.g. a local stand-in for tests or benchmarks."""
+    with _lock:
+        _models[model_name] = model
+        _cached_models.pop(model_name, None)
+        load_times[model_name] = 0.0
+
+
+def warm_up(model_name=EMBEDDING_MODEL):
+    """Load the model and run one embedding so the first real request is fast.
+
+    Returns the load time of the model in seconds.
+    """
+    already_loaded = model_name in _models
+    start = time.perf_counter()
+    get_embeddings(model_name).embed_query("warm-up")
+    if not already_loaded:
+        logging.info(f"Embedding model '{model_name}' warmed up in {time.perf_counter() - start:.2f}s.")
+    return load_times[model_name]
@@ -0,0 +1,235 @@
+"""Metadata filters for retrieval, applied inside the FAISS search.
+
+A filter restricts a query to some documents, pages or metadata values::
+
+    source=handbook.pdf,travel.pdf page=3..10 department=HR creationdate=2024-01-01..
+
+``source`` names files as listed in the manifest; any other key is matched
+against chunk metadata: the page number, the PDF's own metadata (author,
+creationdate, ...) and fields from ``data/metadata.json`` (see ``ingest.py``).
+``a..b`` is an inclusive range and either end may be left open; comma
+separated values match any of them. Chunks collapsed as near-duplicates match
+on the metadata of every copy.
+
+A filter is resolved once per index snapshot into a bitmap over FAISS
+positions, and searches pass it to FAISS as an ``IDSelector``: vectors outside
+it are skipped during the scan instead of being fetched and dropped
+afterwards, so a selective filter makes the search cheaper, not dearer. A
+source filter is mostly contiguous id ranges from the manifest and often
+becomes a single ``IDSelectorRange``. Approximate indexes switch to an exact
+scan of the selected vectors when a filter selects few of them (see
+``Selection.search_target``). Index types whose search takes no selector (PQ)
+are searched through a small index of just the selected codes instead.
+"""
+import shlex
+import threading
+import weakref
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+from index_specs import accepts_selector
+
+FILTER_CACHE_SIZE = 64  # resolved filters kept per index snapshot
+SOURCE_KEY = "source"
+
+
+def _value(text):
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+
+class SearchFilter:
+    """Sources, exact metadata values and inclusive metadata ranges, all of which must match."""
+
+    def __init__(self, sources=(), equals=None, ranges=None):
+        self.sources = tuple(sorted(set(sources)))
+        self.equals = {key: tuple(values) for key, values in sorted((equals or {}).items())}
+        self.ranges = {key: tuple(bounds) for key, bounds in sorted((ranges or {}).items())}
+
+    @classmethod
+    def parse(cls, text):
+        """Build a filter from ``key=value`` terms; raises ValueError for malformed ones."""
+        sources, equals, ranges = [], {}, {}
+        for term in shlex.split(text):
+            key, _, value = term.partition("=")
+            key = key.strip()
+            if not key or not value:
+                raise ValueError(f"Invalid filter term '{term}'; expected key=value or key=low..high.")
+            if key == SOURCE_KEY:
+                sources += [source for source in value.split(",") if source]
+            elif ".." in value:
+                low, _, high = value.partition("..")
+                ranges[key] = (_value(low) if low else None, _value(high) if high else None)
+            else:
+                equals[key] = tuple(_value(v) for v in value.split(",") if v)
+        return cls(sources, equals, ranges)
+
+    @property
+    def key(self):
+        return self.sources, tuple(self.equals.items()), tuple(self.ranges.items())
+
+    def __eq__(self, other):
+        return isinstance(other, SearchFilter) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __bool__(self):
+        return bool(self.sources or self.equals or self.ranges)
+
+    def describe(self):
+        terms = [shlex.quote(f"{SOURCE_KEY}={','.join(self.sources)}")] if self.sources else []
+        terms += [shlex.quote(f"{key}={','.join(map(str, values))}") for key, values in self.equals.items()]
+        terms += [
+            shlex.quote(f"{key}={'' if low is None else low}..{'' if high is None else high}")
+            for key, (low, high) in self.ranges.items()
+        ]
+        return " ".join(terms)
+
+    def __repr__(self):
+        return f"SearchFilter({self.describe()!r})"
+
+
+class Selection:
+    """The FAISS positions a filter allows in one index snapshot."""
+
+    def __init__(self, mask, ids):
+        self.mask = mask
+        self.count = int(mask.sum())
+        self._ids = ids  # int docstore id per position, ascending
+        self.selector = None
+        self._subset = None
+        positions = np.flatnonzero(mask)
+        if self.count == len(mask) or not self.count:
+            return
+        if positions[-1] - positions[0] + 1 == self.count:
+            self.selector = faiss.IDSelectorRange(int(positions[0]), int(positions[-1]) + 1)
+        else:
+            self._bits = np.packbits(mask, bitorder="little")  # must outlive the selector
+            self.selector = faiss.IDSelectorBitmap(len(self._bits), faiss.swig_ptr(self._bits))
+
+    def search_target(self, index):
+        """``(index, params)`` to search for the selection: ``index`` or its flat storage, with an IDSelector.
+
+        An approximate index is bypassed for an exact scan when the selection
+        holds fewer vectors than a normal search would score: every IVF list
+        is probed, or an HNSW index's flat storage searched instead of its
+        graph. An index whose search takes no selector is swapped for
+        ``subset()``, with None params. ``params`` is None when the selection
+        allows everything; an empty selection has none either, so callers
+        check ``count`` first.
+        """
+        if self.selector is None:
+            return index, None
+        if isinstance(index, faiss.IndexIVF):
+            exhaustive = self.count <= index.nprobe * index.ntotal / index.nlist
+            return index, faiss.SearchParametersIVF(sel=self.selector, nprobe=index.nlist if exhaustive else index.nprobe)
+        if isinstance(index, faiss.IndexHNSW):
+            # Roughly the vectors a graph search visits: efSearch nodes' base-layer neighbours, half of them new.
+            if self.count <= index.hnsw.efSearch * index.hnsw.nb_neighbors(0) / 2:
+                return self._scan_target(faiss.downcast_index(index.storage))
+            return index, faiss.SearchParametersHNSW(sel=self.selector, efSearch=index.hnsw.efSearch)
+        return self._scan_target(index)
+
+    def _scan_target(self, index):
+        if accepts_selector(index):
+            return index, faiss.SearchParameters(sel=self.selector)
+        return self.subset(index), None
+
+    def subset(self, index):
+        """An index of only the selected vectors of ``index``, labelled with their positions.
+
+        Flat-code indexes (PQ, LSH) keep their codes and quantizer, so
+        distances are the ones the full index computes; other types are
+        decoded into a flat index. Built once per selection.
+        """
+        if self._subset is None:
+            positions = np.flatnonzero(self.mask)
+            if isinstance(index, faiss.IndexFlatCodes):
+                empty = faiss.clone_index(index)
+                empty.reset()
+                subset = faiss.IndexIDMap2(empty)
+                codes = faiss.vector_to_array(index.codes).reshape(index.ntotal, index.code_size)
+                subset.add_sa_codes(codes[positions], positions)
+            else:
+                subset = faiss.IndexIDMap2(faiss.IndexFlat(index.d, index.metric_type))
+                subset.add_with_ids(index.reconstruct_batch(positions), positions)
+            self._subset = subset
+        return self._subset
+
+    def contains(self, _id):
+        position = np.searchsorted(self._ids, int(_id))
+        return position < len(self._ids) and self._ids[position] == int(_id) and bool(self.mask[position])
+
+
+class _SnapshotFilters:
+    """Docstore ids by position and an LRU of resolved filters for one index snapshot."""
+
+    def __init__(self, db):
+        id_map = db.index_to_docstore_id
+        # Ids are handed out in increasing order and removals keep the order of
+        # the rest, so this array is sorted and searchsorted maps ids to positions.
+        self.ids = np.fromiter((int(id_map[i]) for i in range(len(id_map))), dtype=np.int64, count=len(id_map))
+        self.selections = OrderedDict()
+
+    def positions(self, ids):
+        ids = np.fromiter((int(_id) for _id in ids), dtype=np.int64)
+        positions = np.searchsorted(self.ids, ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == ids[found]
+        return positions[found]
+
+    def resolve(self, store, db, search_filter):
+        mask = np.ones(len(self.ids), dtype=bool)
+        if search_filter.sources:
+            allowed = np.zeros(len(self.ids), dtype=bool)
+            files = store.files
+            for source in search_filter.sources:
+                entry = files.get(source)
+                if entry is None:
+                    continue
+                start, end = np.searchsorted(self.ids, [entry["start"], entry["end"]])
+                allowed[start:end] = True
+                allowed[self.positions(entry.get("adopted", ()))] = True
+            allowed[self.positions(db.docstore.cited_ids(search_filter.sources))] = True
+            mask &= allowed
+        docstore = db.docstore
+        for key, values in search_filter.equals.items():
+            allowed = np.zeros(len(self.ids), dtype=bool)
+            allowed[self.positions(docstore.ids_with_field(key, values=values))] = True
+            mask &= allowed
+        for key, (low, high) in search_filter.ranges.items():
+            allowed = np.zeros(len(self.ids), dtype=bool)
+            allowed[self.positions(docstore.ids_with_field(key, low=low, high=high))] = True
+            mask &= allowed
+        return Selection(mask, self.ids)
+
+
+_snapshots = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def select(store, db, search_filter):
+    """The ``Selection`` of ``search_filter`` in the snapshot ``db``, cached until the snapshot is replaced."""
+    with _lock:
+        snapshot = _snapshots.get(db)
+        if snapshot is None:
+            snapshot = _snapshots[db] = _SnapshotFilters(db)
+        # The manifest is published just after the index; the version keeps
+        # a filter resolved in between from being reused.
+        key = (store.version, search_filter)
+        selection = snapshot.selections.get(key)
+        if selection is not None:
+            snapshot.selections.move_to_end(key)
+            return selection
+    selection = snapshot.resolve(store, db, search_filter)
+    with _lock:
+        snapshot.selections[key] = selection
+        while len(snapshot.selections) > FILTER_CACHE_SIZE:
+            snapshot.selections.popitem(last=False)
+    return selection
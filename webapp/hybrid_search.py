@@ -0,0 +1,23 @@
+"""Reciprocal rank fusion of vector and BM25 keyword results.
+
+Each ranked list adds ``weight / (RRF_K + rank)`` to a chunk's score, so a
+chunk found by both searches beats one ranked highly by only one of them, and
+L2 distances never have to be made comparable with BM25 scores. The weights
+below are the defaults of ``CachedRetriever``; a lexical weight of 0 turns
+retrieval back into plain vector search.
+"""
+from collections import defaultdict
+
+VECTOR_WEIGHT = 1.0
+LEXICAL_WEIGHT = 1.0
+RRF_K = 60
+CANDIDATES = 20  # hits taken from each search before fusing
+
+
+def reciprocal_rank_fusion(rankings, weights, k=RRF_K):
+    """Fuse ranked id lists; returns ``[(id, score)]`` best first."""
+    scores = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, _id in enumerate(ranking, start=1):
+            scores[_id] += weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
@@ -1,40 +1,94 @@
 # ✅ ingest.py (refactored)
+import json
 import os
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from pypdf import PdfReader
+from index_store import file_hash, get_index_store
+from metrics import incr, span
 
 DATA_DIR = "data"
-INDEX_DIR = "index"
+STREAM_WINDOW_PAGES = 32
+METADATA_FILE = "metadata.json"
 
 
-def load_documents(pdf_path):
-    loader = PyPDFLoader(pdf_path)
-    docs = loader.load()
-    print(f"📄 Loaded {len(docs)} pages from '{pdf_path}'.")
-    return docs
+def file_metadata(pdf_path):
+    """Custom fields for a PDF from ``metadata.json`` beside it, e.g. ``{"handbook.pdf": {"department": "HR"}}``.
+
+    They are stored on every chunk and can be used in search filters (see
+    ``filters.py``); edits take effect when the PDF is next ingested.
+    """
+    path = os.path.join(os.path.dirname(pdf_path), METADATA_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get(os.path.basename(pdf_path), {})
+
+
+def iter_page_windows(pdf_path, window_pages=STREAM_WINDOW_PAGES):
+    """Yield lists of at most ``window_pages`` pages, parsed lazily one page at a time."""
+    extra = file_metadata(pdf_path)
+    window = []
+    for page in PyPDFLoader(pdf_path).lazy_load():
+        page.metadata.update(extra)
+        window.append(page)
+        if len(window) == window_pages:
+            yield window
+            window = []
+    if window:
+        yield window
 
 
 def split_documents(docs, name):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    chunks = splitter.split_documents(docs)
+    with span("ingest.split", file=name) as attrs:
+        splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50, add_start_index=True)
+        chunks = splitter.split_documents(docs)
+        attrs["chunks"] = len(chunks)
+    incr("chunks_split", len(chunks))
     print(f"✂️  Split into {len(chunks)} chunks for '{name}'.")
     return chunks
 
 
-def embed_and_save(chunks, name):
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    db = FAISS.from_documents(chunks, embeddings)
-    out_dir = os.path.join(INDEX_DIR, name)
-    os.makedirs(out_dir, exist_ok=True)
-    db.save_local(out_dir)
-    print(f"✅ Vector index saved to '{out_dir}' as 'index.faiss' and 'index.pkl'.")
+def index_name_for(pdf_path):
+    """Manifest key of an uploaded PDF: its file name with spaces replaced."""
+    return os.path.basename(pdf_path).replace(" ", "_")
+
+
+def is_indexed(pdf_path):
+    """True if the manifest already holds this exact file content."""
+    return get_index_store().is_current(index_name_for(pdf_path), file_hash(pdf_path))
+
 
+def process_pdfs_for_file(pdf_path, progress=None):
+    """Index an uploaded PDF a window of pages at a time, so large manuals never sit in memory whole.
 
-def process_pdfs_for_file(pdf_path):
-    filename = os.path.basename(pdf_path)
-    name = filename.replace(" ", "_").replace(".pdf", "")
-    docs = load_documents(pdf_path)
-    chunks = split_documents(docs, name)
-    embed_and_save(chunks, name)
+    The file becomes searchable once every window is in. ``progress(stage,
+    pages_done, total_pages)`` is called as windows are read ("parsing") and
+    indexed ("embedding"). Returns ``(pages, chunks)``.
+    """
+    name = index_name_for(pdf_path)
+    store = get_index_store()
+    total = len(PdfReader(pdf_path).pages) if progress else 0
+    pages = chunks = 0
+    with span("ingest.file", file=name), store.transaction():
+        store.add_file(name, file_hash(pdf_path), [], save=False)
+        if progress:
+            progress("parsing", 0, total)
+        for window in iter_page_windows(pdf_path):
+            if progress:
+                progress("embedding", pages, total)
+            with span("ingest.window", file=name, pages=len(window)):
+                window_chunks = split_documents(window, name)
+                store.append_chunks(name, window_chunks, save=False)
+            incr("pages_loaded", len(window))
+            pages += len(window)
+            chunks += len(window_chunks)
+            if progress:
+                progress("parsing", pages, total)
+        store.save()
+    duplicates = store.files[name].get("duplicates", 0)
+    print(f"📄 Read {pages} pages from '{pdf_path}'.")
+    print(f"✅ Added {chunks} chunks for '{name}' to the global index in '{store.index_dir}'.")
+    if chunks:
+        print(f"🧬 Skipped {duplicates} near-duplicate chunk(s) ({duplicates / chunks:.1%}).")
+    return pages, chunks
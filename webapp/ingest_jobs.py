@@ -0,0 +1,176 @@
+"""Background ingestion jobs for the Streamlit uploader.
+
+Uploads are queued here instead of being indexed inside the script run, so
+chat stays usable while a large PDF is parsed and embedded. Job state is kept
+in a small SQLite database next to the index, so it outlives reruns, sessions
+and server restarts::
+
+    queued -> parsing <-> embedding -> done | failed
+
+with a per-file progress percentage (pages indexed / pages in the PDF).
+Removing a document is a job on the same workers (``queued -> removing ->
+done | failed``): the index store publishes one transaction at a time, so a
+removal waits for the running ingest there instead of in the script run. Jobs
+that were unfinished when the server stopped are queued again on startup;
+their partial work was never published to the index.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from index_store import INDEX_DIR, get_index_store
+from ingest import index_name_for, process_pdfs_for_file
+from metrics import incr, span
+
+JOBS_DB = os.path.join(INDEX_DIR, "ingest_jobs.sqlite")
+# The index store publishes one file's transaction at a time, so extra
+# workers would only wait on its lock.
+INGEST_WORKERS = 1
+QUEUED, PARSING, EMBEDDING, REMOVING, DONE, FAILED = "queued", "parsing", "embedding", "removing", "done", "failed"
+ACTIVE = (QUEUED, PARSING, EMBEDDING, REMOVING)
+INGEST, REMOVE = "ingest", "remove"
+_COLUMNS = ("id", "file", "path", "action", "status", "progress", "pages", "chunks", "error", "created", "updated")
+
+
+class IngestJobQueue:
+    """Runs ``process_pdfs_for_file`` and document removals on a worker pool and records each job's state."""
+
+    def __init__(self, path=JOBS_DB, workers=INGEST_WORKERS):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, file TEXT NOT NULL, path TEXT NOT NULL,"
+            " status TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0, pages INTEGER NOT NULL DEFAULT 0,"
+            " chunks INTEGER NOT NULL DEFAULT 0, error TEXT, created REAL NOT NULL, updated REAL NOT NULL,"
+            f" action TEXT NOT NULL DEFAULT '{INGEST}')"
+        )
+        if "action" not in {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}:
+            # Job databases written before removals were jobs.
+            self._conn.execute(f"ALTER TABLE jobs ADD COLUMN action TEXT NOT NULL DEFAULT '{INGEST}'")
+        self._conn.commit()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-job")
+        self._resume()
+
+    def _resume(self):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, file, path, action FROM jobs WHERE status IN ({','.join('?' * len(ACTIVE))}) ORDER BY created",
+                ACTIVE,
+            ).fetchall()
+        for job_id, file, pdf_path, action in rows:
+            if action == REMOVE:
+                logging.info(f"Re-queued interrupted removal of '{file}'.")
+                self._update(job_id, status=QUEUED)
+                self._pool.submit(self._remove, job_id, file, pdf_path)
+                continue
+            if not os.path.exists(pdf_path):
+                self._update(job_id, status=FAILED, error="File no longer exists.")
+                continue
+            logging.info(f"Re-queued interrupted ingest job for '{pdf_path}'.")
+            self._update(job_id, status=QUEUED, progress=0, pages=0)
+            self._pool.submit(self._run, job_id, pdf_path)
+
+    def _queue(self, file, pdf_path, action):
+        """Record a queued job; returns ``(job id, True)``, or the id of the same job already queued or running and False."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT id FROM jobs WHERE file = ? AND action = ? AND status IN ({','.join('?' * len(ACTIVE))})",
+                (file, action, *ACTIVE),
+            ).fetchone()
+            if row is not None:
+                return row[0], False
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, file, path, action, status, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, file, pdf_path, action, QUEUED, now, now),
+            )
+            self._conn.commit()
+        return job_id, True
+
+    def submit(self, pdf_path):
+        """Queue ``pdf_path`` for indexing and return the job id; a file already queued or running is not queued twice."""
+        job_id, queued = self._queue(index_name_for(pdf_path), pdf_path, INGEST)
+        if queued:
+            incr("ingest_jobs_queued")
+            self._pool.submit(self._run, job_id, pdf_path)
+        return job_id
+
+    def remove(self, file_name, data_dir="data"):
+        """Queue deleting ``file_name`` from ``data_dir`` and the index, after the jobs before it; returns the job id."""
+        pdf_path = os.path.join(data_dir, file_name)
+        job_id, queued = self._queue(file_name, pdf_path, REMOVE)
+        if queued:
+            incr("remove_jobs_queued")
+            self._pool.submit(self._remove, job_id, file_name, pdf_path)
+        return job_id
+
+    def _run(self, job_id, pdf_path):
+        def progress(stage, pages, total):
+            self._update(job_id, status=stage, pages=pages, progress=100 * pages / total if total else 0)
+
+        self._update(job_id, status=PARSING)
+        try:
+            with span("webapp.ingest_job", file=os.path.basename(pdf_path)):
+                pages, chunks = process_pdfs_for_file(pdf_path, progress=progress)
+        except Exception as e:
+            logging.error(f"Ingest job for '{pdf_path}' failed: {e}")
+            self._update(job_id, status=FAILED, error=str(e))
+            incr("ingest_jobs_failed")
+            return
+        self._update(job_id, status=DONE, progress=100, pages=pages, chunks=chunks)
+        incr("ingest_jobs_done")
+
+    def _remove(self, job_id, file_name, pdf_path):
+        self._update(job_id, status=REMOVING)
+        try:
+            with span("webapp.remove_job", file=file_name):
+                if os.path.exists(pdf_path):
+                    os.remove(pdf_path)
+                # File names are the manifest keys.
+                get_index_store().remove_file(file_name)
+        except Exception as e:
+            logging.error(f"Removing '{file_name}' failed: {e}")
+            self._update(job_id, status=FAILED, error=str(e))
+            return
+        self._update(job_id, status=DONE, progress=100)
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def jobs(self, limit=10):
+        """The most recent jobs, newest first, as dicts."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs ORDER BY created DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def clear_finished(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE status IN (?, ?)", (DONE, FAILED))
+            self._conn.commit()
+
+
+_jobs = None
+_jobs_lock = threading.Lock()
+
+
+def get_ingest_jobs():
+    """Return the process-wide job queue; every Streamlit session shares it."""
+    global _jobs
+    if _jobs is None:
+        with _jobs_lock:
+            if _jobs is None:
+                _jobs = IngestJobQueue()
+    return _jobs
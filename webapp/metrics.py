@@ -0,0 +1,209 @@
+"""Timing spans and counters for the ingest and query paths.
+
+``span("retrieval.faiss_search")`` times a block; spans opened inside it are
+recorded as its children. Every finished span is appended to a JSONL file
+(one object per line, with its parent, trace id and duration), and all spans
+and counters are aggregated for a Prometheus-style text dump, which can also
+be served over HTTP::
+
+    with span("qa.query", query=query):
+        with span("retrieval.faiss_search"):
+            ...
+    incr("chunks_embedded", 128)
+    register_gauge("llm_waiting", lambda: slots.waiting)
+    start_metrics_server(9108)   # GET /metrics
+
+``python metrics.py [metrics.jsonl]`` summarizes a metrics file per span.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import logging
+
+METRICS_ENABLED = True
+METRICS_FILE = os.path.join("Log", "metrics.jsonl")
+PROMETHEUS_FILE = os.path.join("Log", "metrics.prom")
+METRICS_PORT = 9108
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_local = threading.local()
+_counters = defaultdict(float)
+_span_counts = defaultdict(int)
+_span_sums = defaultdict(float)
+_span_buckets = defaultdict(lambda: [0] * len(BUCKETS))
+_gauges = {}
+_file = None
+
+
+def _write(record):
+    global _file
+    with _lock:
+        if _file is None:
+            os.makedirs(os.path.dirname(METRICS_FILE) or ".", exist_ok=True)
+            _file = open(METRICS_FILE, "a", encoding="utf-8")
+        _file.write(json.dumps(record, default=str) + "\n")
+        _file.flush()
+
+
+def _observe(name, seconds):
+    with _lock:
+        _span_counts[name] += 1
+        _span_sums[name] += seconds
+        buckets = _span_buckets[name]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+
+
+def record(name, seconds, **attrs):
+    """Record a duration measured outside a ``span`` block (e.g. across a generator)."""
+    if not METRICS_ENABLED:
+        return
+    stack = getattr(_local, "stack", [])
+    parent = stack[-1] if stack else None
+    _observe(name, seconds)
+    _write({
+        "ts": time.time(),
+        "span": name,
+        "parent": parent["name"] if parent else None,
+        "trace": parent["trace"] if parent else None,
+        "duration_ms": seconds * 1000,
+        **attrs,
+    })
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the enclosed block as a span nested under the current one."""
+    if not METRICS_ENABLED:
+        yield attrs
+        return
+    stack = _local.__dict__.setdefault("stack", [])
+    parent = stack[-1] if stack else None
+    current = {"name": name, "trace": parent["trace"] if parent else uuid.uuid4().hex[:16]}
+    stack.append(current)
+    start = time.perf_counter()
+    try:
+        # Callers may add attributes (result sizes etc.) to the yielded dict.
+        yield attrs
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        _observe(name, seconds)
+        _write({
+            "ts": time.time(),
+            "span": name,
+            "parent": parent["name"] if parent else None,
+            "trace": current["trace"],
+            "depth": len(stack),
+            "duration_ms": seconds * 1000,
+            **attrs,
+        })
+
+
+def incr(name, value=1):
+    if METRICS_ENABLED and value:
+        with _lock:
+            _counters[name] += value
+
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+
+def register_gauge(name, read):
+    """Export ``read()`` as a gauge, read each time the metrics are dumped."""
+    with _lock:
+        _gauges[name] = read
+
+
+def prometheus_text():
+    lines = []
+    with _lock:
+        gauges = dict(_gauges)
+    for name in sorted(gauges):
+        metric = f"copilot_{name}"
+        lines += [f"# TYPE {metric} gauge", f"{metric} {gauges[name]():g}"]
+    with _lock:
+        for name in sorted(_counters):
+            metric = f"copilot_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {_counters[name]:g}"]
+        if _span_counts:
+            lines.append("# TYPE copilot_span_seconds histogram")
+        for name in sorted(_span_counts):
+            for bound, count in zip(BUCKETS, _span_buckets[name]):
+                lines.append(f'copilot_span_seconds_bucket{{span="{name}",le="{bound:g}"}} {count}')
+            lines.append(f'copilot_span_seconds_bucket{{span="{name}",le="+Inf"}} {_span_counts[name]}')
+            lines.append(f'copilot_span_seconds_sum{{span="{name}"}} {_span_sums[name]:.6f}')
+            lines.append(f'copilot_span_seconds_count{{span="{name}"}} {_span_counts[name]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path=PROMETHEUS_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    return path
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT, host="127.0.0.1"):
+    """Serve ``/metrics`` in Prometheus text format from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def summarize(path=METRICS_FILE):
+    """Per-span count and latency percentiles from a metrics JSONL file."""
+    durations = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            durations[entry["span"]].append(entry["duration_ms"])
+    return {
+        name: {
+            "count": len(values),
+            "p50_ms": float(np.percentile(values, 50)),
+            "p95_ms": float(np.percentile(values, 95)),
+            "total_ms": float(np.sum(values)),
+        }
+        for name, values in durations.items()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a metrics JSONL file per span.")
+    parser.add_argument("path", nargs="?", default=METRICS_FILE)
+    args = parser.parse_args()
+
+    summary = summarize(args.path)
+    print(f"{'span':<32} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'total ms':>12}")
+    for name, row in sorted(summary.items(), key=lambda item: -item[1]["total_ms"]):
+        print(f"{name:<32} {row['count']:>7} {row['p50_ms']:>10.2f} {row['p95_ms']:>10.2f} {row['total_ms']:>12.1f}")
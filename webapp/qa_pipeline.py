@@ -1,12 +1,16 @@
 
-import os
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.llms import Ollama
-from langchain.chains import RetrievalQA
+import logging
+import time
+from langchain.chains import LLMChain, RetrievalQA
+from langchain.chains.combine_documents.stuff import StuffDocumentsChain
 from langchain.prompts import PromptTemplate
-
-INDEX_DIR = "index"
+from index_store import get_index_store
+from llm_backend import get_llm
+from retrieval_cache import CachedRetriever, get_retrieval_cache
+from shards import get_sharded_search
+from metrics import incr, record, span
+from rerank import get_reranker
+from context_packing import estimate_tokens, format_context, pack_documents
 
 custom_prompt = PromptTemplate.from_template("""
 You are a helpful AI assistant for internal company knowledge.
@@ -29,37 +33,113 @@ Question: {question}
 Answer: 
 """)
 
-def load_all_indexes():
-    """Load all FAISS indexes from the index directory."""
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    dbs = []
-
-    for name in os.listdir(INDEX_DIR):
-        dir_path = os.path.join(INDEX_DIR, name)
-        if os.path.isdir(dir_path):
-            try:
-                db = FAISS.load_local(dir_path, embeddings, allow_dangerous_deserialization=True)
-                dbs.append(db)
-                print(f"✅ Loaded index from '{dir_path}'")
-            except Exception as e:
-                print(f"⚠️ Skipped '{dir_path}': {e}")
-
-    if not dbs:
-        raise RuntimeError("❌ Failed to load RAG pipeline: No valid FAISS indexes found.")
+class PackedStuffDocumentsChain(StuffDocumentsChain):
+    """The "stuff" step, with the retrieved chunks packed under the context token budget.
+
+    ``chain.invoke`` and ``stream_answer`` therefore send the same prompt.
+    """
+
+    def _get_inputs(self, docs, **kwargs):
+        inputs = super()._get_inputs([], **kwargs)
+        with span("qa.prompt_assembly") as attrs:
+            passages, stats = pack_documents(docs)
+            inputs[self.document_variable_name] = format_context(passages)
+            attrs.update(stats, prompt_tokens=estimate_tokens(self.llm_chain.prompt.format(**inputs)))
+        logging.info(
+            f"Prompt: ~{attrs['prompt_tokens']} tokens, {stats['passages']} passage(s) from {stats['chunks']} chunk(s), "
+            f"{stats['dropped']} over budget."
+        )
+        incr("llm_tokens_in", attrs["prompt_tokens"])
+        return inputs
+
 
-    # Merge all DBs into one
-    merged_db = dbs[0]
-    for db in dbs[1:]:
-        merged_db.merge_from(db)
+def build_qa_chain(retriever, llm):
+    """RetrievalQA over ``retriever`` whose "stuff" step packs the retrieved chunks."""
+    stuff = PackedStuffDocumentsChain(llm_chain=LLMChain(llm=llm, prompt=custom_prompt), document_variable_name="context")
+    return RetrievalQA(combine_documents_chain=stuff, retriever=retriever, return_source_documents=True)
 
-    retriever = merged_db.as_retriever(search_kwargs={"k": 4})
-    llm = Ollama(model="llama3")
 
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=retriever,
-        chain_type="stuff",
-        chain_type_kwargs={"prompt": custom_prompt},
-        return_source_documents=True
+def load_all_indexes():
+    """Load the global FAISS index and build the RAG chain on top of it."""
+    store = get_index_store()
+    db = store.load()
+    # Swap in versions published by the watcher or another ingest process.
+    store.start_refresh_thread()
+    if db is None or db.index.ntotal == 0:
+        raise RuntimeError("❌ Failed to load RAG pipeline: No valid FAISS indexes found.")
+    print(f"✅ Loaded global index with {db.index.ntotal} vectors")
+
+    retriever = CachedRetriever(
+        store=store, cache=get_retrieval_cache(), k=4, reranker=get_reranker(), sharding=get_sharded_search()
     )
+    llm = get_llm()
+
+    qa_chain = build_qa_chain(retriever, llm)
     return qa_chain
+
+
+def stream_answer(chain, query, cache=None, search_filter=None):
+    """Retrieve first, then stream the LLM answer.
+
+    Returns ``(source_documents, tokens)`` so callers can show citations before
+    generation starts; ``tokens`` yields text chunks as Ollama produces them.
+    The prompt is built exactly as the chain's "stuff" step would build it.
+    With a semantic ``cache``, a close enough earlier question is answered from
+    the cache, and a fully streamed new answer is added to it.
+
+    A ``search_filter`` (see ``filters.py``) restricts retrieval to matching
+    chunks. The chain's retriever is shared, so a filtered copy of it is used;
+    the answer cache is bypassed, since its entries do not record a filter.
+    """
+    retriever = chain.retriever
+    if search_filter:
+        retriever = retriever.model_copy(update={"search_filter": search_filter})
+        cache = None
+    vector = version = None
+    if cache is not None:
+        version = cache.version_fn()  # before retrieval, so a swap during it skips the store
+        vector = cache.embed(query)
+        hit = cache.lookup(query, vector)
+        if hit is not None:
+            answer, docs, _ = hit
+            return docs, iter([answer])
+
+    with span("qa.retrieve") as attrs:
+        docs = retriever.invoke(query)
+        attrs["docs"] = len(docs)
+    prompt = build_prompt(chain, query, docs)
+    tokens = _timed(chain.combine_documents_chain.llm_chain.llm.stream(prompt))
+    if cache is not None:
+        tokens = _cache_when_done(tokens, cache, query, docs, vector, version)
+    return docs, tokens
+
+
+def build_prompt(chain, query, docs):
+    """The prompt ``chain`` sends for ``query`` and the retrieved ``docs``, built by its "stuff" step."""
+    stuff = chain.combine_documents_chain
+    return stuff.llm_chain.prompt.format(**stuff._get_inputs(docs, question=query))
+
+
+def _timed(tokens):
+    """Record time to first token and total generation time of an LLM stream.
+
+    Token counts are estimates: prompt characters / 4 in, streamed chunks
+    (about one token each with Ollama) out.
+    """
+    start = time.perf_counter()
+    count = 0
+    for token in tokens:
+        if count == 0:
+            record("qa.llm_first_token", time.perf_counter() - start)
+        count += 1
+        yield token
+    incr("llm_tokens_out", count)
+    record("qa.llm_generate", time.perf_counter() - start, tokens=count)
+
+
+def _cache_when_done(tokens, cache, query, docs, vector, version):
+    answer = ""
+    for token in tokens:
+        answer += token
+        yield token
+    cache.store(query, answer, docs, vector, version)
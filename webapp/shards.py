@@ -0,0 +1,107 @@
+"""Sharded parallel search over the global index.
+
+FAISS parallelises a search over its queries, so a single query against a
+flat or scalar-quantized index is one sequential scan of every vector on one
+core. Here the index's positions are split into ``SEARCH_SHARDS`` contiguous
+ranges, which are groups of consecutive documents since each document's chunks
+occupy one id range (see ``index_store.py``). Each range is searched on a
+thread pool through an ``IDSelectorRange`` (FAISS releases the GIL while it
+searches), and the per-shard hits are merged into the global top-k with a heap.
+
+Shards are views of the published snapshot, not copies: adding or removing a
+document moves the shard boundaries without loading or copying any vectors.
+Graph and inverted-list indexes (HNSW, IVF) already visit only a small part of
+the index per query and are searched whole, as are index types whose search
+takes no ``IDSelector`` (PQ; see ``index_specs.accepts_selector``).
+``shard_bench.py`` measures the latency at each thread count.
+"""
+import heapq
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+from index_specs import accepts_selector
+
+SEARCH_SHARDS = os.cpu_count() or 1
+SEARCH_THREADS = SEARCH_SHARDS
+# Below this many vectors per shard the thread hand-off costs more than the scan saves.
+MIN_SHARD_VECTORS = 10_000
+# FAISS parallelises batches of this many queries or more itself (BLAS).
+MAX_SHARDED_BATCH = 20
+
+
+class ShardedSearch:
+    """Searches exhaustive-scan indexes in ``shards`` position ranges on ``threads`` threads."""
+
+    def __init__(self, shards=SEARCH_SHARDS, threads=SEARCH_THREADS, min_shard_vectors=MIN_SHARD_VECTORS):
+        self.shards = shards
+        self.threads = threads
+        self.min_shard_vectors = min_shard_vectors
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="faiss-shard") if threads > 1 else None
+
+    def ranges(self, ntotal):
+        """``[(start, end)]`` position ranges covering ``0..ntotal``; one range when sharding does not pay."""
+        count = max(1, min(self.shards, ntotal // max(self.min_shard_vectors, 1)))
+        cuts = [ntotal * i // count for i in range(count + 1)]
+        return list(zip(cuts, cuts[1:]))
+
+    def usable(self, index, queries):
+        return (
+            accepts_selector(index)
+            and queries <= MAX_SHARDED_BATCH
+            and len(self.ranges(index.ntotal)) > 1
+        )
+
+    def search(self, index, matrix, k, reconstruct=False, selector=None):
+        """Like ``index.search`` (or ``search_and_reconstruct``), one thread per shard.
+
+        Returns ``(distances, positions, vectors or None)`` with -1 positions
+        padding rows that have fewer than k hits. A ``selector`` (a metadata
+        filter) further restricts every shard.
+        """
+        ranges = self.ranges(index.ntotal)
+
+        def search_shard(bounds):
+            shard = faiss.IDSelectorRange(*bounds)
+            sel = shard if selector is None else faiss.IDSelectorAnd(shard, selector)
+            params = faiss.SearchParameters(sel=sel)
+            if reconstruct:
+                return index.search_and_reconstruct(matrix, k, params=params)
+            return index.search(matrix, k, params=params) + (None,)
+
+        if self._pool is None:
+            results = [search_shard(bounds) for bounds in ranges]
+        else:
+            results = list(self._pool.map(search_shard, ranges))
+
+        distances = np.full((len(matrix), k), np.inf, dtype=np.float32)
+        positions = np.full((len(matrix), k), -1, dtype=np.int64)
+        vectors = np.zeros((len(matrix), k, index.d), dtype=np.float32) if reconstruct else None
+        for row in range(len(matrix)):
+            # Each shard's row is already sorted nearest first.
+            shard_hits = [
+                [(float(d), int(p), shard, col) for col, (d, p) in enumerate(zip(D[row], I[row])) if p != -1]
+                for shard, (D, I, _) in enumerate(results)
+            ]
+            for col, (d, p, shard, shard_col) in enumerate(itertools.islice(heapq.merge(*shard_hits), k)):
+                distances[row, col], positions[row, col] = d, p
+                if reconstruct:
+                    vectors[row, col] = results[shard][2][row, shard_col]
+        return distances, positions, vectors
+
+
+_sharded = None
+_sharded_lock = threading.Lock()
+
+
+def get_sharded_search():
+    """Process-wide sharded search with the module's shard and thread counts."""
+    global _sharded
+    if _sharded is None:
+        with _sharded_lock:
+            if _sharded is None:
+                _sharded = ShardedSearch()
+    return _sharded